@@ -1,13 +1,10 @@
 import os
+import threading
 import tkinter as tk
 from tkinter import filedialog, messagebox
 from PIL import Image, ImageTk
-import subprocess
 
 from project import paths
-from project.chatGPT_API.chatptapi import chat_gpt_api
-from project.classification_pipeline.classifier import IngredientClassifier
-from project.classification_pipeline.clip_model_pipeline.clip_model import ClipModel
 from project.recipe_dataset.filtering import recipe_filtering
 
 
@@ -25,6 +22,7 @@ def filter_recipes3(labels):
     # Normally, this would call your filtering script
     # Example: subprocess.run(['python', 'filter_recipes.py', json.dumps(labels)])
     print(f"Filtering recipes using: {labels}")
+    from project.chatGPT_API.chatptapi import chat_gpt_api  # The OpenAI client is only needed here
     recipe = chat_gpt_api(labels)  # Simulated output
     return labels, recipe  # Simulated output
 
@@ -43,6 +41,12 @@ class RecipeFinderApp(tk.Tk):
         self.labels = []
         self.filtered_recipes = []
 
+        # The models are loaded in the background once the window is shown
+        self.classifier = None
+        self._warmup_error = None
+        self._warmup = threading.Thread(target=self.warm_up, daemon=True)
+        self.after(100, self.start_warm_up)
+
         # Container for frames
         self.container = tk.Frame(self)
         self.container.pack(fill="both", expand=True)
@@ -62,16 +66,42 @@ class RecipeFinderApp(tk.Tk):
         frame = self.frames[frame_class]
         frame.tkraise()
 
+    def start_warm_up(self):
+        if self._warmup.ident is None:
+            self._warmup.start()
+
+    def warm_up(self):
+        """Import the pipeline and load the models, runs in a background thread."""
+        try:
+            from project.classification_pipeline.classifier import IngredientClassifier
+            classifier = IngredientClassifier()
+            classifier.warm_up()
+            self.classifier = classifier
+            print("Models loaded.")
+        except Exception as e:
+            print("Error loading models:", e)
+            self._warmup_error = e
+
+    def wait_for_models(self):
+        """Block until the background warm-up finished, with a busy cursor."""
+        self.start_warm_up()
+        if self._warmup.is_alive():
+            self.config(cursor="watch")
+            self.update_idletasks()
+            self._warmup.join()
+            self.config(cursor="")
+        if self.classifier is None:
+            raise RuntimeError(f"The models could not be loaded: {self._warmup_error}")
+        return self.classifier
+
     def call_yolo_and_cliper(self, images_folder):
         """Call YOLO and CLIP scripts to process the image and extract labels."""
+        image_path = None
         try:
-            # Simulate YOLO script call (replace with actual call)
-            classifier = IngredientClassifier()
-            images, ingreds = classifier.inference(images_folder)
+            classifier = self.wait_for_models()
+            images, ingreds = classifier.inference(images_folder, output_folder=paths.config["annotated_images"])
             if images:
-                for name, image in images.items():
-                    image_path = f"{paths.config["annotated_images"]}/{os.path.basename(name)}"
-                    image.save(image_path)
+                image_path = list(images.values())[-1]
             self.processed_image_path = list(ingreds.keys())[0] # Replace with actual processed image path
             print("Processed image path:", self.processed_image_path)
             self.labels = list(ingreds.values())[0]
@@ -327,5 +357,8 @@ class ResultsFrame3(tk.Frame):
 
 
 if __name__ == "__main__":
+    problems = paths.validate(strict=False)
+    if problems:
+        print("Configuration problems:\n  " + "\n  ".join(problems))
     app = RecipeFinderApp()
     app.mainloop()
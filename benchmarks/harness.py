@@ -0,0 +1,100 @@
+import json
+import os
+import platform
+import time
+
+import numpy as np
+
+
+def run_benchmark(name: str, function, items: int = 1, repeat: int = 30, warmup: int = 3, setup=None) -> dict:
+    """
+    Times a function and reports latency percentiles and throughput.
+
+    Args:
+        name (str): Name of the benchmark.
+        function: Callable without arguments, or with the result of setup() as its only argument.
+        items (int): Number of items (boxes, images, ...) processed by one call, used for the throughput.
+        repeat (int): Number of timed calls.
+        warmup (int): Number of untimed calls before the measurement.
+        setup: Optional callable run before every call (untimed), its result is passed to function.
+
+    Returns:
+        dict: name, calls, items per call, latency percentiles in milliseconds and items per second.
+    """
+    def call():
+        if setup is None:
+            start = time.perf_counter()
+            function()
+        else:
+            argument = setup()
+            start = time.perf_counter()
+            function(argument)
+        return time.perf_counter() - start
+
+    for _ in range(warmup):
+        call()
+    latencies = np.array([call() for _ in range(repeat)])
+    p50, p90, p99 = np.percentile(latencies, [50, 90, 99]) * 1000
+    return {
+        "name": name,
+        "calls": repeat,
+        "items": items,
+        "mean_ms": float(latencies.mean() * 1000),
+        "p50_ms": float(p50),
+        "p90_ms": float(p90),
+        "p99_ms": float(p99),
+        "items_per_second": float(items / latencies.mean()),
+    }
+
+
+def print_results(results: list):
+    print(f"{'benchmark':<32} {'p50 ms':>10} {'p90 ms':>10} {'p99 ms':>10} {'items/s':>12}")
+    for result in results:
+        print(f"{result['name']:<32} {result['p50_ms']:10.3f} {result['p90_ms']:10.3f} {result['p99_ms']:10.3f} "
+              f"{result['items_per_second']:12.1f}")
+
+
+def save_baseline(results: list, output_file: str):
+    """
+    Saves benchmark results as a JSON baseline, together with a description of the machine.
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(output_file)), exist_ok=True)
+    baseline = {
+        "machine": {"platform": platform.platform(), "processor": platform.processor(),
+                    "python": platform.python_version(), "cpu_count": os.cpu_count()},
+        "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "results": {result["name"]: result for result in results},
+    }
+    with open(output_file, "w") as f:
+        json.dump(baseline, f, indent=2)
+    print(f"Baseline saved to {output_file}.")
+
+
+def compare_to_baseline(results: list, baseline_file: str, tolerance: float = 0.2) -> list:
+    """
+    Compares the median latency of every benchmark with a saved baseline.
+
+    Args:
+        results (list): Results of run_benchmark().
+        baseline_file (str): JSON written by save_baseline(), ideally on the same machine.
+        tolerance (float): Allowed relative slowdown, 0.2 means up to 20 % slower is not a regression.
+
+    Returns:
+        list: Names of the benchmarks that regressed.
+    """
+    with open(baseline_file, "r") as f:
+        baseline = json.load(f)["results"]
+    regressions = []
+    print(f"{'benchmark':<32} {'baseline p50':>14} {'p50':>10} {'change':>9}")
+    for result in results:
+        if result["name"] not in baseline:
+            print(f"{result['name']:<32} {'-':>14} {result['p50_ms']:10.3f}")
+            continue
+        reference = baseline[result["name"]]["p50_ms"]
+        change = result["p50_ms"] / reference - 1 if reference > 0 else 0.0
+        flag = ""
+        if change > tolerance:
+            regressions.append(result["name"])
+            flag = "  REGRESSION"
+        print(f"{result['name']:<32} {reference:14.3f} {result['p50_ms']:10.3f} {change:+9.1%}{flag}")
+    return regressions
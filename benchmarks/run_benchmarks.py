@@ -0,0 +1,126 @@
+import argparse
+import json
+import os
+import sys
+import tempfile
+
+import cv2
+import numpy as np
+import yaml
+
+import project.paths as paths
+from project.benchmarks.harness import compare_to_baseline, print_results, run_benchmark, save_baseline
+from project.benchmarks.stand_ins import (StandInDetector, StandInEmbeddingModel, synthetic_boxes, synthetic_coco,
+                                          synthetic_image, synthetic_recipes)
+from project.classification_pipeline.classifier import IngredientClassifier, extract_ingredients_from_coco
+from project.classification_pipeline.clip_model_pipeline.ann_index import create_index
+from project.classification_pipeline.yolo_model_pipeline.box_ops import box_iou, nms
+from project.classification_pipeline.yolo_model_pipeline.YOLO_model import YoloModel
+from project.recipe_dataset.filtering import recipe_filtering
+
+
+LABELS = [f"ingredient_{i}" for i in range(134)]
+
+
+def write_recipes(rng: np.random.Generator, workdir: str, n_recipes: int = 2000):
+    recipe_file = os.path.join(workdir, "recipes.yaml")
+    with open(recipe_file, "w") as f:
+        yaml.safe_dump(synthetic_recipes(rng, n_recipes, LABELS), f)
+    paths.config["recipe_dataset"] = recipe_file
+
+
+def micro_benchmarks(rng: np.random.Generator, repeat: int, workdir: str) -> list:
+    results = []
+
+    boxes, scores = synthetic_boxes(rng, 1000)
+    results.append(run_benchmark("nms_1000_boxes", lambda: nms(boxes, scores, 0.7), items=1000, repeat=repeat))
+    results.append(run_benchmark("box_iou_500x500", lambda: box_iou(boxes[:500], boxes[500:]), items=500 * 500,
+                                 repeat=repeat))
+
+    label_vectors = rng.standard_normal((1000, 768)).astype(np.float32)
+    crops = rng.standard_normal((256, 768)).astype(np.float32)
+    for kind in ("flat", "ivf"):
+        index = create_index(kind, backend="numpy")
+        index.build(label_vectors, [str(i) for i in range(len(label_vectors))])
+        results.append(run_benchmark(f"label_scoring_{kind}_256x1000", lambda: index.query(crops, k=2), items=256,
+                                     repeat=repeat))
+
+    coco_data = synthetic_coco(rng, 500, 20, LABELS)
+    results.append(run_benchmark("extract_ingredients_500_images", lambda: extract_ingredients_from_coco(coco_data),
+                                 items=500, repeat=repeat))
+
+    # recipe_filtering reads the dataset on every call, that is part of what is measured
+    detected = [str(label) for label in rng.choice(LABELS, 8, replace=False)]
+    results.append(run_benchmark("recipe_filtering_2000_recipes", lambda: recipe_filtering(detected), items=1,
+                                 repeat=max(3, repeat // 5)))
+    return results
+
+
+def macro_benchmarks(rng: np.random.Generator, repeat: int, workdir: str, n_images: int) -> list:
+    """
+    End-to-end IngredientClassifier.inference on synthetic images with the stand-in models.
+    """
+    images_folder = os.path.join(workdir, "images")
+    os.makedirs(images_folder, exist_ok=True)
+    for i in range(n_images):
+        cv2.imwrite(os.path.join(images_folder, f"{i:04d}.jpg"), synthetic_image(rng))
+
+    reversed_dict = os.path.join(workdir, "reversed.yaml")
+    with open(reversed_dict, "w") as f:
+        yaml.safe_dump({label: label for label in LABELS}, f)
+    paths.config.update({
+        "images": images_folder,
+        "cropped_objects_folder": os.path.join(workdir, "crops"),
+        "annotated_images": os.path.join(workdir, "annotated"),
+        "yolo_results": os.path.join(workdir, "yolo_results.json"),
+        "clip_results": os.path.join(workdir, "clip_results.json"),
+        "embedded_labels": os.path.join(workdir, "embedded_labels"),
+        "reversed_ingredients_dict": reversed_dict,
+        "detection_thresholds": None,
+        "derived_cache": None,
+        "vocabulary": os.path.join(workdir, "vocabulary.json"),
+    })
+
+    yolo_model = YoloModel(path_to_model="stand-in")
+    yolo_model.model1 = yolo_model.model2 = StandInDetector()
+    classifier = IngredientClassifier(yolo_model=yolo_model, clip_model=StandInEmbeddingModel(LABELS))
+
+    results = [run_benchmark(f"inference_{n_images}_images",
+                             lambda: classifier.inference(images_folder, output_folder=paths.config["annotated_images"]),
+                             items=n_images, repeat=repeat, warmup=1)]
+    with open(paths.config["clip_results"], "r") as f:
+        detected = [label for labels in extract_ingredients_from_coco(json.load(f)).values() for label in labels]
+    results.append(run_benchmark("recipe_from_inference", lambda: recipe_filtering(detected), items=1,
+                                 repeat=repeat, warmup=1))
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Micro and macro benchmarks of the pipeline, offline on CPU.")
+    parser.add_argument("--suite", choices=("micro", "macro", "all"), default="all")
+    parser.add_argument("--repeat", type=int, default=30, help="Timed calls per micro benchmark.")
+    parser.add_argument("--macro-repeat", type=int, default=5, help="Timed calls per macro benchmark.")
+    parser.add_argument("--images", type=int, default=32, help="Number of synthetic images of the macro benchmark.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--save-baseline", help="Write the results to this JSON file.")
+    parser.add_argument("--compare", help="Compare the results with this baseline JSON file.")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed relative slowdown of the median.")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        write_recipes(rng, workdir)
+        if args.suite in ("micro", "all"):
+            results += micro_benchmarks(rng, args.repeat, workdir)
+        if args.suite in ("macro", "all"):
+            results += macro_benchmarks(rng, args.macro_repeat, workdir, args.images)
+    print_results(results)
+
+    if args.save_baseline:
+        save_baseline(results, args.save_baseline)
+    if args.compare:
+        regressions = compare_to_baseline(results, args.compare, args.tolerance)
+        if regressions:
+            print(f"{len(regressions)} benchmarks regressed: {', '.join(regressions)}")
+            sys.exit(1)
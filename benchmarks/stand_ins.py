@@ -0,0 +1,141 @@
+import zlib
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from project.classification_pipeline.clip_model_pipeline.embedding_model import EmbeddingModel
+
+
+class _Array:
+    """Mimics the part of the torch tensor API used on YOLO results (.cpu().numpy())."""
+    def __init__(self, array: np.ndarray):
+        self.array = array
+
+    def cpu(self):
+        return self
+
+    def numpy(self):
+        return self.array
+
+
+class _Boxes:
+    def __init__(self, xyxy: np.ndarray, conf: np.ndarray):
+        self.xyxy = _Array(xyxy)
+        self.conf = _Array(conf)
+
+    def __len__(self):
+        return len(self.conf.array)
+
+
+class _Result:
+    def __init__(self, boxes: _Boxes):
+        self.boxes = boxes
+
+
+class StandInDetector:
+    """
+    Tiny offline replacement of a YOLO model with the same call signature. Bright blobs on the
+    dark background of the synthetic images are found with a threshold and connected components,
+    so the boxes depend on the image content like real detections.
+    """
+    def __init__(self, threshold: int = 100, input_size: int = 320):
+        self.threshold = threshold
+        self.input_size = input_size
+
+    def __call__(self, images, conf: float = 0.25, verbose: bool = False) -> list:
+        results = []
+        for image in images:
+            height, width = image.shape[:2]
+            scale = self.input_size / max(height, width)
+            small = cv2.resize(image, (max(1, int(width * scale)), max(1, int(height * scale))))
+            mask = (cv2.cvtColor(small, cv2.COLOR_BGR2GRAY) > self.threshold).astype(np.uint8)
+            n, _, stats, _ = cv2.connectedComponentsWithStats(mask)
+            stats = stats[1:][stats[1:, cv2.CC_STAT_AREA] > 16]
+            xyxy = np.column_stack([stats[:, 0], stats[:, 1], stats[:, 0] + stats[:, 2],
+                                    stats[:, 1] + stats[:, 3]]).astype(np.float32) / scale
+            scores = np.clip(stats[:, cv2.CC_STAT_AREA] / (stats[:, 2] * stats[:, 3] + 1e-6), 0, 1).astype(np.float32)
+            keep = scores >= conf
+            results.append(_Result(_Boxes(xyxy[keep].reshape(-1, 4), scores[keep])))
+        return results
+
+
+class StandInEmbeddingModel(EmbeddingModel):
+    """
+    Tiny offline replacement of the CLIP model. Images are embedded by a fixed random projection of
+    their downscaled pixels, labels by a random vector seeded with the label, so the results are
+    deterministic and the labelling code path (index, scoring) is the real one.
+    """
+    def __init__(self, labels: list, dim: int = 256, image_size: int = 16, seed: int = 0):
+        super().__init__()
+        self.device = "cpu"
+        self.model_name = "stand-in"
+        self.labels = labels
+        self.dim = dim
+        self.image_size = image_size
+        self._projection = np.random.default_rng(seed).standard_normal(
+            (image_size * image_size * 3, dim)).astype(np.float32)
+
+    def _preprocess_image(self, image: Image) -> np.ndarray:
+        image = image.convert("RGB").resize((self.image_size, self.image_size))
+        return np.asarray(image, dtype=np.float32).reshape(-1) / 255.0
+
+    def _embed_image(self, image: np.ndarray) -> np.ndarray:
+        return image @ self._projection
+
+    def _embed_label(self, label: str) -> np.ndarray:
+        return np.random.default_rng(zlib.crc32(label.encode())).standard_normal(self.dim).astype(np.float32)
+
+    def load_label_store(self, root_folder: str):
+        """The label store is computed from the labels, nothing is read from disk."""
+        if not self._label_embeddings:
+            self.embed_labels(self.labels)
+
+
+def synthetic_image(rng: np.random.Generator, height: int = 480, width: int = 640, n_objects: int = 6) -> np.ndarray:
+    """
+    Draws a dark image with bright rectangles and ellipses standing in for ingredients.
+    """
+    image = np.full((height, width, 3), 30, dtype=np.uint8)
+    for _ in range(n_objects):
+        color = tuple(int(c) for c in rng.integers(120, 256, 3))
+        x, y = int(rng.integers(0, width - 80)), int(rng.integers(0, height - 80))
+        w, h = int(rng.integers(30, 120)), int(rng.integers(30, 120))
+        if rng.random() < 0.5:
+            cv2.rectangle(image, (x, y), (x + w, y + h), color, -1)
+        else:
+            cv2.ellipse(image, (x + w // 2, y + h // 2), (w // 2, h // 2), 0, 0, 360, color, -1)
+    return image
+
+
+def synthetic_boxes(rng: np.random.Generator, n: int, size: int = 1000) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Random clustered boxes in [x_min, y_min, x_max, y_max] format and their scores, many of them overlap.
+    """
+    centers = rng.uniform(0, size, (max(1, n // 8), 2))
+    xy = centers[rng.integers(0, len(centers), n)] + rng.normal(0, 10, (n, 2))
+    wh = rng.uniform(20, 120, (n, 2))
+    boxes = np.concatenate([xy, xy + wh], axis=1).astype(np.float32)
+    return boxes, rng.uniform(0.05, 1, n).astype(np.float32)
+
+
+def synthetic_coco(rng: np.random.Generator, n_images: int, annotations_per_image: int, labels: list) -> dict:
+    """
+    Synthetic COCO data with n_images images and annotations_per_image labelled boxes per image.
+    """
+    categories = [{"id": i, "name": label} for i, label in enumerate(labels)]
+    images = [{"id": i, "file_name": f"images/{i}.jpg", "width": 640, "height": 480} for i in range(n_images)]
+    annotations = [{"id": i, "image_id": i // annotations_per_image, "bbox": [10.0, 10.0, 50.0, 50.0],
+                    "area": 2500.0, "iscrowd": 0, "category_id": int(rng.integers(0, len(labels))),
+                    "score": 0.5, "model": 1}
+                   for i in range(n_images * annotations_per_image)]
+    return {"info": {}, "images": images, "annotations": annotations, "categories": categories}
+
+
+def synthetic_recipes(rng: np.random.Generator, n_recipes: int, labels: list) -> list:
+    """
+    Synthetic recipe dataset in the format of paths.config["recipe_dataset"].
+    """
+    return [{"ingredients": [str(label) for label in rng.choice(labels, int(rng.integers(3, 10)), replace=False)],
+             "directions": [f"Step {j}" for j in range(3)]}
+            for _ in range(n_recipes)]
@@ -0,0 +1,90 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+from project.classification_pipeline.coco_index import CocoIndex
+
+
+class AnnotationRenderer:
+    """
+    Draws COCO bounding boxes and labels onto images with OpenCV.
+    Annotations are grouped by image once, frames that are already decoded are reused
+    and images are rendered in a thread pool (OpenCV releases the GIL while drawing and encoding).
+
+    Attributes:
+        color (tuple): BGR color of boxes and labels.
+        thickness (int): Line thickness of the boxes.
+        font_scale (float): Scale of the label font.
+        n_workers (int): Number of threads used to render images.
+    """
+    font = cv2.FONT_HERSHEY_SIMPLEX
+
+    def __init__(self, color=(0, 255, 0), thickness: int = 2, font_scale: float = 1.2, n_workers: int = 4):
+        self.color = color
+        self.thickness = thickness
+        self.font_scale = font_scale
+        self.n_workers = n_workers
+
+    def draw(self, image: np.ndarray, boxes, labels) -> np.ndarray:
+        """
+        Draws boxes and labels into the image in place.
+
+        Args:
+            image (np.ndarray): BGR image.
+            boxes: Iterable of COCO boxes [x_min, y_min, width, height].
+            labels: Label for every box.
+
+        Returns:
+            np.ndarray: The same image with the annotations drawn.
+        """
+        for (x_min, y_min, width, height), label in zip(boxes, labels):
+            x_min, y_min = int(x_min), int(y_min)
+            x_max, y_max = int(x_min + width), int(y_min + height)
+            cv2.rectangle(image, (x_min, y_min), (x_max, y_max), self.color, self.thickness)
+            text_position = (x_min, y_min - 10 if y_min - 10 > 10 else y_min + 30)
+            cv2.putText(image, label, text_position, self.font, self.font_scale, self.color, self.thickness,
+                        cv2.LINE_AA)
+        return image
+
+    def render(self, coco_data: dict, image_folder: str, frames: dict | None = None,
+               output_folder: str | None = None, coco_index: CocoIndex | None = None) -> dict:
+        """
+        Renders the annotations of all images in coco_data.
+
+        Args:
+            coco_data (dict): COCO data with images, annotations and categories.
+            image_folder (str): Folder with the original images, used for images missing in frames.
+            frames (dict | None): Already decoded BGR images keyed by image id. They are drawn into in place.
+            output_folder (str | None): If provided, the rendered images are encoded there under their original name.
+            coco_index (CocoIndex | None): Index of coco_data, built if not provided.
+
+        Returns:
+            dict: Image path -> rendered BGR image.
+        """
+        frames = frames or {}
+        coco_index = coco_index or CocoIndex(coco_data)
+        if output_folder is not None:
+            os.makedirs(output_folder, exist_ok=True)
+
+        def render_image(image_info):
+            image_name = os.path.basename(image_info['file_name'])
+            image_path = os.path.join(image_folder, image_name)
+            image = frames.get(image_info['id'])
+            if image is None:
+                image = cv2.imread(image_path)
+            if image is None:
+                print(f"Failed to load image {image_path}, skipping.")
+                return image_path, None
+
+            annotations = [annotation for annotation in coco_index.annotations(image_info['id']) if annotation.get('bbox')]
+            self.draw(image, [annotation['bbox'] for annotation in annotations],
+                      [coco_index.category_name(annotation['category_id']) or "" for annotation in annotations])
+            if output_folder is not None:
+                cv2.imwrite(os.path.join(output_folder, image_name), image)
+            return image_path, image
+
+        with ThreadPoolExecutor(max_workers=self.n_workers) as executor:
+            rendered = executor.map(render_image, coco_data['images'])
+            return {image_path: image for image_path, image in rendered if image is not None}
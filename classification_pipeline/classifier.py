@@ -1,154 +1,272 @@
+import hashlib
 import json
 import os
 import re
-from collections import defaultdict
+from typing import TYPE_CHECKING, Callable
 
 import cv2
-import yaml
-from PIL import Image, ImageDraw, ImageFont
+from PIL import Image
 from tqdm import tqdm
 
 import project.paths as paths
-from project.classification_pipeline.clip_model_pipeline.clip_model import ClipModel
+from project.classification_pipeline.annotation_renderer import AnnotationRenderer
+from project.classification_pipeline.coco_index import CocoIndex
+from project.classification_pipeline.detection_result import DetectionResult
+from project.classification_pipeline.profiler import profiler
+from project.classification_pipeline.results_manifest import ResultsManifest, file_signature
+from project.classification_pipeline.vocabulary import load_vocabulary
 from project.classification_pipeline.yolo_model_pipeline.cutt_of_ingredients import cut_out_objects
-from project.classification_pipeline.yolo_model_pipeline.YOLO_model import YoloModel
+
+if TYPE_CHECKING:
+    from project.classification_pipeline.yolo_model_pipeline.YOLO_model import YoloModel
 
 
 class IngredientClassifier():
-    def __init__(self):
-        self.yolo_model = YoloModel()
-        self.clip_model = ClipModel()
-
-    def inference(self, image_folder, iou_threshold=0.7) -> Image:
-        output_file = paths.config["yolo_results"]
-        with open(paths.config["reversed_ingredients_dict"]) as f:
-            unified_labels = yaml.safe_load(f)
-        coco_data = self.yolo_model.detect(image_folder, output_file, iou_threshold=iou_threshold, save=True)
-        cut_out_objects(coco_data, image_folder)
-
-        self.clip_model.load_label_embeddings(paths.config["embedded_labels"])
-        # clip_labels = predict(self.clip_model)
-        cropped_obj = paths.config["cropped_objects_folder"]
-        unified_labels_list = list(set(unified_labels.values()))
-        print(len(unified_labels_list))
-        for label in unified_labels_list:
-            coco_data["categories"].append({
-                "id": unified_labels_list.index(label),
-                "name": label,
-            })
-
-        # for image_path, label in clip_labels.items():
-
-        for file_name in tqdm(os.listdir(cropped_obj), desc="Classifying ingredients"):
-            if file_name.endswith(".jpg") or file_name.endswith(".png") or file_name.endswith(".jpeg"):  # Process only .jpg files
-                # Extract image file name from the path
-                # Get the corresponding image ID from the YOLO JSON
-                object_id = int(re.search(r'ann_(\d+)', file_name)[1])
-                # Add a new annotation for the classification result from CLIP
-                image_path = os.path.join(cropped_obj, file_name)
-                label = self.clip_model.label_image(image_path)
-                coco_data["annotations"][object_id]["category_id"] = unified_labels_list.index(unified_labels[label])
-        with open(paths.config["clip_results"], "w") as f:
-            json.dump(coco_data, f, indent=4)
-        ingreds = extract_ingredients_from_coco(coco_data)
-        return self.add_bboxes_and_annotation(coco_data), ingreds
+    def __init__(self, precision: str = "fp32", yolo_export_format: str | None = None,
+                 use_embedding_cache: bool = True, clip_model_name: str = "openai/clip-vit-large-patch14",
+                 cascade_model_name: str | None = None, cascade_margin: float = 0.02,
+                 yolo_model: "YoloModel | None" = None, clip_model=None):
+        """
+        Args:
+            precision (str): Inference precision of the CLIP model ("fp32", "bf16", "int8").
+            yolo_export_format (str | None): Run the YOLO models via "onnx" or "openvino" instead of PyTorch.
+            use_embedding_cache (bool): Reuse cached CLIP embeddings of already seen crops.
+            clip_model_name (str): The CLIP backbone used to label crops.
+            cascade_model_name (str | None): A smaller CLIP backbone (e.g. "openai/clip-vit-base-patch32") that
+                labels every crop first, clip_model_name then only re-scores crops with a margin below cascade_margin.
+            cascade_margin (float): Top-1/top-2 cosine distance margin below which a crop is re-scored.
+            yolo_model (YoloModel | None): An already constructed detector used instead of loading one
+                (e.g. the stand-in models of the benchmarks).
+            clip_model: An already constructed labelling model (EmbeddingModel or CascadeClipModel) used
+                instead of loading one.
+        """
+        # torch, transformers and ultralytics are imported only when the models are built,
+        # importing this module stays cheap
+        if yolo_model is None:
+            from project.classification_pipeline.yolo_model_pipeline.YOLO_model import YoloModel
+            yolo_model = YoloModel(export_format=yolo_export_format)
+        self.yolo_model = yolo_model
+        if clip_model is not None:
+            self.clip_model = clip_model
+        elif cascade_model_name:
+            from project.classification_pipeline.clip_model_pipeline.cascade_model import CascadeClipModel
+            self.clip_model = CascadeClipModel(cascade_model_name, clip_model_name, margin_threshold=cascade_margin,
+                                               precision=precision, use_embedding_cache=use_embedding_cache)
+        else:
+            from project.classification_pipeline.clip_model_pipeline.clip_model import ClipModel
+            self.clip_model = ClipModel(clip_model_name, precision=precision, use_embedding_cache=use_embedding_cache)
+        self.clip_settings = {"clip_model_name": clip_model_name, "cascade_model_name": cascade_model_name,
+                              "cascade_margin": cascade_margin, "precision": precision}
+        self.renderer = AnnotationRenderer()
+        self._label_store_signature = None
+        self.crop_folder = paths.config["cropped_objects_folder"]  # Every worker process needs its own
+
+    def _pipeline_fingerprint(self, iou_threshold, tiled, max_tiles) -> str:
+        """
+        Fingerprint of everything that influences the results of an image: the model files and their
+        thresholds, the CLIP settings, the label store and the label mapping. Results in the manifest
+        that were produced with a different fingerprint are recomputed.
+        """
+        settings = {
+            "yolo_models": [file_signature(paths.config["yolo_model_1"]), file_signature(paths.config["yolo_model_2"])],
+            "export_format": self.yolo_model.export_format,
+            "thresholds": [self.yolo_model.conf1, self.yolo_model.conf2, self.yolo_model.max_detections,
+                           self.yolo_model.skip_model2_coverage],
+            "clip": self.clip_settings,
+            "label_store": file_signature(paths.config["embedded_labels"]),
+            "reversed_ingredients_dict": file_signature(paths.config["reversed_ingredients_dict"]),
+            "params": [iou_threshold, tiled, max_tiles],
+        }
+        return hashlib.sha1(json.dumps(settings, sort_keys=True).encode()).hexdigest()
+
+    def _load_label_store(self):
+        """
+        Loads the CLIP label store, again only if it changed on disk since the last load.
+        """
+        signature = file_signature(paths.config["embedded_labels"])
+        if signature is None or signature != self._label_store_signature:
+            with profiler.span("load_label_store"):
+                self.clip_model.load_label_store(paths.config["embedded_labels"])
+            self._label_store_signature = signature
+
+    def warm_up(self):
+        """
+        Loads everything that is otherwise loaded lazily on the first request (the vocabulary, synced with
+        the ingredient dictionary, and the label store), so the first classification is not slower than
+        the following ones and forked workers do not sync the vocabulary each on their own.
+        """
+        load_vocabulary()
+        self._load_label_store()
+
+    def classify(self, image_folder, image_files=None, iou_threshold=0.7, tiled=False, max_tiles=None,
+                 save_detections: bool = True, chunk_size: int = 32, batch_size: int = 8,
+                 on_chunk: Callable[[dict, dict], None] | None = None) -> tuple[DetectionResult, CocoIndex]:
+        """
+        Detects the objects in the images and labels them with CLIP. The images are processed in chunks,
+        the decoded images of a chunk are shared by detection, cropping and on_chunk and released
+        before the next chunk, so memory does not grow with the number of images.
+
+        Args:
+            image_folder (str): Folder with the images.
+            image_files (list | None): File names inside image_folder to process, default all images.
+            iou_threshold (float): IoU threshold of the box merging.
+            tiled (bool): Run the detectors on overlapping tiles as well (see YoloModel.detect).
+            max_tiles (int | None): Upper bound on the number of tiles per image.
+            save_detections (bool): Save the detections to paths.config["yolo_results"].
+            chunk_size (int): Number of images decoded and kept in memory at once.
+            batch_size (int): Number of images per YOLO forward pass (see YoloModel.detect).
+            on_chunk (Callable | None): Called with the labelled COCO data of every chunk and its decoded BGR
+                images keyed by image id, e.g. to render them while they are still in memory.
+
+        Returns:
+            tuple[DetectionResult, CocoIndex]: The labelled detections and the index of their COCO data.
+        """
+        if image_files is None:
+            image_files = [f for f in os.listdir(image_folder) if f.lower().endswith(('.png', '.jpg', '.jpeg'))]
+        vocabulary = load_vocabulary()
+        self._load_label_store()
+        self.clip_model.set_vocabulary(vocabulary)
+
+        detections = None
+        # An empty list still runs one chunk, so an empty result is returned
+        for start in range(0, len(image_files) or 1, chunk_size):
+            frames = {}
+            first_image = len(detections.images) if detections is not None else 0
+            detections = self.yolo_model.detect(image_folder, None, iou_threshold=iou_threshold, tiled=tiled,
+                                                max_tiles=max_tiles, image_files=image_files[start:start + chunk_size],
+                                                frames=frames, detections=detections, batch_size=batch_size)
+            if first_image == 0:
+                detections.set_categories(vocabulary.categories())
+                detections.info["vocabulary_version"] = vocabulary.version
+            image_ids = [image_info["id"] for image_info in detections.images[first_image:]]
+            chunk_coco = detections.to_coco(image_ids)
+            cut_out_objects(chunk_coco, image_folder, CocoIndex(chunk_coco), self.crop_folder, frames)
+
+            cropped_obj = self.crop_folder
+            crop_files = [file_name for file_name in os.listdir(cropped_obj) if file_name.endswith((".jpg", ".png", ".jpeg"))]
+            crop_paths = [os.path.join(cropped_obj, file_name) for file_name in crop_files]
+            category_ids = self.clip_model.label_ids(tqdm(crop_paths, desc="Classifying ingredients")) if crop_paths else []
+            # Get the corresponding annotation ID from the crop file name
+            object_ids = [int(re.search(r'ann_(\d+)', file_name)[1]) for file_name in crop_files]
+            detections.set_category_ids(object_ids, category_ids)
+
+            if on_chunk is not None:
+                on_chunk(detections.to_coco(image_ids), frames)
+            del frames
+
+        if save_detections:
+            with profiler.span("save_json"):
+                detections.save(paths.config["yolo_results"])
+        return detections, CocoIndex(detections.to_coco())
+
+    def inference(self, image_folder, iou_threshold=0.7, output_folder=None, tiled=False,
+                  max_tiles=None, incremental: bool = False) -> tuple[dict, dict]:
+        """
+        Detects and labels the ingredients in all images of a folder.
+
+        Args:
+            image_folder (str): Folder with the images.
+            iou_threshold (float): IoU threshold of the box merging.
+            output_folder (str | None): If provided, the annotated images are written there.
+            tiled (bool): Run the detectors on overlapping tiles as well (see YoloModel.detect).
+            max_tiles (int | None): Upper bound on the number of tiles per image.
+            incremental (bool): Only process images that are new or changed since the last run (or were
+                processed with different models or settings), results of the others are taken from
+                paths.config["results_manifest"]. Only the processed images are rendered.
+
+        Returns:
+            tuple[dict, dict]: The rendered images and image path -> list of ingredients.
+        """
+        image_files = None
+        if incremental:
+            manifest = ResultsManifest(paths.config["results_manifest"])
+            fingerprint = self._pipeline_fingerprint(iou_threshold, tiled, max_tiles)
+            all_files = sorted(f for f in os.listdir(image_folder) if f.lower().endswith(('.png', '.jpg', '.jpeg')))
+            manifest.prune(image_folder, all_files)
+            image_files = manifest.stale_files(image_folder, all_files, fingerprint)
+            print(f"{len(all_files) - len(image_files)} of {len(all_files)} images unchanged, skipping them.")
+
+        # Every chunk is rendered while its decoded images are still in memory
+        rendered = {}
+
+        def render_chunk(chunk_coco, frames):
+            rendered.update(self.add_bboxes_and_annotation(chunk_coco, frames, output_folder))
+
+        detections, coco_index = self.classify(image_folder, image_files, iou_threshold, tiled, max_tiles,
+                                               on_chunk=render_chunk)
+        coco_data = coco_index.coco_data
+        ingreds = extract_ingredients_from_coco(coco_data, coco_index)
+        if incremental:
+            for image_info in coco_data["images"]:
+                manifest.update(os.path.join(image_folder, os.path.basename(image_info["file_name"])), fingerprint,
+                                image_info, annotation_fragments(coco_index, image_info["id"]),
+                                coco_index.ingredients(image_info["id"]))
+            manifest.save()
+            with profiler.span("save_json"), open(paths.config["clip_results"], "w") as f:
+                json.dump(manifest.to_coco(image_folder, detections.categories, detections.info), f,
+                          separators=(",", ":"))
+            ingreds = manifest.ingredients(image_folder, paths.config["annotated_images"])
+        else:
+            with profiler.span("save_json"):
+                detections.save(paths.config["clip_results"])
+        return rendered, ingreds
         # return coco_data
 
 
 
-    def add_bboxes_and_annotation(self, coco_data) -> Image:
-
-        # Get image details
-        category_dict = {category['id']: category['name'] for category in coco_data['categories']}
-        images = {}
-        for image_dict in coco_data["images"]:
-            image_path = image_dict['file_name']
-            image_id = image_dict['id']
-            image_path = os.path.join(paths.config["images"], os.path.basename(image_path))
-            # Check if the image exists
-            if not os.path.exists(image_path):
-                print(f"Image {image_path} does not exist.")
-                return
-
-            # Load the image using OpenCV
-            image = cv2.imread(image_path)
-            if image is None:
-                print(f"Failed to load image {image_path}.")
-                return
-
-            # Convert the OpenCV image (BGR) to RGB format and then to PIL Image
-            image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-            pil_image = Image.fromarray(image)
-            # Draw all annotations related to this image
-            draw = ImageDraw.Draw(pil_image)
-            for annotation in coco_data['annotations']:
-                # Extract bounding box information (if available)
-                id = annotation['image_id']
-                if id == image_id:
-                    bbox = annotation.get('bbox', None)
-                    category_id = annotation['category_id']
-                    label = category_dict[category_id]
-
-                    # Draw the bounding box if available
-                    if bbox:
-                        x_min, y_min, width, height = bbox
-                        x_max, y_max = x_min + width, y_min + height
-
-                        # Draw rectangle for bounding box
-                        color_rec = (0, 255, 0)  # Green
-                        draw.rectangle([x_min, y_min, x_max, y_max], outline=color_rec, width=2)
-
-                        # Draw label above the bounding box
-                        font = ImageFont.load_default(40)
-                        text_position = (x_min, y_min - 10 if y_min - 10 > 10 else y_min + 10)
-                        color_text = (0, 255, 0)
-                        draw.text(text_position, label, fill=color_text, font=font)
-                images[image_path] = pil_image
-        return images
-
-
-
-def extract_ingredients_from_coco(coco_data) -> dict:
-    """
-    Extracts a dictionary where each image ID is mapped to a list of ingredients present in that image.
-
-    Args:
-        coco_json_path (str): Path to the COCO-like JSON file.
-
-    Returns:
-        dict: A dictionary where the keys are image file names and the values are lists of ingredients.
-    """
-
-    # Create a lookup dictionary for category_id -> ingredient name
-    category_id_to_name = {category['id']: category['name'] for category in coco_data['categories']}
+    def add_bboxes_and_annotation(self, coco_data, frames=None, output_folder=None, coco_index=None) -> dict:
+        """
+        Draws the bounding boxes and labels of coco_data into the images.
 
-    # Create a dictionary to store ingredients for each image
-    image_ingredients = defaultdict(list)
+        Args:
+            coco_data (dict): COCO data with images, annotations and categories.
+            frames (dict | None): Already decoded BGR images keyed by image id, reused instead of reading the files.
+            output_folder (str | None): If provided, the annotated images are written there.
+            coco_index (CocoIndex | None): Index of coco_data, built if not provided.
 
-    # Iterate over the annotations and collect ingredients for each image
-    for annotation in coco_data['annotations']:
-        image_id = annotation['image_id']
-        category_id = annotation.get('category_id', None)
+        Returns:
+            dict: Image path -> annotated PIL image, or image path -> written file path if output_folder is given.
+        """
+        with profiler.span("render"):
+            rendered = self.renderer.render(coco_data, paths.config["images"], frames=frames,
+                                            output_folder=output_folder, coco_index=coco_index)
+        if output_folder is not None:
+            return {image_path: os.path.join(output_folder, os.path.basename(image_path)) for image_path in rendered}
+        return {image_path: Image.fromarray(cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
+                for image_path, image in rendered.items()}
 
-        # Get the file name for the corresponding image_id
-        image_filename = None
-        for image in coco_data['images']:
-            if image['id'] == image_id:
-                image_filename = f"{paths.config["annotated_images"]}/{os.path.basename(image['file_name'])}"
-                break
 
-        # Skip if the image file name is not found or the category_id is missing
-        if image_filename is None or category_id is None:
-            continue
 
-        # Get the ingredient name corresponding to the category_id
-        ingredient_name = category_id_to_name.get(category_id, None)
+def annotation_fragments(coco_index: CocoIndex, image_id) -> list:
+    """
+    Returns the annotations of one image with category names instead of ids, so they can be stored
+    and merged independently of the category numbering of a run.
+    """
+    return [{"bbox": annotation["bbox"], "category": coco_index.category_name(annotation["category_id"]),
+             "score": annotation["score"], "model": annotation["model"]}
+            for annotation in coco_index.annotations(image_id)]
 
-        # Add the ingredient name to the image's list of ingredients
-        if ingredient_name is not None and ingredient_name not in image_ingredients[image_filename]:
-            image_ingredients[image_filename].append(ingredient_name)
 
-    return dict(image_ingredients)
+def extract_ingredients_from_coco(coco_data, coco_index: CocoIndex | None = None) -> dict:
+    """
+    Extracts a dictionary where each image ID is mapped to a list of ingredients present in that image.
 
+    Args:
+        coco_data (dict): COCO-like data with images, annotations and categories.
+        coco_index (CocoIndex | None): Index of coco_data, built if not provided.
 
+    Returns:
+        dict: A dictionary where the keys are image file names and the values are lists of ingredients.
+    """
+    coco_index = coco_index or CocoIndex(coco_data)
+
+    image_ingredients = {}
+    for image_id in coco_index.annotations_by_image:
+        file_name = coco_index.file_name(image_id)
+        ingredients = coco_index.ingredients(image_id)
+        # Skip if the image file name is not found or no annotation has a known category
+        if file_name is None or not ingredients:
+            continue
+        image_ingredients[f"{paths.config["annotated_images"]}/{file_name}"] = ingredients
 
+    return image_ingredients
@@ -0,0 +1,363 @@
+import abc
+import json
+import os
+import warnings
+from typing import List, Tuple
+
+import numpy as np
+
+try:
+    import faiss
+except ImportError:  # faiss is optional, numpy indexes are used instead
+    faiss = None
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    """
+    L2-normalizes vectors row-wise so that inner product equals cosine similarity.
+
+    Args:
+        vectors (np.ndarray): Array of shape (n, dim) or (dim,).
+
+    Returns:
+        np.ndarray: float32 array of the same shape with unit-length rows.
+    """
+    vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+class NearestNeighbourIndex(abc.ABC):
+    """
+    Abstract base class for cosine nearest-neighbour indexes over embeddings.
+    Every stored vector has a key (label name, gallery label, ...) that is returned by query().
+
+    Attributes:
+        kind (str): Name of the index type ("flat", "ivf" or "hnsw").
+        keys (List[str]): Keys of the stored vectors, in insertion order.
+        dim (int): Dimension of the stored vectors.
+    """
+    kind = None
+
+    def __init__(self):
+        self.keys = []
+        self.dim = 0
+
+    def __len__(self):
+        return len(self.keys)
+
+    def build(self, vectors: np.ndarray, keys: List[str]):
+        """
+        Builds the index from scratch.
+
+        Args:
+            vectors (np.ndarray): Array of shape (n, dim) with the embeddings.
+            keys (List[str]): Key for every row of vectors.
+        """
+        vectors = normalize(vectors)
+        if len(keys) != len(vectors):
+            raise ValueError(f"Got {len(vectors)} vectors but {len(keys)} keys.")
+        self.keys = list(keys)
+        self.dim = vectors.shape[1]
+        self._build(vectors)
+
+    def query(self, queries: np.ndarray, k: int = 1) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Finds the k nearest stored vectors for every query.
+
+        Args:
+            queries (np.ndarray): Array of shape (m, dim) or a single vector of shape (dim,).
+            k (int): Number of neighbours to return.
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: Cosine distances and row indices, both of shape (m, k),
+                sorted from the closest neighbour. Approximate indexes return -1 when the probed lists
+                hold fewer than k vectors, these queries are searched again exactly.
+        """
+        if not self.keys:
+            raise ValueError("Index is empty. Call build() or load() first.")
+        k = min(k, len(self.keys))
+        queries = normalize(queries)
+        similarities, indices = self._query(queries, k)
+        incomplete = np.flatnonzero((indices < 0).any(axis=1))
+        if len(incomplete):
+            similarities, indices = similarities.copy(), indices.copy()
+            similarities[incomplete], indices[incomplete] = _top_k(queries[incomplete] @ self._vectors_all().T, k)
+        return 1 - similarities, indices
+
+    def query_keys(self, queries: np.ndarray, k: int = 1) -> List[List[Tuple[str, float]]]:
+        """
+        Same as query() but returns (key, cosine distance) pairs for every query.
+        """
+        distances, indices = self.query(queries, k)
+        return [[(self.keys[i], float(d)) for d, i in zip(row_d, row_i) if i >= 0]
+                for row_d, row_i in zip(distances, indices)]
+
+    def save(self, output_folder: str):
+        """
+        Saves the index to the specified folder.
+
+        Args:
+            output_folder (str): The folder to save the index to.
+        """
+        os.makedirs(output_folder, exist_ok=True)
+        with open(os.path.join(output_folder, "index_meta.json"), "w") as f:
+            json.dump({"kind": self.kind, "backend": self.backend, "dim": self.dim, "keys": self.keys,
+                       "params": self._params()}, f)
+        self._save(output_folder)
+
+    @staticmethod
+    def load(input_folder: str) -> "NearestNeighbourIndex":
+        """
+        Loads an index previously stored with save().
+
+        Args:
+            input_folder (str): The folder to load the index from.
+
+        Returns:
+            NearestNeighbourIndex: The loaded index.
+        """
+        with open(os.path.join(input_folder, "index_meta.json"), "r") as f:
+            meta = json.load(f)
+        index = create_index(meta["kind"], backend=meta["backend"], **meta["params"])
+        index.keys = meta["keys"]
+        index.dim = meta["dim"]
+        index._load(input_folder)
+        return index
+
+    def _params(self) -> dict:
+        return {}
+
+    @property
+    @abc.abstractmethod
+    def backend(self) -> str:
+        pass
+
+    @abc.abstractmethod
+    def _vectors_all(self) -> np.ndarray:
+        """Returns all stored (normalized) vectors in row order, used for the exact search fallback."""
+        pass
+
+    @abc.abstractmethod
+    def _build(self, vectors: np.ndarray):
+        pass
+
+    @abc.abstractmethod
+    def _query(self, queries: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        pass
+
+    @abc.abstractmethod
+    def _save(self, output_folder: str):
+        pass
+
+    @abc.abstractmethod
+    def _load(self, input_folder: str):
+        pass
+
+
+def _top_k(similarities: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Returns the k largest similarities per row and their column indices, sorted descending."""
+    if k < similarities.shape[1]:
+        indices = np.argpartition(-similarities, k - 1, axis=1)[:, :k]
+    else:
+        indices = np.broadcast_to(np.arange(similarities.shape[1]), similarities.shape).copy()
+    top = np.take_along_axis(similarities, indices, axis=1)
+    order = np.argsort(-top, axis=1)
+    return np.take_along_axis(top, order, axis=1), np.take_along_axis(indices, order, axis=1)
+
+
+class FlatIndex(NearestNeighbourIndex):
+    """
+    Exact index, one matrix product against all stored vectors.
+    """
+    kind = "flat"
+    backend = "numpy"
+
+    def __init__(self):
+        super().__init__()
+        self._vectors = np.zeros((0, 0), dtype=np.float32)
+
+    def _build(self, vectors: np.ndarray):
+        self._vectors = vectors
+
+    def _query(self, queries: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        return _top_k(queries @ self._vectors.T, k)
+
+    def _vectors_all(self) -> np.ndarray:
+        return self._vectors
+
+    def _save(self, output_folder: str):
+        np.save(os.path.join(output_folder, "vectors.npy"), self._vectors)
+
+    def _load(self, input_folder: str):
+        self._vectors = np.load(os.path.join(input_folder, "vectors.npy"))
+
+
+class IVFIndex(NearestNeighbourIndex):
+    """
+    Inverted file index. Vectors are clustered by spherical k-means and a query only scans
+    the n_probe clusters with the closest centroids.
+
+    Attributes:
+        n_lists (int | None): Number of clusters, default sqrt(n).
+        n_probe (int): Number of clusters scanned per query.
+    """
+    kind = "ivf"
+    backend = "numpy"
+
+    def __init__(self, n_lists: int | None = None, n_probe: int = 8, n_iter: int = 10, seed: int = 0):
+        super().__init__()
+        self.n_lists = n_lists
+        self.n_probe = n_probe
+        self.n_iter = n_iter
+        self.seed = seed
+        self._vectors = np.zeros((0, 0), dtype=np.float32)
+        self._centroids = np.zeros((0, 0), dtype=np.float32)
+        self._assignments = np.zeros(0, dtype=np.int64)
+        self._lists = []
+
+    def _params(self) -> dict:
+        return {"n_lists": self.n_lists, "n_probe": self.n_probe, "n_iter": self.n_iter, "seed": self.seed}
+
+    def _build(self, vectors: np.ndarray):
+        n_lists = self.n_lists or max(1, int(np.sqrt(len(vectors))))
+        n_lists = min(n_lists, len(vectors))
+        rng = np.random.default_rng(self.seed)
+        centroids = vectors[rng.choice(len(vectors), n_lists, replace=False)]
+        for _ in range(self.n_iter):
+            assignments = np.argmax(vectors @ centroids.T, axis=1)
+            for c in range(n_lists):
+                members = vectors[assignments == c]
+                if len(members):
+                    centroids[c] = members.mean(axis=0)
+            centroids = normalize(centroids)
+        self._vectors = vectors
+        self._centroids = centroids
+        self._assignments = np.argmax(vectors @ centroids.T, axis=1)
+        self._split_lists()
+
+    def _split_lists(self):
+        self._lists = [np.flatnonzero(self._assignments == c) for c in range(len(self._centroids))]
+
+    def _query(self, queries: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        n_probe = min(self.n_probe, len(self._centroids))
+        _, probes = _top_k(queries @ self._centroids.T, n_probe)
+        similarities = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        indices = np.full((len(queries), k), -1, dtype=np.int64)
+        for q, clusters in enumerate(probes):
+            candidates = np.concatenate([self._lists[c] for c in clusters])
+            if not len(candidates):
+                continue
+            top, order = _top_k(queries[q:q + 1] @ self._vectors[candidates].T, min(k, len(candidates)))
+            similarities[q, :top.shape[1]] = top[0]
+            indices[q, :top.shape[1]] = candidates[order[0]]
+        return similarities, indices
+
+    def _vectors_all(self) -> np.ndarray:
+        return self._vectors
+
+    def _save(self, output_folder: str):
+        np.savez(os.path.join(output_folder, "ivf.npz"), vectors=self._vectors, centroids=self._centroids,
+                 assignments=self._assignments)
+
+    def _load(self, input_folder: str):
+        data = np.load(os.path.join(input_folder, "ivf.npz"))
+        self._vectors = data["vectors"]
+        self._centroids = data["centroids"]
+        self._assignments = data["assignments"]
+        self._split_lists()
+
+
+class FaissIndex(NearestNeighbourIndex):
+    """
+    Index backed by faiss (optional dependency). Supports "flat", "ivf" and "hnsw".
+    """
+    backend = "faiss"
+
+    def __init__(self, kind: str = "flat", n_lists: int | None = None, n_probe: int = 8, hnsw_m: int = 32,
+                 ef_search: int = 64):
+        super().__init__()
+        if faiss is None:
+            raise ImportError("faiss is not installed. Install faiss-cpu or use the numpy backend.")
+        self.kind = kind
+        self.n_lists = n_lists
+        self.n_probe = n_probe
+        self.hnsw_m = hnsw_m
+        self.ef_search = ef_search
+        self._index = None
+
+    def _params(self) -> dict:
+        return {"kind": self.kind, "n_lists": self.n_lists, "n_probe": self.n_probe, "hnsw_m": self.hnsw_m,
+                "ef_search": self.ef_search}
+
+    def _build(self, vectors: np.ndarray):
+        dim = vectors.shape[1]
+        if self.kind == "flat":
+            index = faiss.IndexFlatIP(dim)
+        elif self.kind == "ivf":
+            n_lists = min(self.n_lists or max(1, int(np.sqrt(len(vectors)))), len(vectors))
+            index = faiss.IndexIVFFlat(faiss.IndexFlatIP(dim), dim, n_lists, faiss.METRIC_INNER_PRODUCT)
+            index.train(vectors)
+        elif self.kind == "hnsw":
+            index = faiss.IndexHNSWFlat(dim, self.hnsw_m, faiss.METRIC_INNER_PRODUCT)
+        else:
+            raise ValueError(f"Unknown index kind '{self.kind}'.")
+        index.add(vectors)
+        self._index = index
+        self._apply_search_params()
+
+    def _apply_search_params(self):
+        if self.kind == "ivf":
+            self._index.nprobe = self.n_probe
+        elif self.kind == "hnsw":
+            self._index.hnsw.efSearch = self.ef_search
+
+    def _query(self, queries: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        return self._index.search(queries, k)
+
+    def _vectors_all(self) -> np.ndarray:
+        return self._index.reconstruct_n(0, self._index.ntotal)
+
+    def _save(self, output_folder: str):
+        faiss.write_index(self._index, os.path.join(output_folder, "faiss.index"))
+
+    def _load(self, input_folder: str):
+        self._index = faiss.read_index(os.path.join(input_folder, "faiss.index"))
+        self._apply_search_params()
+
+
+# Keyword arguments accepted by the index of each backend
+FAISS_PARAMS = ("n_lists", "n_probe", "hnsw_m", "ef_search")
+IVF_PARAMS = ("n_lists", "n_probe", "n_iter", "seed")
+
+
+def create_index(kind: str = "flat", backend: str = "auto", **kwargs) -> NearestNeighbourIndex:
+    """
+    Creates an empty nearest-neighbour index.
+
+    Args:
+        kind (str): "flat" (exact), "ivf" or "hnsw".
+        backend (str): "faiss", "numpy" or "auto" (faiss if installed, numpy otherwise).
+        **kwargs: Index parameters (n_lists, n_probe, hnsw_m, ef_search for faiss, n_iter, seed for numpy IVF).
+            Parameters the chosen backend does not use are ignored, so the same call works with "auto".
+
+    Returns:
+        NearestNeighbourIndex: The index, call build() to fill it.
+    """
+    kwargs.pop("kind", None)
+    if backend == "auto":
+        backend = "faiss" if faiss is not None else "numpy"
+    if backend == "faiss":
+        return FaissIndex(kind, **{key: value for key, value in kwargs.items() if key in FAISS_PARAMS})
+    if backend != "numpy":
+        raise ValueError(f"Unknown index backend '{backend}'.")
+
+    if kind == "hnsw":
+        warnings.warn("HNSW index needs faiss, falling back to the numpy IVF index.")
+        kind = "ivf"
+    if kind == "flat":
+        return FlatIndex()
+    if kind == "ivf":
+        return IVFIndex(**{key: value for key, value in kwargs.items() if key in IVF_PARAMS})
+    raise ValueError(f"Unknown index kind '{kind}'.")
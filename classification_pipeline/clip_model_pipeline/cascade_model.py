@@ -0,0 +1,93 @@
+from typing import List
+
+import numpy as np
+
+from project.classification_pipeline.clip_model_pipeline.clip_model import ClipModel
+from project.classification_pipeline.vocabulary import Vocabulary
+
+
+class CascadeClipModel:
+    """
+    Two CLIP backbones in a cascade. The small model labels every crop, only crops where the margin
+    between its top-1 and top-2 label is below margin_threshold are re-scored by the large model.
+    Has the same labelling interface as ClipModel, so IngredientClassifier can use either.
+
+    Attributes:
+        small_model (ClipModel): The cheap backbone that labels every crop.
+        large_model (ClipModel): The accurate backbone used for uncertain crops.
+        margin_threshold (float): Cosine distance margin below which a crop is re-scored.
+        n_labelled (int): Number of crops labelled so far.
+        n_rescored (int): Number of crops re-scored by the large model so far.
+    """
+    def __init__(self, small_model_name: str = "openai/clip-vit-base-patch32",
+                 large_model_name: str = "openai/clip-vit-large-patch14", margin_threshold: float = 0.02,
+                 **clip_kwargs):
+        """
+        Args:
+            small_model_name (str): The name of the small pre-trained CLIP model. default: clip-vit-base-patch32
+            large_model_name (str): The name of the large pre-trained CLIP model. default: clip-vit-large-patch14
+            margin_threshold (float): Cosine distance margin below which a crop is re-scored. default: 0.02
+            **clip_kwargs: Further arguments passed to both ClipModels (precision, index_kind, ...).
+        """
+        self.small_model = ClipModel(small_model_name, **clip_kwargs)
+        self.large_model = ClipModel(large_model_name, **clip_kwargs)
+        self.margin_threshold = margin_threshold
+        self.n_labelled = 0
+        self.n_rescored = 0
+
+    def load_label_store(self, root_folder: str):
+        """
+        Loads the label store of both backbones from root_folder.
+        """
+        self.small_model.load_label_store(root_folder)
+        self.large_model.load_label_store(root_folder)
+
+    def set_vocabulary(self, vocabulary: Vocabulary):
+        """
+        Sets the vocabulary of both backbones.
+        """
+        self.small_model.set_vocabulary(vocabulary)
+        self.large_model.set_vocabulary(vocabulary)
+
+    def label_image(self, image_path: str) -> str:
+        return self.label_images([image_path])[0]
+
+    def label_images(self, image_paths: List[str]) -> List[str]:
+        """
+        Labels a batch of images with the small model and re-scores the uncertain ones with the large model.
+
+        Args:
+            image_paths (List[str]): Paths to the images.
+
+        Returns:
+            List[str]: The best matching label for every image.
+        """
+        image_paths = list(image_paths)
+        labels, margins = self.small_model.label_images_with_margin(image_paths)
+        uncertain = np.flatnonzero(margins < self.margin_threshold)
+        if len(uncertain):
+            rescored = self.large_model.label_images([image_paths[i] for i in uncertain])
+            for i, label in zip(uncertain, rescored):
+                labels[i] = label
+        self.n_labelled += len(image_paths)
+        self.n_rescored += len(uncertain)
+        return labels
+
+    def label_ids(self, image_paths: List[str]) -> np.ndarray:
+        """
+        Like label_images(), but returns the category ids of the vocabulary set with set_vocabulary().
+
+        Args:
+            image_paths (List[str]): Paths to the images.
+
+        Returns:
+            np.ndarray: The category id of the best matching label for every image.
+        """
+        image_paths = list(image_paths)
+        ids, margins = self.small_model.label_ids_with_margin(image_paths)
+        uncertain = np.flatnonzero(margins < self.margin_threshold)
+        if len(uncertain):
+            ids[uncertain] = self.large_model.label_ids([image_paths[i] for i in uncertain])
+        self.n_labelled += len(image_paths)
+        self.n_rescored += len(uncertain)
+        return ids
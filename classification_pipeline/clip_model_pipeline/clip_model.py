@@ -1,14 +1,38 @@
+import contextlib
 import os
 import shutil
+import warnings
+from typing import List
 
 from tqdm import tqdm
 
+import project.paths as paths
+from project.classification_pipeline.clip_model_pipeline.embedding_cache import EmbeddingCache
 from project.classification_pipeline.clip_model_pipeline.embedding_model import EmbeddingModel
 import numpy as np
 import torch
 from PIL import Image
 from transformers import CLIPProcessor, CLIPModel
 
+PROMPT_TEMPLATES = [
+    "a photo of {}",
+    "a photo of a package of {}",
+    "a close-up photo of {}",
+    "a photo of {} in a fridge",
+]
+
+PRECISIONS = ("fp32", "bf16", "int8")
+
+
+def _stored_embedding_dim(input_folder: str) -> int | None:
+    """
+    Returns the dimension of the label embeddings stored directly in input_folder, None if there are none.
+    """
+    for file in sorted(os.listdir(input_folder)) if os.path.isdir(input_folder) else []:
+        if file.endswith("_embeddings.npy"):
+            return np.load(os.path.join(input_folder, file), mmap_mode="r").shape[-1]
+    return None
+
 
 # define the clip model class that inherits from the embedding model class
 class ClipModel(EmbeddingModel):
@@ -25,20 +49,49 @@ class ClipModel(EmbeddingModel):
                 Resizes the input image to the required dimensions for the CLIP model.
             _embed_image(image: Image) -> np.ndarray:
                 Generates an embedding for the input image.
+            _embed_images_batch(images: List[Image]) -> np.ndarray:
+                Generates embeddings for a batch of images in one forward pass.
             _embed_label(label: str) -> np.ndarray:
                 Generates an embedding for the input label.
+            _embed_labels_batch(labels: List[str]) -> np.ndarray:
+                Generates embeddings for a batch of labels in one forward pass.
         """
-    def __init__(self, model_name: str = "openai/clip-vit-large-patch14"):
+    def __init__(self, model_name: str = "openai/clip-vit-large-patch14", index_kind: str = "flat",
+                 use_embedding_cache: bool = True, precision: str = "fp32"):
         """
         Initializes the ClipModel with the specified model name.
 
         Args:
             model_name (str): The name of the pre-trained CLIP model to use. default: clip-vit-large-patch14
+            index_kind (str): Type of the label/gallery index ("flat", "ivf", "hnsw"). default: flat
+            use_embedding_cache (bool): Cache image embeddings in paths.config["embedding_cache"]. default: True
+            precision (str): Inference precision. "fp32", "bf16" (autocast) or "int8" (dynamic quantization
+                of the linear layers, CPU only). default: fp32
         """
-        super().__init__()
-        self.model = CLIPModel.from_pretrained(model_name).to(self.device)
+        if precision not in PRECISIONS:
+            raise ValueError(f"Invalid precision '{precision}'. Choose one of {PRECISIONS}.")
+        embedding_cache = None
+        if use_embedding_cache and paths.config.get("embedding_cache"):
+            embedding_cache = EmbeddingCache(paths.config["embedding_cache"])
+        super().__init__(index_kind=index_kind, embedding_cache=embedding_cache)
+        self.model_name = model_name
+        self.precision = precision
+        if precision == "int8" and self.device != "cpu":
+            warnings.warn("int8 dynamic quantization is only supported on CPU, running the CLIP model on CPU.")
+            self.device = "cpu"
+        self.model = CLIPModel.from_pretrained(model_name).to(self.device).eval()
+        if precision == "int8":
+            self.model = torch.ao.quantization.quantize_dynamic(self.model, {torch.nn.Linear}, dtype=torch.qint8)
         self.processor = CLIPProcessor.from_pretrained(model_name)
 
+    def _inference_context(self):
+        """
+        Returns the context the forward passes run in, bf16 autocast for the "bf16" precision.
+        """
+        if self.precision == "bf16":
+            return torch.autocast(device_type=self.device, dtype=torch.bfloat16)
+        return contextlib.nullcontext()
+
     def _preprocess_image(self, image: Image) -> Image:
         """
         Resizes the input image to the required dimensions for the CLIP model.
@@ -62,9 +115,24 @@ class ClipModel(EmbeddingModel):
             np.ndarray: The embedding of the image.
         """
         inputs = self.processor(images=image, return_tensors="pt").to(self.device)
-        with torch.no_grad():
+        with torch.no_grad(), self._inference_context():
+            image_features = self.model.get_image_features(**inputs)
+        return image_features.float().cpu().numpy().flatten()
+
+    def _embed_images_batch(self, images: List[Image.Image]) -> np.ndarray:
+        """
+        Generates embeddings for a batch of images in one forward pass.
+
+        Args:
+            images (List[Image.Image]): The preprocessed images.
+
+        Returns:
+            np.ndarray: The embeddings of shape (len(images), dim).
+        """
+        inputs = self.processor(images=images, return_tensors="pt").to(self.device)
+        with torch.no_grad(), self._inference_context():
             image_features = self.model.get_image_features(**inputs)
-        return image_features.cpu().numpy().flatten()
+        return image_features.float().cpu().numpy()
 
     def save_embedded_labels(self, output_folder: str):
         """
@@ -91,16 +159,60 @@ class ClipModel(EmbeddingModel):
         except (OSError, IOError) as e:
             print(f"Error saving embeddings: {e}")
 
+    def label_store_folder(self, root_folder: str) -> str:
+        """
+        Returns the folder of this backbone's label store inside root_folder.
+        Every backbone needs its own store, embeddings of different models are not comparable.
+
+        Args:
+            root_folder (str): The folder with label stores, paths.config["embedded_labels"].
+
+        Returns:
+            str: The label store folder of this model.
+        """
+        return os.path.join(root_folder, self.model_name.replace("/", "__"))
+
+    def load_label_store(self, root_folder: str):
+        """
+        Loads this backbone's label embeddings from root_folder. Falls back to label embeddings stored
+        directly in root_folder, where stores were saved before they were split per backbone, but only
+        if they have the embedding dimension of this model.
+
+        Args:
+            root_folder (str): The folder with label stores, paths.config["embedded_labels"].
+
+        Raises:
+            FileNotFoundError: If there is no label store for this backbone.
+        """
+        input_folder = self.label_store_folder(root_folder)
+        if not os.path.isdir(input_folder):
+            stored_dim = _stored_embedding_dim(root_folder)
+            if stored_dim != self.model.config.projection_dim:
+                found = f"labels with {stored_dim}-d embeddings" if stored_dim else "no labels"
+                raise FileNotFoundError(
+                    f"No label store for {self.model_name} in {input_folder} and {root_folder} holds {found} "
+                    f"(the model needs {self.model.config.projection_dim}-d). Run embed_labels.py with "
+                    f"model_name = \"{self.model_name}\" to create it.")
+            input_folder = root_folder
+        self.load_label_embeddings(input_folder)
+
     def load_label_embeddings(self, input_folder):
+        """
+        Replaces the label embeddings with the ones stored in input_folder, labels removed from the
+        store are dropped.
+        """
+        label_embeddings = {}
         for file in tqdm(os.listdir(input_folder), desc="Loading label embeddings"):
             file_path = os.path.join(input_folder, file)
             if os.path.isfile(file_path) and file.endswith("_embeddings.npy"):
                 try:
                     embeddings = np.load(file_path)
                     label = "_".join(file.split("_")[:-1])  # More robust label extraction
-                    self._label_embeddings[label] = embeddings
+                    label_embeddings[label] = embeddings
                 except (OSError, IOError) as e:
                     print(f"Error loading file {file}: {e}")
+        self._label_embeddings = label_embeddings
+        self._label_index = None
     def _embed_label(self, label: str) -> np.ndarray:
         """
         Generates an embedding for the input label.
@@ -112,6 +224,21 @@ class ClipModel(EmbeddingModel):
             np.ndarray: The embedding of the label.
         """
         inputs = self.processor(text=[label], return_tensors="pt").to(self.device)
-        with torch.no_grad():
+        with torch.no_grad(), self._inference_context():
+            text_features = self.model.get_text_features(**inputs)
+        return text_features.float().cpu().numpy().flatten()
+
+    def _embed_labels_batch(self, labels: List[str]) -> np.ndarray:
+        """
+        Generates embeddings for a batch of labels in one forward pass.
+
+        Args:
+            labels (List[str]): The labels to embed, padded to the longest one.
+
+        Returns:
+            np.ndarray: The embeddings of shape (len(labels), dim).
+        """
+        inputs = self.processor(text=labels, return_tensors="pt", padding=True).to(self.device)
+        with torch.no_grad(), self._inference_context():
             text_features = self.model.get_text_features(**inputs)
-        return text_features.cpu().numpy().flatten()
\ No newline at end of file
+        return text_features.float().cpu().numpy()
@@ -1,18 +1,28 @@
 
 import yaml
 
-from clip_model import ClipModel
+from clip_model import ClipModel, PROMPT_TEMPLATES
 import project.paths as paths
 from project.recipe_dataset.ingredients_functions import load_ingredients
 
-input_file = paths.config["ingredients_dict"]
-composite_ingredients, single_ingredients = load_ingredients(input_file)
+# One embedding per unified label (mean over its synonyms) instead of one per synonym
+group_synonyms = False
 
-ingredients = composite_ingredients + single_ingredients
-clip_model = ClipModel()
+# Every CLIP backbone gets its own label store, e.g. "openai/clip-vit-base-patch32" for the cascade
+model_name = "openai/clip-vit-large-patch14"
 
-# clip_model.load_label_embeddings("./embedded_labels")
-clip_model.embed_labels(ingredients)
-clip_model.save_embedded_labels(paths.config["embedded_labels"])
+input_file = paths.config["ingredients_dict"]
+clip_model = ClipModel(model_name)
 
+# clip_model.load_label_embeddings("./embedded_labels")
+if group_synonyms:
+    with open(input_file, "r") as f:
+        ingredients_config = yaml.safe_load(f)
+    groups = {unified: synonyms for category in ingredients_config.values() for unified, synonyms in category.items()}
+    clip_model.embed_label_groups(groups, templates=PROMPT_TEMPLATES)
+else:
+    composite_ingredients, single_ingredients = load_ingredients(input_file)
+    ingredients = composite_ingredients + single_ingredients
+    clip_model.embed_labels(ingredients, templates=PROMPT_TEMPLATES)
+clip_model.save_embedded_labels(clip_model.label_store_folder(paths.config["embedded_labels"]))
 
@@ -0,0 +1,153 @@
+import hashlib
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from PIL import Image
+
+
+def image_content_hash(image: Image) -> str:
+    """
+    Computes a hash of the decoded pixels of an image, so the same crop saved under
+    a different file name (or re-encoded losslessly) maps to the same key.
+
+    Args:
+        image (Image): The image to hash.
+
+    Returns:
+        str: Hex digest of the pixel data.
+    """
+    digest = hashlib.blake2b(digest_size=20)
+    digest.update(f"{image.mode}:{image.size[0]}x{image.size[1]}".encode())
+    digest.update(image.tobytes())
+    return digest.hexdigest()
+
+
+class EmbeddingCache:
+    """
+    Content-addressed embedding cache. Vectors are stored in an SQLite file keyed by
+    (model name, image pixel hash) with an in-memory LRU in front of it.
+
+    Attributes:
+        db_path (str | None): Path to the SQLite file, None keeps the cache in memory only.
+        max_memory_items (int): Capacity of the in-memory LRU.
+        hits (int): Number of lookups served from the cache.
+        misses (int): Number of lookups that were not in the cache.
+    """
+    def __init__(self, db_path: str | None = None, max_memory_items: int = 10000):
+        self.db_path = db_path
+        self.max_memory_items = max_memory_items
+        self.hits = 0
+        self.misses = 0
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._connection = None
+        if db_path is not None:
+            os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+            self.reopen()
+
+    def reopen(self):
+        """
+        Opens a new connection to the SQLite file. A connection must not be used across fork(),
+        worker processes call this after they are started.
+        """
+        if self.db_path is None:
+            return
+        self._lock = threading.Lock()
+        # Several processes may write at the same time, wait for the lock instead of failing
+        self._connection = sqlite3.connect(self.db_path, check_same_thread=False, timeout=30)
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "model TEXT NOT NULL, hash TEXT NOT NULL, dtype TEXT NOT NULL, vector BLOB NOT NULL, "
+            "PRIMARY KEY (model, hash))")
+        self._connection.commit()
+
+    def get(self, model_name: str, content_hash: str) -> np.ndarray | None:
+        """
+        Looks up an embedding.
+
+        Args:
+            model_name (str): Name of the model that produced the embedding.
+            content_hash (str): Hash returned by image_content_hash().
+
+        Returns:
+            np.ndarray | None: The cached embedding or None on a miss.
+        """
+        key = (model_name, content_hash)
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return self._memory[key]
+            row = None
+            if self._connection is not None:
+                row = self._connection.execute(
+                    "SELECT dtype, vector FROM embeddings WHERE model = ? AND hash = ?", key).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            embedding = np.frombuffer(row[1], dtype=row[0])
+            self._remember(key, embedding)
+            return embedding
+
+    def put(self, model_name: str, content_hash: str, embedding: np.ndarray):
+        """
+        Stores an embedding.
+
+        Args:
+            model_name (str): Name of the model that produced the embedding.
+            content_hash (str): Hash returned by image_content_hash().
+            embedding (np.ndarray): The embedding to store.
+        """
+        self.put_many(model_name, [content_hash], [embedding])
+
+    def put_many(self, model_name: str, content_hashes: list, embeddings):
+        """
+        Stores several embeddings in one SQLite transaction.
+
+        Args:
+            model_name (str): Name of the model that produced the embeddings.
+            content_hashes (list): Hashes returned by image_content_hash().
+            embeddings: The embeddings to store, one per hash.
+        """
+        rows = []
+        with self._lock:
+            for content_hash, embedding in zip(content_hashes, embeddings):
+                embedding = np.ascontiguousarray(embedding)
+                self._remember((model_name, content_hash), embedding)
+                rows.append((model_name, content_hash, embedding.dtype.str, embedding.tobytes()))
+            if self._connection is not None and rows:
+                with self._connection:  # One commit for all rows
+                    self._connection.executemany(
+                        "INSERT OR REPLACE INTO embeddings (model, hash, dtype, vector) VALUES (?, ?, ?, ?)", rows)
+
+    def _remember(self, key, embedding: np.ndarray):
+        self._memory[key] = embedding
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_items:
+            self._memory.popitem(last=False)
+
+    def clear(self, model_name: str | None = None):
+        """
+        Removes cached embeddings of one model, or of all models if model_name is None.
+        """
+        with self._lock:
+            if model_name is None:
+                self._memory.clear()
+            else:
+                for key in [key for key in self._memory if key[0] == model_name]:
+                    del self._memory[key]
+            if self._connection is not None:
+                if model_name is None:
+                    self._connection.execute("DELETE FROM embeddings")
+                else:
+                    self._connection.execute("DELETE FROM embeddings WHERE model = ?", (model_name,))
+                self._connection.commit()
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
@@ -1,15 +1,20 @@
 import abc as abc
+import itertools
 import json
 import os
 import warnings
 from collections import defaultdict
-from typing import List, Any
+from typing import List, Any, Dict
 
 import numpy as np
 import torch
 from PIL import Image
 from tqdm import tqdm
 import project.paths as paths
+from project.classification_pipeline.clip_model_pipeline.ann_index import NearestNeighbourIndex, create_index
+from project.classification_pipeline.clip_model_pipeline.embedding_cache import EmbeddingCache, image_content_hash
+from project.classification_pipeline.profiler import profiler
+from project.classification_pipeline.vocabulary import Vocabulary
 
 # define the embedding model abstract class that uses abc module
 class EmbeddingModel(abc.ABC):
@@ -22,8 +27,13 @@ class EmbeddingModel(abc.ABC):
         _label_embeddings (list): A list to store label embeddings.
         tracks_embedded (bool): A flag indicating if tracks have been embedded.
         labels_embedded (bool): A flag indicating if labels have been embedded.
+        index_kind (str): Type of the nearest-neighbour index used for label and gallery lookup ("flat", "ivf", "hnsw").
+        model_name (str | None): Name of the underlying model, used as the embedding cache namespace.
+        precision (str): Inference precision of the model ("fp32", "bf16", "int8"), part of the cache namespace.
+        embedding_cache (EmbeddingCache | None): Cache of image embeddings keyed by pixel hash, None disables caching.
+        vocabulary (Vocabulary | None): Maps the labels of the label index to category ids in label_ids().
     """
-    def __init__(self):
+    def __init__(self, index_kind: str = "flat", embedding_cache: EmbeddingCache | None = None):
         """
         Initializes the EmbeddingModel with default values.
         """
@@ -32,6 +42,18 @@ class EmbeddingModel(abc.ABC):
         self._label_embeddings = {}
         self.tracks_embedded = False
         self.labels_embedded = False
+        self.index_kind = index_kind
+        self.model_name = None
+        self.precision = "fp32"
+        self.embedding_cache = embedding_cache
+        self._label_index = None
+        self._gallery_index = None
+        self._gallery_embeddings = []
+        self._gallery_labels = []
+        self.vocabulary = None
+        self._category_table = None
+        self._category_lookup_key = None
+
     @abc.abstractmethod
     def _preprocess_image(self, image: Image) -> Image:
         """
@@ -53,8 +75,88 @@ class EmbeddingModel(abc.ABC):
     def _embed_label(self, label: str) -> np.ndarray:
         pass
 
-    def embed_image(self, image_path):
-        return self._embed_image(self._preprocess_image(Image.open(image_path)))
+    def _embed_labels_batch(self, labels: List[str]) -> np.ndarray:
+        """
+        Generates embeddings for a batch of labels. Override in child classes
+        that can encode several texts in one forward pass.
+
+        Args:
+            labels (List[str]): The labels to embed.
+
+        Returns:
+            np.ndarray: Array of shape (len(labels), dim).
+        """
+        return np.stack([self._embed_label(label) for label in labels])
+
+    def _embed_images_batch(self, images: List[Image.Image]) -> np.ndarray:
+        """
+        Generates embeddings for a batch of preprocessed images. Override in child classes
+        that can encode several images in one forward pass.
+
+        Args:
+            images (List[Image.Image]): The preprocessed images.
+
+        Returns:
+            np.ndarray: Array of shape (len(images), dim).
+        """
+        return np.stack([self._embed_image(image) for image in images])
+
+    def embed_image(self, image_path: str | Image.Image) -> np.ndarray:
+        """
+        Embeds an image, consulting the embedding cache first.
+
+        Args:
+            image_path (str | Image.Image): Path to the image or an already opened image.
+
+        Returns:
+            np.ndarray: The embedding of the image.
+        """
+        image = image_path if isinstance(image_path, Image.Image) else Image.open(image_path)
+        if self.embedding_cache is None or self.model_name is None:
+            return self._embed_image(self._preprocess_image(image))
+
+        namespace = f"{self.model_name}:{self.precision}"
+        content_hash = image_content_hash(image)
+        embedding = self.embedding_cache.get(namespace, content_hash)
+        if embedding is None:
+            embedding = self._embed_image(self._preprocess_image(image))
+            self.embedding_cache.put(namespace, content_hash, embedding)
+        return embedding
+
+    def embed_images(self, image_paths, batch_size: int = 256) -> np.ndarray:
+        """
+        Embeds many images, batch_size at a time in one forward pass. Images found in the embedding
+        cache are not embedded again.
+
+        Args:
+            image_paths: Iterable of paths to the images or already opened images.
+            batch_size (int): Number of images per forward pass.
+
+        Returns:
+            np.ndarray: Array of shape (number of images, dim).
+        """
+        use_cache = self.embedding_cache is not None and self.model_name is not None
+        namespace = f"{self.model_name}:{self.precision}"
+        embeddings = []
+        image_paths = iter(image_paths)
+        while chunk := list(itertools.islice(image_paths, batch_size)):
+            images = [image_path if isinstance(image_path, Image.Image) else Image.open(image_path)
+                      for image_path in chunk]
+            chunk_embeddings = [None] * len(images)
+            content_hashes = [image_content_hash(image) for image in images] if use_cache else []
+            if use_cache:
+                chunk_embeddings = [self.embedding_cache.get(namespace, content_hash) for content_hash in content_hashes]
+            missing = [i for i, embedding in enumerate(chunk_embeddings) if embedding is None]
+            if missing:
+                computed = self._embed_images_batch([self._preprocess_image(images[i]) for i in missing])
+                for i, embedding in zip(missing, computed):
+                    chunk_embeddings[i] = embedding
+                if use_cache:
+                    self.embedding_cache.put_many(namespace, [content_hashes[i] for i in missing], computed)
+            embeddings.extend(chunk_embeddings)
+        if not embeddings:
+            return np.zeros((0, 0), dtype=np.float32)
+        return np.stack(embeddings)
 
     def embed_tracks(self, image_folder: str, strategy: str|None=None, output_folder: str|None =None):
         """
@@ -87,16 +189,62 @@ class EmbeddingModel(abc.ABC):
         if output_folder is not None:
             self.save_track_embeddings(output_folder)
 
-    def embed_labels(self, labels: List[str]):
+    def _embed_prompts(self, labels: List[str], templates: List[str] | None, batch_size: int) -> np.ndarray:
+        """
+        Embeds every label formatted with every template, in batches.
+
+        Returns:
+            np.ndarray: Normalized embeddings of shape (len(labels), len(templates), dim).
+        """
+        templates = templates or ["{}"]
+        prompts = [template.format(label) for label in labels for template in templates]
+        batches = [self._embed_labels_batch(prompts[i:i + batch_size])
+                   for i in tqdm(range(0, len(prompts), batch_size), desc="Calculating label embeddings")]
+        embeddings = np.concatenate(batches).reshape(len(labels), len(templates), -1)
+        return embeddings / np.linalg.norm(embeddings, axis=-1, keepdims=True)
+
+    def embed_labels(self, labels: List[str], templates: List[str] | None = None, batch_size: int = 256):
         """
-        Embeds a list of labels.
+        Embeds a list of labels. With templates, every label is embedded as the mean of
+        its prompts (e.g. "a photo of {}") which is more robust than the bare label.
+
         Args:
             labels (List[str]): The list of labels to embed.
+            templates (List[str] | None): Prompt templates with a single "{}" placeholder.
+            batch_size (int): Number of prompts encoded in one forward pass.
+        """
+        if not labels:
+            return
+        embeddings = self._embed_prompts(labels, templates, batch_size).mean(axis=1)
+        for label, embedding in zip(labels, embeddings):
+            self._label_embeddings[label] = embedding / np.linalg.norm(embedding)
+        self.labels_embedded = True
+        self._label_index = None
+
+    def embed_label_groups(self, groups: Dict[str, List[str]], templates: List[str] | None = None,
+                           batch_size: int = 256):
+        """
+        Embeds groups of synonyms, storing one embedding per group key computed as the mean
+        over all synonyms and templates. Used to get one embedding per unified label.
+
+        Args:
+            groups (Dict[str, List[str]]): Mapping from group key (unified label) to its synonyms.
+            templates (List[str] | None): Prompt templates with a single "{}" placeholder.
+            batch_size (int): Number of prompts encoded in one forward pass.
         """
-        for label in tqdm(labels, desc="Calculating label embeddings"):
-            embed_label = self._embed_label(label)
-            self._label_embeddings[label] = embed_label
+        synonyms = [synonym for group in groups.values() for synonym in group]
+        if not synonyms:
+            return
+        embeddings = self._embed_prompts(synonyms, templates, batch_size).mean(axis=1)
+        start = 0
+        for key, group in groups.items():
+            if not group:
+                continue
+            embedding = embeddings[start:start + len(group)].mean(axis=0)
+            self._label_embeddings[key] = embedding / np.linalg.norm(embedding)
+            start += len(group)
         self.labels_embedded = True
+        self._label_index = None
 
     def get_labels(self) -> np.ndarray:
         """
@@ -281,26 +429,209 @@ class EmbeddingModel(abc.ABC):
             track_labels[track_id] = best_label
 
         return track_labels
+    def build_label_index(self, **index_params) -> NearestNeighbourIndex:
+        """
+        Builds the nearest-neighbour index over the label embeddings.
+
+        Args:
+            **index_params: Parameters passed to create_index() (backend, n_lists, n_probe, ...).
+
+        Returns:
+            NearestNeighbourIndex: The built index.
+        """
+        if not self._label_embeddings:
+            raise ValueError("No label embeddings available. Call embed_labels() or load_label_embeddings() first.")
+        self._label_index = create_index(self.index_kind, **index_params)
+        self._label_index.build(np.stack(list(self._label_embeddings.values())), list(self._label_embeddings.keys()))
+        return self._label_index
+
+    def save_label_index(self, output_folder: str):
+        """
+        Saves the label index to the specified folder, so it does not have to be rebuilt.
+
+        Args:
+            output_folder (str): The folder to save the index to.
+        """
+        if self._label_index is None:
+            self.build_label_index()
+        self._label_index.save(output_folder)
+
+    def load_label_index(self, input_folder: str):
+        """
+        Loads a label index previously stored with save_label_index().
+
+        Args:
+            input_folder (str): The folder to load the index from.
+        """
+        self._label_index = NearestNeighbourIndex.load(input_folder)
+
+    def add_to_gallery(self, image_paths: List[str], labels: List[str]):
+        """
+        Adds reference crops to the few-shot gallery.
+
+        Args:
+            image_paths (List[str]): Paths to the reference crops.
+            labels (List[str]): Label of every reference crop.
+        """
+        for image_path, label in zip(image_paths, labels):
+            self._gallery_embeddings.append(self.embed_image(image_path))
+            self._gallery_labels.append(label)
+        self._gallery_index = None
+
+    def build_gallery_index(self, **index_params) -> NearestNeighbourIndex:
+        """
+        Builds the nearest-neighbour index over the gallery embeddings.
+
+        Args:
+            **index_params: Parameters passed to create_index() (backend, n_lists, n_probe, ...).
+
+        Returns:
+            NearestNeighbourIndex: The built index.
+        """
+        if not self._gallery_embeddings:
+            raise ValueError("Gallery is empty. Call add_to_gallery() or load_gallery_index() first.")
+        self._gallery_index = create_index(self.index_kind, **index_params)
+        self._gallery_index.build(np.stack(self._gallery_embeddings), self._gallery_labels)
+        return self._gallery_index
+
+    def save_gallery_index(self, output_folder: str):
+        """
+        Saves the gallery index to the specified folder.
+
+        Args:
+            output_folder (str): The folder to save the index to.
+        """
+        if self._gallery_index is None:
+            self.build_gallery_index()
+        self._gallery_index.save(output_folder)
+
+    def load_gallery_index(self, input_folder: str):
+        """
+        Loads a gallery index previously stored with save_gallery_index().
+
+        Args:
+            input_folder (str): The folder to load the index from.
+        """
+        self._gallery_index = NearestNeighbourIndex.load(input_folder)
+
     def label_image(self, image_path: str) -> str:
         """
+        Finds the label closest to the image by cosine distance.
+
+        Args:
+            image_path (str): Path to the image.
+
+        Returns:
+            str: The best matching label.
         """
+        return self.label_images([image_path])[0]
 
-        image_embedding = self.embed_image(image_path)
-        distances = [self.cosine_distance(image_embedding, label_emb) for label_emb in self._label_embeddings.values()]
-        best_label_index = np.argmin(distances)
-        best_label = list(self._label_embeddings.keys())[best_label_index]
+    def label_images(self, image_paths: List[str]) -> List[str]:
+        """
+        Labels a batch of images with a single query to the label index.
 
-        return best_label
+        Args:
+            image_paths (List[str]): Paths to the images.
 
+        Returns:
+            List[str]: The best matching label for every image.
+        """
+        return self.label_images_with_margin(image_paths)[0]
 
-# TODO: add following functionality in the future
+    def label_images_with_margin(self, image_paths: List[str]) -> tuple[List[str], np.ndarray]:
+        """
+        Labels a batch of images and returns how confident the decision was.
 
-    # def _embed_images_batch(self, images: List[Image]) -> np.ndarray:
-    #     images = [self._preprocess_image(image) for image in images]
-    #     inputs = self.processor(images=images, return_tensors="pt", padding=True).to(self.device)
-    #     with torch.no_grad():
-    #         image_features = self.model.get_image_features(**inputs)
-    #     return image_features.cpu().numpy()
+        Args:
+            image_paths (List[str]): Paths to the images.
+
+        Returns:
+            tuple[List[str], np.ndarray]: The best matching label for every image and the margin between
+                the cosine distances of the second and the first label (inf if there is a single label, 0 if
+                an approximate index did not find a second label, so the image counts as uncertain).
+        """
+        indices, margins = self._query_label_index(image_paths)
+        return [self._label_index.keys[i] for i in indices], margins
+
+    def label_ids_with_margin(self, image_paths: List[str]) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Like label_images_with_margin(), but returns the category ids of the vocabulary set with
+        set_vocabulary(). The index rows are mapped to ids with one integer array lookup.
+
+        Args:
+            image_paths (List[str]): Paths to the images.
+
+        Returns:
+            tuple[np.ndarray, np.ndarray]: The category id of the best matching label for every image and the margins.
+        """
+        indices, margins = self._query_label_index(image_paths)
+        return self._category_lookup()[indices], margins
+
+    def label_ids(self, image_paths: List[str]) -> np.ndarray:
+        return self.label_ids_with_margin(image_paths)[0]
+
+    def set_vocabulary(self, vocabulary: Vocabulary):
+        """
+        Sets the vocabulary that label_ids() maps the labels of the label index to.
+        """
+        self.vocabulary = vocabulary
+
+    def _category_lookup(self) -> np.ndarray:
+        """
+        Returns the category id of every row of the label index, rebuilt when the index or the vocabulary changed.
+        """
+        if self.vocabulary is None:
+            raise ValueError("No vocabulary set. Call set_vocabulary() first.")
+        if self._label_index is None:
+            self.build_label_index()
+        if self._category_lookup_key != (self._label_index, self.vocabulary.version):
+            self._category_table = self.vocabulary.lookup_table(self._label_index.keys)
+            self._category_lookup_key = (self._label_index, self.vocabulary.version)
+        return self._category_table
+
+    def _query_label_index(self, image_paths: List[str]) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Embeds the images and finds their two closest labels.
+
+        Returns:
+            tuple[np.ndarray, np.ndarray]: Index row of the best label of every image and the margins.
+        """
+        if self._label_index is None:
+            self.build_label_index()
+        with profiler.span("clip_embed"):
+            image_embeddings = self.embed_images(image_paths)
+        with profiler.span("label_scoring"):
+            distances, indices = self._label_index.query(image_embeddings, k=2)
+        if distances.shape[1] < 2:
+            margins = np.full(len(image_paths), np.inf)
+        else:
+            margins = distances[:, 1] - distances[:, 0]
+        return indices[:, 0], margins
+
+    def label_images_by_gallery(self, image_paths: List[str], k: int = 5) -> List[str]:
+        """
+        Labels a batch of images by a majority vote of the k closest reference crops in the gallery.
+
+        Args:
+            image_paths (List[str]): Paths to the images.
+            k (int): Number of gallery neighbours that vote.
+
+        Returns:
+            List[str]: The winning label for every image.
+        """
+        if self._gallery_index is None:
+            self.build_gallery_index()
+        image_embeddings = self.embed_images(image_paths)
+        predictions = []
+        for neighbours in self._gallery_index.query_keys(image_embeddings, k=k):
+            votes = defaultdict(float)
+            for label, distance in neighbours:
+                votes[label] += 1 - distance
+            predictions.append(max(votes, key=votes.get))
+        return predictions
+
+
+# TODO: add following functionality in the future
 
 # # Výpočet nejlepšího labelu na základě průměrné vzdálenosti ke clusteru
 # track_labels = {}
@@ -0,0 +1,53 @@
+import os
+from collections import defaultdict
+
+
+class CocoIndex:
+    """
+    Indexed view of COCO data. The lookup maps are built once, so no stage has to scan
+    all images or annotations to find the ones belonging together.
+    The index keeps references to the original dicts, changes of an annotation (e.g. its
+    category_id) are visible through the index. Call refresh() after adding or removing entries.
+
+    Attributes:
+        coco_data (dict): The indexed COCO data.
+        images (dict): Image id -> image dict.
+        annotations_by_image (defaultdict): Image id -> list of annotation dicts.
+        category_names (dict): Category id -> category name.
+    """
+    def __init__(self, coco_data: dict):
+        self.coco_data = coco_data
+        self.refresh()
+
+    def refresh(self):
+        """
+        Rebuilds the lookup maps from coco_data.
+        """
+        self.images = {image['id']: image for image in self.coco_data.get('images', [])}
+        self.annotations_by_image = defaultdict(list)
+        for annotation in self.coco_data.get('annotations', []):
+            self.annotations_by_image[annotation['image_id']].append(annotation)
+        self.category_names = {category['id']: category['name'] for category in self.coco_data.get('categories', [])}
+
+    def image(self, image_id) -> dict | None:
+        return self.images.get(image_id)
+
+    def file_name(self, image_id) -> str | None:
+        """
+        Returns the base name of the image file, or None for an unknown image id.
+        """
+        image = self.images.get(image_id)
+        return os.path.basename(image['file_name']) if image is not None else None
+
+    def annotations(self, image_id) -> list:
+        return self.annotations_by_image.get(image_id, [])
+
+    def category_name(self, category_id) -> str | None:
+        return self.category_names.get(category_id)
+
+    def ingredients(self, image_id) -> list:
+        """
+        Returns the unique category names annotated in an image, in order of first appearance.
+        """
+        names = (self.category_names.get(annotation.get('category_id')) for annotation in self.annotations(image_id))
+        return list(dict.fromkeys(name for name in names if name is not None))
@@ -0,0 +1,192 @@
+import json
+
+import numpy as np
+
+
+class DetectionResult:
+    """
+    Columnar detection results. Boxes, scores and ids of all detections are stored in numpy arrays,
+    the row index of a detection is its annotation id. The COCO dict is only built when it is asked for.
+
+    Attributes:
+        boxes (np.ndarray): float32 array (n, 4) of boxes [x_min, y_min, width, height].
+        scores (np.ndarray): float32 array (n,) of detection confidences.
+        image_ids (np.ndarray): int64 array (n,) of image ids.
+        category_ids (np.ndarray): int64 array (n,) of category ids.
+        model_ids (np.ndarray): int8 array (n,) of the detector that produced the box.
+        images (list): COCO image dicts (id, file_name, width, height).
+        categories (list): COCO category dicts (id, name).
+        info (dict): COCO info dict.
+    """
+    def __init__(self, info: dict | None = None):
+        self.info = info or {}
+        self.images = []
+        self.categories = []
+        self.boxes = np.zeros((0, 4), dtype=np.float32)
+        self.scores = np.zeros(0, dtype=np.float32)
+        self.image_ids = np.zeros(0, dtype=np.int64)
+        self.category_ids = np.zeros(0, dtype=np.int64)
+        self.model_ids = np.zeros(0, dtype=np.int8)
+        self._pending = []
+        self._coco = None
+
+    def __len__(self):
+        self._flush()
+        return len(self.scores)
+
+    def add_image(self, image_info: dict, boxes: np.ndarray, scores: np.ndarray, model_ids: np.ndarray,
+                  category_ids: np.ndarray | None = None):
+        """
+        Adds an image and its detections.
+
+        Args:
+            image_info (dict): COCO image dict, must contain "id".
+            boxes (np.ndarray): Array (k, 4) of boxes [x_min, y_min, width, height].
+            scores (np.ndarray): Array (k,) of confidences.
+            model_ids (np.ndarray): Array (k,) of detector ids.
+            category_ids (np.ndarray | None): Array (k,) of category ids, default 0.
+        """
+        self.images.append(image_info)
+        n = len(scores)
+        if category_ids is None:
+            category_ids = np.zeros(n, dtype=np.int64)
+        self._pending.append((np.asarray(boxes, dtype=np.float32).reshape(-1, 4),
+                              np.asarray(scores, dtype=np.float32),
+                              np.full(n, image_info["id"], dtype=np.int64),
+                              np.asarray(category_ids, dtype=np.int64),
+                              np.asarray(model_ids, dtype=np.int8)))
+        self._coco = None
+
+    def _flush(self):
+        """Concatenates the per-image chunks added since the last flush into the columns."""
+        if not self._pending:
+            return
+        columns = list(zip(*self._pending))
+        self.boxes = np.concatenate([self.boxes, *columns[0]])
+        self.scores = np.concatenate([self.scores, *columns[1]])
+        self.image_ids = np.concatenate([self.image_ids, *columns[2]])
+        self.category_ids = np.concatenate([self.category_ids, *columns[3]])
+        self.model_ids = np.concatenate([self.model_ids, *columns[4]])
+        self._pending = []
+
+    def for_image(self, image_id: int) -> np.ndarray:
+        """
+        Returns the row indices (annotation ids) of the detections of one image.
+        """
+        self._flush()
+        return np.flatnonzero(self.image_ids == image_id)
+
+    def set_category_ids(self, annotation_ids, category_ids):
+        """
+        Assigns categories to detections. Keeps an already built COCO dict in sync.
+
+        Args:
+            annotation_ids: Row indices of the detections.
+            category_ids: New category id for every detection.
+        """
+        self._flush()
+        annotation_ids = np.asarray(annotation_ids, dtype=np.int64)
+        self.category_ids[annotation_ids] = category_ids
+        if self._coco is not None:
+            annotations = self._coco["annotations"]
+            for annotation_id, category_id in zip(annotation_ids.tolist(), self.category_ids[annotation_ids].tolist()):
+                annotations[annotation_id]["category_id"] = category_id
+
+    def set_categories(self, categories: list):
+        """
+        Replaces the COCO category list.
+        """
+        self.categories = categories
+        if self._coco is not None:
+            self._coco["categories"] = categories
+
+    def to_coco(self, image_ids: list | None = None) -> dict:
+        """
+        Returns the results as a COCO dict. The dict of all images is built once and cached, later changes
+        made through set_category_ids() and set_categories() are applied to it.
+
+        Args:
+            image_ids (list | None): Only include these images. The dict is built anew and not cached,
+                the annotation ids stay the row indices.
+
+        Returns:
+            dict: COCO data with info, images, annotations and categories.
+        """
+        self._flush()
+        if image_ids is not None:
+            rows = np.flatnonzero(np.isin(self.image_ids, image_ids))
+            image_ids = set(image_ids)
+            return self._build_coco(rows, [image_info for image_info in self.images if image_info["id"] in image_ids])
+        if self._coco is None:
+            self._coco = self._build_coco(np.arange(len(self.scores)), self.images)
+        return self._coco
+
+    def _build_coco(self, rows: np.ndarray, images: list) -> dict:
+        """Builds the COCO dict of the given rows and images."""
+        boxes = np.round(self.boxes[rows].astype(np.float64), 2)
+        areas = (boxes[:, 2] * boxes[:, 3]).tolist()
+        return {
+            "info": self.info,
+            "images": images,
+            "annotations": [
+                {"id": i, "image_id": image_id, "bbox": box, "area": area, "iscrowd": 0,
+                 "category_id": category_id, "score": score, "model": model_id}
+                for i, image_id, box, area, category_id, score, model_id in zip(
+                    rows.tolist(), self.image_ids[rows].tolist(), boxes.tolist(), areas,
+                    self.category_ids[rows].tolist(), np.round(self.scores[rows].astype(np.float64), 4).tolist(),
+                    self.model_ids[rows].tolist())
+            ],
+            "categories": self.categories,
+        }
+
+    @classmethod
+    def from_coco(cls, coco_data: dict) -> "DetectionResult":
+        """
+        Builds a DetectionResult from COCO data. Annotations are re-numbered by their order.
+        """
+        result = cls(coco_data.get("info"))
+        result.images = list(coco_data.get("images", []))
+        result.categories = list(coco_data.get("categories", []))
+        annotations = coco_data.get("annotations", [])
+        result.boxes = np.array([a["bbox"] for a in annotations], dtype=np.float32).reshape(-1, 4)
+        result.scores = np.array([a.get("score", 1.0) for a in annotations], dtype=np.float32)
+        result.image_ids = np.array([a["image_id"] for a in annotations], dtype=np.int64)
+        result.category_ids = np.array([a.get("category_id", 0) for a in annotations], dtype=np.int64)
+        result.model_ids = np.array([a.get("model", 0) for a in annotations], dtype=np.int8)
+        return result
+
+    def save(self, output_file: str):
+        """
+        Saves the results. A ".npz" path stores the columns in binary, anything else is written as compact COCO JSON.
+
+        Args:
+            output_file (str): Path to the output file.
+        """
+        if output_file.endswith(".npz"):
+            self._flush()
+            meta = json.dumps({"info": self.info, "images": self.images, "categories": self.categories})
+            np.savez(output_file, boxes=self.boxes, scores=self.scores, image_ids=self.image_ids,
+                     category_ids=self.category_ids, model_ids=self.model_ids, meta=np.array(meta))
+        else:
+            with open(output_file, "w") as f:
+                json.dump(self.to_coco(), f, separators=(",", ":"))
+
+    @classmethod
+    def load(cls, input_file: str) -> "DetectionResult":
+        """
+        Loads results stored with save().
+        """
+        if not input_file.endswith(".npz"):
+            with open(input_file, "r") as f:
+                return cls.from_coco(json.load(f))
+        data = np.load(input_file)
+        meta = json.loads(str(data["meta"]))
+        result = cls(meta["info"])
+        result.images = meta["images"]
+        result.categories = meta["categories"]
+        result.boxes = data["boxes"]
+        result.scores = data["scores"]
+        result.image_ids = data["image_ids"]
+        result.category_ids = data["category_ids"]
+        result.model_ids = data["model_ids"]
+        return result
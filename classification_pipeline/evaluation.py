@@ -1,8 +1,12 @@
+import itertools
 import json
 import os.path
+import time
 from collections import defaultdict
 import numpy as np
 
+from project.classification_pipeline.coco_index import CocoIndex
+
 
 def map_image_and_category_ids(ground_truth_file, prediction_file):
     with open(ground_truth_file, 'r') as f:
@@ -15,8 +19,9 @@ def map_image_and_category_ids(ground_truth_file, prediction_file):
     category_name_to_id = {category['name']: category['id'] for category in coco_gt['categories']}
     category_id_to_name = {category['id']: category['name'] for category in coco_preds['categories']}
 
+    preds_index = CocoIndex(coco_preds)
     for pred in coco_preds['annotations']:
-        image_filename = next((os.path.basename(img['file_name']) for img in coco_preds['images'] if img['id'] == pred['image_id']), None)
+        image_filename = preds_index.file_name(pred['image_id'])
         if image_filename in filename_to_id:
             pred['image_id'] = filename_to_id[image_filename]
 
@@ -107,6 +112,12 @@ def calculate_precision_recall(predictions, ground_truths, class_id, iou_thresho
     tp, fp, fn = 0, 0, 0
     gt_matched_ids = set()
 
+    # Group the ground truths of this class by image once instead of scanning all of them per prediction
+    class_gts_by_image = defaultdict(list)
+    for gt in ground_truths:
+        if gt['category_id'] == class_id:
+            class_gts_by_image[gt['image_id']].append(gt)
+
     for pred in predictions:
         if pred['category_id'] != class_id:
             continue
@@ -116,9 +127,7 @@ def calculate_precision_recall(predictions, ground_truths, class_id, iou_thresho
 
         best_iou = 0
         best_id = None
-        for gt in ground_truths:
-            if gt['image_id'] != pred_image_id or gt['category_id'] != class_id:
-                continue
+        for gt in class_gts_by_image.get(pred_image_id, []):
             iou = calculate_iou(pred_box, gt['bbox'])
             if iou > best_iou:
                 best_iou = iou
@@ -191,6 +200,183 @@ def calculate_pr(ground_truth_file, prediction_file, iou_threshold=0.5, count_em
     print(f"\nP: {ap_score:.4f}, R: {recall_score:.4f}")
     return ap_score, recall_score
 
+def inference_mode_report(ground_truth_file, image_folder, modes=None, iou_threshold=0.5, output_file=None):
+    """
+    Runs the whole classification pipeline once per inference mode and reports precision,
+    recall and latency, so a mode can be picked per deployment.
+
+    Parameters:
+    -----------
+    ground_truth_file : str
+        COCO file with the ground truth for the images in image_folder.
+    image_folder : str
+        Folder with the evaluation images.
+    modes : list of dict
+        Keyword arguments for IngredientClassifier, e.g. {"precision": "int8", "yolo_export_format": "onnx"}.
+    iou_threshold : float
+        IoU threshold used for precision and recall.
+    output_file : str
+        If provided, the report is saved there as JSON.
+
+    Returns:
+    --------
+    list of dict
+        One row per mode with precision, recall, total seconds and seconds per image.
+    """
+    import project.paths as paths
+    from project.classification_pipeline.classifier import IngredientClassifier
+
+    if modes is None:
+        modes = [{"precision": "fp32"}, {"precision": "bf16"}, {"precision": "int8"},
+                 {"precision": "int8", "yolo_export_format": "onnx"},
+                 {"precision": "int8", "yolo_export_format": "openvino"}]
+    n_images = max(1, len([f for f in os.listdir(image_folder) if f.lower().endswith(('.png', '.jpg', '.jpeg'))]))
+
+    report = []
+    for mode in modes:
+        # The embedding cache is disabled, otherwise the timed run would skip the CLIP forward passes
+        classifier = IngredientClassifier(use_embedding_cache=False, **mode)
+        # Warm-up run so that lazy initialization and exports are not measured
+        classifier.inference(image_folder)
+        start = time.perf_counter()
+        classifier.inference(image_folder)
+        elapsed = time.perf_counter() - start
+        precision, recall = calculate_pr(ground_truth_file, paths.config["clip_results"], iou_threshold)
+        report.append({
+            "mode": mode,
+            "precision": precision,
+            "recall": recall,
+            "seconds": elapsed,
+            "seconds_per_image": elapsed / n_images,
+        })
+        del classifier
+
+    print("\nInference modes (precision / recall / s per image):")
+    for row in report:
+        print(f" - {row['mode']}: P = {row['precision']:.4f}, R = {row['recall']:.4f}, {row['seconds_per_image']:.3f} s")
+
+    if output_file:
+        with open(output_file, 'w') as f:
+            json.dump(report, f, indent=4)
+    return report
+
+def _score_ranks(image_ids, scores, mask):
+    """
+    Rank of every kept detection (mask) within its image by descending score, the same order in which
+    YoloModel applies max_detections. Removed detections are ranked after the kept ones.
+    """
+    order = np.lexsort((-scores, ~mask, image_ids))
+    ranks = np.empty(len(order), dtype=np.int64)
+    group_starts = np.r_[0, np.flatnonzero(np.diff(image_ids[order])) + 1]
+    group_sizes = np.diff(np.r_[group_starts, len(order)])
+    ranks[order] = np.arange(len(order)) - np.repeat(group_starts, group_sizes)
+    return ranks
+
+
+def _evaluate_caps(detections, merged, conf1, conf2, max_detections_grid, pred_to_gt_id, ground_truths,
+                   iou_threshold):
+    """Scores the merged detections of one threshold pair under every per-image detection cap."""
+    results = []
+    for max_detections in max_detections_grid:
+        mask = merged.copy()
+        if max_detections is not None:
+            mask &= _score_ranks(detections.image_ids, detections.scores, mask) < max_detections
+        predictions = [{'image_id': pred_to_gt_id[image_id], 'bbox': box, 'category_id': 0}
+                       for image_id, box in zip(detections.image_ids[mask].tolist(), detections.boxes[mask].tolist())
+                       if pred_to_gt_id[image_id] is not None]
+        tp, fp, fn = calculate_precision_recall(predictions, ground_truths, 0, iou_threshold)
+        precision = tp / (tp + fp) if (tp + fp) > 0 else 0
+        recall = tp / (tp + fn) if (tp + fn) > 0 else 0
+        f1 = 2 * precision * recall / (precision + recall) if (precision + recall) > 0 else 0
+        results.append({"conf1": conf1, "conf2": conf2, "max_detections": max_detections,
+                        "precision": precision, "recall": recall, "f1": f1, "n_detections": int(mask.sum())})
+    return results
+
+
+def calibrate_detection_thresholds(ground_truth_file, image_folder, conf_grid=(0.05, 0.1, 0.15, 0.2, 0.25, 0.3, 0.4),
+                                   max_detections_grid=(None, 10, 20, 30, 50), iou_threshold=0.5,
+                                   nms_iou_threshold=0.7, output_file=None):
+    """
+    Picks per-model confidence thresholds and a per-image detection cap on a validation set.
+    The detectors run once at the lowest threshold and their raw boxes are kept. Every combination is
+    then evaluated offline: the boxes are filtered by the thresholds, merged by NMS like YoloModel.detect()
+    does, and capped. Matching is class-agnostic, the categories come from CLIP later.
+
+    Parameters:
+    -----------
+    ground_truth_file : str
+        COCO file with the ground truth for the images in image_folder.
+    image_folder : str
+        Folder with the validation images.
+    conf_grid : tuple of float
+        Candidate confidence thresholds, tried for model1 and model2 independently.
+    max_detections_grid : tuple of int or None
+        Candidate caps on detections per image, None means no cap.
+    iou_threshold : float
+        IoU threshold for a detection to match a ground-truth box.
+    nms_iou_threshold : float
+        IoU threshold of the NMS merging the boxes of both models, as passed to YoloModel.detect().
+    output_file : str
+        Where the best thresholds are saved, default paths.config["detection_thresholds"].
+        YoloModel loads them from there.
+
+    Returns:
+    --------
+    dict
+        The best thresholds (conf1, conf2, max_detections) with their precision, recall and F1.
+    """
+    import project.paths as paths
+    from project.classification_pipeline.yolo_model_pipeline.YOLO_model import YoloModel
+    from project.classification_pipeline.yolo_model_pipeline.box_ops import nms
+
+    yolo = YoloModel()
+    yolo.conf1 = yolo.conf2 = min(conf_grid)
+    yolo.max_detections = None
+    yolo.skip_model2_coverage = None
+    # Without merging, a box suppressed at the lowest threshold can still be kept at a higher one
+    detections = yolo.detect(image_folder, None, save=False, merge="none")
+    detections.to_coco()  # flushes the columns
+    boxes = detections.boxes.copy()
+    boxes[:, 2:] += boxes[:, :2]  # xywh -> xyxy for NMS
+    order = np.argsort(detections.image_ids, kind="stable")
+    rows_per_image = np.split(order, np.flatnonzero(np.diff(detections.image_ids[order])) + 1)
+
+    with open(ground_truth_file, 'r') as f:
+        coco_gt = json.load(f)
+    gt_index = CocoIndex(coco_gt)
+    filename_to_gt_id = {gt_index.file_name(image_id): image_id for image_id in gt_index.images}
+    pred_index = CocoIndex(detections.to_coco())
+    pred_to_gt_id = {image_id: filename_to_gt_id.get(pred_index.file_name(image_id)) for image_id in pred_index.images}
+    ground_truths = [{**gt, 'category_id': 0} for gt in coco_gt['annotations']]
+
+    results = []
+    for conf1, conf2 in itertools.product(conf_grid, conf_grid):
+        passed = ((detections.model_ids == 1) & (detections.scores >= conf1)) | \
+                 ((detections.model_ids == 2) & (detections.scores >= conf2))
+        merged = np.zeros(len(passed), dtype=bool)
+        for rows in rows_per_image:
+            rows = rows[passed[rows]]
+            if len(rows):
+                merged[rows[nms(boxes[rows], detections.scores[rows], iou_threshold=nms_iou_threshold)]] = True
+        results += _evaluate_caps(detections, merged, conf1, conf2, max_detections_grid, pred_to_gt_id,
+                                  ground_truths, iou_threshold)
+
+    # Best F1, ties broken by fewer detections (less CLIP work)
+    best = max(results, key=lambda row: (row["f1"], -row["n_detections"]))
+    print(f"Best thresholds: conf1 = {best['conf1']}, conf2 = {best['conf2']}, max_detections = {best['max_detections']}"
+          f" (P = {best['precision']:.4f}, R = {best['recall']:.4f}, F1 = {best['f1']:.4f})")
+
+    # Other settings in the file (e.g. skip_model2_coverage) are kept
+    output_file = output_file or paths.config["detection_thresholds"]
+    thresholds = {}
+    if os.path.exists(output_file):
+        with open(output_file, 'r') as f:
+            thresholds = json.load(f)
+    thresholds.update({key: best[key] for key in ("conf1", "conf2", "max_detections")})
+    with open(output_file, 'w') as f:
+        json.dump(thresholds, f, indent=4)
+    return best
+
 if __name__ == "__main__":
     # Paths to your COCO annotation files
 
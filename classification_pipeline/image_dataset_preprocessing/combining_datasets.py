@@ -1,6 +1,20 @@
-import os
+import argparse
+import fcntl
 import glob
+import json
+import os
 import shutil
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from tqdm import tqdm
+
+from project.classification_pipeline.image_dataset_preprocessing.dedup_index import build_dedup_plan
+
+SUBSETS = ["train", "valid", "test"]
+MANIFEST_FILE = ".combine_manifest.json"
+DEDUP_INDEX_FILE = ".dedup_index.json"
+FICLONE = 0x40049409  # ioctl request of a copy-on-write clone on Linux
 
 def rewrite_label_to_binary(label_file_path, output_label_file_path, new_label):
     """
@@ -17,46 +31,193 @@ def rewrite_label_to_binary(label_file_path, output_label_file_path, new_label):
         new_line = f"{new_label} " + " ".join(bbox) + "\n"
         rewritten_lines.append(new_line)
 
-    # Write the new label lines to the output label file
-    with open(output_label_file_path, 'w') as file:
+    # Write the new label lines to a temporary file first, an interrupted run never leaves a half-written label
+    temporary_path = f"{output_label_file_path}.tmp"
+    with open(temporary_path, 'w') as file:
         file.writelines(rewritten_lines)
+    os.replace(temporary_path, output_label_file_path)
+
+
+def _reflink(source, destination):
+    """
+    Copy-on-write clone of source (btrfs, XFS), raises OSError where the file system does not support it.
+    """
+    with open(source, 'rb') as src, open(destination, 'wb') as dst:
+        fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+
 
-def combine_datasets(base_paths, output_base_path, new_label):
+def link_or_copy(source, destination, link_mode="auto"):
+    """
+    Places source at destination without copying the bytes where possible.
+
+    Args:
+        source (str): The existing file.
+        destination (str): The new file.
+        link_mode (str): "auto" tries a reflink, then a hardlink and copies as the last resort, "copy" always copies.
+            A hardlinked image shares its data with the source dataset, so it must not be edited in place.
+
+    Returns:
+        str: How the file was placed ("reflinked", "hardlinked" or "copied").
+    """
+    temporary_path = f"{destination}.tmp"
+    if os.path.exists(temporary_path):
+        os.remove(temporary_path)
+    method = "copied"
+    if link_mode == "auto":
+        try:
+            _reflink(source, temporary_path)
+            method = "reflinked"
+        except (OSError, AttributeError):
+            if os.path.exists(temporary_path):
+                os.remove(temporary_path)
+            try:
+                os.link(source, temporary_path)
+                method = "hardlinked"
+            except OSError:
+                pass
+    if method == "copied":
+        shutil.copy2(source, temporary_path)
+    os.replace(temporary_path, destination)
+    return method
+
+
+def _signature(path):
+    stat = os.stat(path)
+    return f"{stat.st_size}:{stat.st_mtime_ns}"
+
+
+def plan_operations(base_paths, output_base_path, dropped_images=()):
+    """
+    Lists every label rewrite and image copy of the combined dataset before anything is written.
+    As before, the first dataset wins when two datasets contain a file of the same name.
+
+    Args:
+        base_paths (list): Roots of the datasets.
+        output_base_path (str): Root of the combined dataset.
+        dropped_images: Absolute paths of images left out together with their labels (e.g. the "drop"
+            entries of a dedup plan, see dedup_index.py).
+
+    Returns:
+        tuple[list, int, int]: Operations (kind "label" or "image", source, destination), the number of
+            files skipped because of a name collision and the number of dropped files.
+    """
+    operations, destinations, collisions, dropped = [], set(), 0, 0
+    for subset in SUBSETS:
+        for base_path in base_paths:
+            for kind, folder, pattern in (("label", "labels", "*.txt"), ("image", "images", "*.jpg")):
+                input_folder = os.path.join(base_path, subset, folder)
+                if not os.path.exists(input_folder):
+                    continue
+                for source in sorted(glob.glob(os.path.join(input_folder, pattern))):
+                    image = source if kind == "image" else os.path.join(
+                        base_path, subset, "images", f"{os.path.splitext(os.path.basename(source))[0]}.jpg")
+                    if os.path.abspath(image) in dropped_images:
+                        dropped += 1
+                        continue
+                    destination = os.path.join(output_base_path, subset, folder, os.path.basename(source))
+                    if destination in destinations:
+                        collisions += 1
+                        continue
+                    destinations.add(destination)
+                    operations.append((kind, source, destination))
+    return operations, collisions, dropped
+
+
+def _execute(operation, new_label, link_mode):
+    kind, source, destination = operation
+    if kind == "label":
+        rewrite_label_to_binary(source, destination, new_label)
+        return "relabelled"
+    return link_or_copy(source, destination, link_mode)
+
+
+def combine_datasets(base_paths, output_base_path, new_label, workers=8, link_mode="auto", dedup_distance=None):
     """
     Combine datasets from multiple base paths into a new dataset and rewrite labels to a single new label.
-    Also, copy the corresponding images to the new dataset.
+    Also, place the corresponding images into the new dataset (reflinked or hardlinked where possible).
+
+    All operations are planned first and then run in a thread pool. Finished operations are recorded in
+    a manifest in output_base_path, so an interrupted run resumes where it stopped; an operation is
+    repeated only if its source file changed since.
+
+    Args:
+        base_paths (list): Roots of the datasets, each with train/valid/test folders of images and labels.
+        output_base_path (str): Root of the combined dataset.
+        new_label (int): Class id written into every label.
+        workers (int): Number of threads.
+        link_mode (str): "auto" or "copy", see link_or_copy().
+        dedup_distance (int | None): Leave out byte-identical images and images whose perceptual hashes are
+            at most this many bits apart (0 for exact duplicates only), keeping the first copy. None keeps all.
+
+    Returns:
+        Counter: Number of files per outcome, "bytes" written by copies and labels and "linked_bytes" of
+            reflinked or hardlinked images.
     """
-    subsets = ["train", "valid", "test"]
-    for subset in subsets:
+    for subset in SUBSETS:
         # Create output folders for the combined dataset (images and labels)
-        output_label_folder = os.path.join(output_base_path, subset, 'labels')
-        output_image_folder = os.path.join(output_base_path, subset, 'images')
-        os.makedirs(output_label_folder, exist_ok=True)
-        os.makedirs(output_image_folder, exist_ok=True)
+        os.makedirs(os.path.join(output_base_path, subset, 'labels'), exist_ok=True)
+        os.makedirs(os.path.join(output_base_path, subset, 'images'), exist_ok=True)
+
+    manifest_path = os.path.join(output_base_path, MANIFEST_FILE)
+    manifest = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path, 'r') as file:
+            manifest = json.load(file)
+    if manifest.get("new_label", new_label) != new_label:
+        manifest = {}  # Labels were written with a different class id, rewrite everything
+    done = manifest.setdefault("done", {})
+    manifest["new_label"] = new_label
+
+    dropped_images = {}
+    if dedup_distance is not None:
+        image_folders = [os.path.join(base_path, subset, 'images') for subset in SUBSETS for base_path in base_paths]
+        dropped_images = build_dedup_plan(image_folders, os.path.join(output_base_path, DEDUP_INDEX_FILE),
+                                          dedup_distance)["drop"]
+    operations, collisions, dropped = plan_operations(base_paths, output_base_path, dropped_images)
+    stats = Counter(collisions=collisions, duplicates=dropped)
+    pending = []
+    for operation in operations:
+        _, source, destination = operation
+        signature = f"{_signature(source)}:{source}"
+        if done.get(destination) == signature and os.path.exists(destination):
+            stats["resumed"] += 1
+        else:
+            pending.append((operation, signature))
+    print(f"{len(operations)} files planned, {stats['resumed']} already done, {collisions} name collisions and "
+          f"{dropped} duplicate files skipped.")
+
+    def save_manifest():
+        with open(f"{manifest_path}.tmp", 'w') as file:
+            json.dump(manifest, file)
+        os.replace(f"{manifest_path}.tmp", manifest_path)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(_execute, operation, new_label, link_mode): (operation, signature)
+                   for operation, signature in pending}
+        for i, future in enumerate(tqdm(as_completed(futures), total=len(futures), desc="Combining datasets")):
+            (kind, source, destination), signature = futures[future]
+            try:
+                outcome = future.result()
+                stats[outcome] += 1
+                done[destination] = signature
+                # Linked files share their data with the source, only copies and new labels use disk space
+                size_key = "linked_bytes" if outcome in ("reflinked", "hardlinked") else "bytes"
+                stats[size_key] += os.path.getsize(destination)
+            except OSError as e:
+                stats["failed"] += 1
+                print(f"Failed to write {destination}: {e}")
+            if i % 1000 == 999:
+                save_manifest()
+    save_manifest()
+
+    print("Combined dataset summary:")
+    for outcome in ("relabelled", "reflinked", "hardlinked", "copied", "resumed", "collisions", "duplicates",
+                    "failed"):
+        print(f"  {outcome:<11} {stats[outcome]}")
+    print(f"  {'written':<11} {stats['bytes'] / 1024 ** 2:.1f} MiB")
+    print(f"  {'linked':<11} {stats['linked_bytes'] / 1024 ** 2:.1f} MiB (shared with the source datasets)")
+    return stats
 
-        for base_path in base_paths:
-            input_label_folder = os.path.join(base_path, subset, 'labels')
-            input_image_folder = os.path.join(base_path, subset, 'images')
-
-            if os.path.exists(input_label_folder):
-                label_files = glob.glob(os.path.join(input_label_folder, '*.txt'))
-                for label_file in label_files:
-                    output_label_file_path = os.path.join(output_label_folder, os.path.basename(label_file))
-                    if not os.path.exists(output_label_file_path):
-                        rewrite_label_to_binary(label_file, output_label_file_path, new_label)
-                        print(f"Rewritten label for: {label_file} to {output_label_file_path}")
-                    else:
-                        print(f"Skipped existing label file: {output_label_file_path}")
-
-            if os.path.exists(input_image_folder):
-                image_files = glob.glob(os.path.join(input_image_folder, '*.jpg'))
-                for image_file in image_files:
-                    output_image_file_path = os.path.join(output_image_folder, os.path.basename(image_file))
-                    if not os.path.exists(output_image_file_path):
-                        shutil.copy(image_file, output_image_file_path)
-                        print(f"Copied image: {image_file} to {output_image_file_path}")
-                    else:
-                        print(f"Skipped existing image file: {output_image_file_path}")
 
 def create_yaml_file(output_base_path):
     """
@@ -77,6 +238,13 @@ def create_yaml_file(output_base_path):
     print(f"YAML file created at: {yaml_file_path}")
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Combine YOLO datasets into one single-class dataset.")
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--copy", action="store_true", help="Copy the images instead of linking them.")
+    parser.add_argument("--dedup", type=int, default=None, metavar="MAX_DISTANCE",
+                        help="Leave out duplicate images, up to this many differing pHash bits (0 for exact only).")
+    args = parser.parse_args()
+
     # List of dataset base paths to combine
     base_paths = [
         "/mnt/home2/SU2/ingredients_photo_dataset/all_old_ds/Dataset for YOLOv5.v2i.yolov11",
@@ -101,5 +269,6 @@ if __name__ == "__main__":
     # Rewrite labels to a specific new label (0 or 1)
     new_label = 0
 
-    combine_datasets(base_paths, output_base_path, new_label)
+    combine_datasets(base_paths, output_base_path, new_label, workers=args.workers,
+                     link_mode="copy" if args.copy else "auto", dedup_distance=args.dedup)
     create_yaml_file(output_base_path)
@@ -1,6 +1,12 @@
-import os
+import argparse
+import difflib
 import glob
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
 import numpy as np
+from tqdm import tqdm
 
 def is_correct_format(bbox):
     """
@@ -31,73 +37,203 @@ def convert_polygon_to_xywh(bbox):
 
     return [x_center, y_center, width, height]
 
-def process_label_file(label_file_path):
+def parse_label_file(text):
+    """
+    Parse a whole YOLO label file at once. Rows may have different lengths (boxes and polygons).
+
+    Returns:
+        tuple[list, np.ndarray, np.ndarray]: Class id of every row (as written), all coordinates
+            concatenated into one float array and the number of coordinates of every row.
+    """
+    rows = [line.split() for line in text.splitlines() if line.strip()]
+    class_ids = [row[0] for row in rows]
+    lengths = np.fromiter((len(row) - 1 for row in rows), dtype=np.int64, count=len(rows))
+    values = np.array([value for row in rows for value in row[1:]], dtype=np.float64)
+    return class_ids, values, lengths
+
+
+def convert_rows(values, lengths):
+    """
+    Convert all polygon rows to (x_center, y_center, width, height) with vectorized reductions,
+    rows that are already in xywh format are kept.
+
+    Args:
+        values (np.ndarray): Coordinates of all rows concatenated (see parse_label_file()).
+        lengths (np.ndarray): Number of coordinates of every row.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: Boxes (n, 4) and a mask of the rows that were converted.
+    """
+    n_rows = len(lengths)
+    starts = np.concatenate(([0], np.cumsum(lengths)[:-1])) if n_rows else np.zeros(0, dtype=np.int64)
+    boxes = np.zeros((n_rows, 4), dtype=np.float64)
+    is_box = lengths == 4
+    box_starts = starts[is_box]
+    boxes[is_box] = values[box_starts[:, None] + np.arange(4)]
+
+    # A repeated closing point does not change the min/max, so it does not need to be removed
+    polygons = np.flatnonzero(~is_box & (lengths >= 2))
+    if len(polygons):
+        polygon_lengths = lengths[polygons]
+        position = np.arange(polygon_lengths.sum()) - np.repeat(np.cumsum(polygon_lengths) - polygon_lengths,
+                                                               polygon_lengths)
+        polygon_values = values[np.repeat(starts[polygons], polygon_lengths) + position]
+        is_x = position % 2 == 0
+        x_starts = np.concatenate(([0], np.cumsum((polygon_lengths + 1) // 2)[:-1]))
+        y_starts = np.concatenate(([0], np.cumsum(polygon_lengths // 2)[:-1]))
+        x_values, y_values = polygon_values[is_x], polygon_values[~is_x]
+        x_min, x_max = np.minimum.reduceat(x_values, x_starts), np.maximum.reduceat(x_values, x_starts)
+        y_min, y_max = np.minimum.reduceat(y_values, y_starts), np.maximum.reduceat(y_values, y_starts)
+        boxes[polygons] = np.stack([(x_min + x_max) / 2.0, (y_min + y_max) / 2.0, x_max - x_min, y_max - y_min],
+                                   axis=1)
+    converted = ~is_box & (lengths >= 2)
+    return boxes, converted
+
+
+def process_label_file(label_file_path, dry_run=False, with_diff=False):
     """
     Process a single label file to convert bounding boxes only if they are not in the correct format.
+    The file is only written when its content changes.
+
+    Args:
+        label_file_path (str): Path to the label file.
+        dry_run (bool): Only report what would change, do not write.
+        with_diff (bool): Include a unified diff of the changes in the report.
+
+    Returns:
+        dict: Report with the file, the number of rows, converted rows and invalid rows (no coordinates,
+            kept as they are), whether the file changed and optionally the diff or the error.
+    """
+    report = {"file": label_file_path, "rows": 0, "converted": 0, "invalid": 0, "changed": False}
+    try:
+        with open(label_file_path, 'r') as file:
+            text = file.read()
+        class_ids, values, lengths = parse_label_file(text)
+    except (OSError, ValueError) as e:
+        report["error"] = str(e)
+        return report
+
+    boxes, converted = convert_rows(values, lengths)
+    invalid = lengths < 2
+    lines = [" ".join(text_row.split()) for text_row in text.splitlines() if text_row.strip()]
+    converted_lines = [line if invalid[i] else f"{class_id} " + " ".join(f"{coord:.6f}" for coord in box)
+                       for i, (line, class_id, box) in enumerate(zip(lines, class_ids, boxes.tolist()))]
+    new_text = "".join(f"{line}\n" for line in converted_lines)
+
+    report.update(rows=len(lengths), converted=int(converted.sum()), invalid=int(invalid.sum()),
+                  changed=new_text != text)
+    if report["changed"] and with_diff:
+        report["diff"] = "".join(difflib.unified_diff(text.splitlines(keepends=True), new_text.splitlines(keepends=True),
+                                                      label_file_path, label_file_path))
+    if report["changed"] and not dry_run:
+        temporary_path = f"{label_file_path}.tmp"
+        with open(temporary_path, 'w') as file:
+            file.write(new_text)
+        os.replace(temporary_path, label_file_path)
+    return report
+
+
+def _process_chunk(task):
+    label_files, dry_run, with_diff = task
+    return [process_label_file(label_file, dry_run, with_diff) for label_file in label_files]
+
+
+def convert_label_files(label_files, workers=None, dry_run=False, with_diff=False, chunk_size=256):
     """
-    with open(label_file_path, 'r') as file:
-        lines = file.readlines()
+    Convert many label files across a process pool.
 
-    converted_lines = []
-    for line in lines:
-        elements = line.strip().split()
-        class_id = elements[0]
-        bbox = list(map(float, elements[1:]))
+    Args:
+        label_files (list): Paths to the label files.
+        workers (int | None): Number of processes, default all cores.
+        dry_run (bool): Only report what would change, do not write.
+        with_diff (bool): Include unified diffs in the reports.
+        chunk_size (int): Number of files sent to a process at once.
 
-        if not is_correct_format(bbox):
-            # Convert if the format is incorrect
-            bbox_xywh = convert_polygon_to_xywh(bbox)
-            if bbox_xywh:
-                bbox = bbox_xywh
-            print(f"Checked and converted: {label_file_path}")
+    Returns:
+        list: The report of every file (see process_label_file()).
+    """
+    tasks = [(label_files[i:i + chunk_size], dry_run, with_diff) for i in range(0, len(label_files), chunk_size)]
+    reports = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for chunk_reports in tqdm(executor.map(_process_chunk, tasks), total=len(tasks), desc="Converting labels"):
+            reports.extend(chunk_reports)
+    return reports
 
-        bbox = [f"{coord:.6f}" for coord in bbox]
-        converted_line = f"{class_id} " + " ".join(bbox) + "\n"
-        converted_lines.append(converted_line)
 
-    with open(label_file_path, 'w') as file:
-        file.writelines(converted_lines)
+def summarize_reports(reports, dry_run=False):
+    """
+    Prints how many files and rows were (or would be, in a dry run) changed.
+    """
+    changed = [report for report in reports if report["changed"]]
+    failed = [report for report in reports if "error" in report]
+    print(f"{len(reports)} label files checked, {len(changed)} {'would change' if dry_run else 'changed'}, "
+          f"{sum(report['converted'] for report in reports)} of {sum(report['rows'] for report in reports)} rows "
+          f"converted from polygons, {sum(report['invalid'] for report in reports)} rows without coordinates.")
+    for report in failed:
+        print(f"Failed to read {report['file']}: {report['error']}")
+
 
-def convert_labels_in_folder(folder_path):
+def convert_labels_in_folder(folder_path, workers=None, dry_run=False):
     """
     Iterate through all label files in the given folder and convert them if necessary.
     """
     label_files = glob.glob(os.path.join(folder_path, '*.txt'))
-    for label_file in label_files:
-        process_label_file(label_file)
-
+    return convert_label_files(label_files, workers, dry_run)
 
 
+def process_all_datasets(base_path, subfolders, workers=None, dry_run=False, report_file=None):
+    """
+    Convert the label files of all datasets in base_path.
 
+    Args:
+        base_path (str): Folder with the datasets.
+        subfolders (list): Label folders inside every dataset (train/labels, valid/labels, test/labels).
+        workers (int | None): Number of processes, default all cores.
+        dry_run (bool): Only report what would change, do not write.
+        report_file (str | None): Write the reports, with diffs of the changed files, to this JSON file.
 
-def process_all_datasets(base_path, subfolders):
+    Returns:
+        list: The report of every file.
+    """
+    label_files = []
     # Iterate through all datasets in the base folder
-    for dataset in os.listdir(base_path):
+    for dataset in sorted(os.listdir(base_path)):
         dataset_path = os.path.join(base_path, dataset)
 
         # Check if it's a directory
         if os.path.isdir(dataset_path):
-            print(f"Processing dataset: {dataset}")
-
             # Iterate over subfolders (train/labels, valid/labels, test/labels)
             for subfolder in subfolders:
                 folder_path = os.path.join(dataset_path, subfolder)
 
                 if os.path.exists(folder_path):
-                    print(f"Found folder: {folder_path}")
-                    # Process the labels in the folder
-                    convert_labels_in_folder(folder_path)
+                    label_files.extend(sorted(glob.glob(os.path.join(folder_path, '*.txt'))))
                 else:
                     print(f"Warning: Folder {folder_path} does not exist.")
         else:
             print(f"Skipping non-directory: {dataset}")
+
+    reports = convert_label_files(label_files, workers, dry_run, with_diff=report_file is not None)
+    summarize_reports(reports, dry_run)
+    if report_file is not None:
+        with open(report_file, 'w') as file:
+            json.dump([report for report in reports if report["changed"] or "error" in report], file, indent=1)
+        print(f"Report saved to {report_file}")
+    return reports
+
+
 def main():
-    base_path = "/mnt/home2/SU2/ingredients_photo_dataset/all_old_ds/"
+    parser = argparse.ArgumentParser(description="Convert polygon labels of YOLO datasets to xywh boxes.")
+    parser.add_argument("--base-path", default="/mnt/home2/SU2/ingredients_photo_dataset/all_old_ds/")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--dry-run", action="store_true", help="Only report which files would change.")
+    parser.add_argument("--report", help="Write a JSON report with a diff of every changed file.")
+    args = parser.parse_args()
 
     # Subfolders to look for inside each dataset
     subfolders = ["train/labels", "valid/labels", "test/labels"]
 
-    process_all_datasets(base_path, subfolders)
+    process_all_datasets(args.base_path, subfolders, args.workers, args.dry_run, args.report)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,254 @@
+import argparse
+import hashlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+import numpy as np
+from tqdm import tqdm
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.gif', '.tiff')
+SUBSETS = ("train", "valid", "test")
+
+
+def content_hash(image_path):
+    """
+    SHA-1 of the file bytes, equal only for byte-identical files.
+    """
+    sha1 = hashlib.sha1()
+    with open(image_path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1 << 20), b''):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+def perceptual_hash(image_path):
+    """
+    64-bit pHash: the signs of the 8x8 lowest DCT frequencies of the 32x32 grayscale image relative to
+    their median. Re-encoded, resized or slightly edited copies of an image differ in only a few bits.
+
+    Returns:
+        int | None: The hash, None if the image can not be decoded.
+    """
+    image = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
+    if image is None:
+        return None
+    small = cv2.resize(image, (32, 32), interpolation=cv2.INTER_AREA).astype(np.float32)
+    low_frequencies = cv2.dct(small)[:8, :8].flatten()
+    bits = low_frequencies > np.median(low_frequencies[1:])
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+
+def _hash_image(image_path):
+    return image_path, content_hash(image_path), perceptual_hash(image_path)
+
+
+def _signature(path):
+    stat = os.stat(path)
+    return f"{stat.st_size}:{stat.st_mtime_ns}"
+
+
+def hamming_distance(hash1, hash2):
+    return (hash1 ^ hash2).bit_count()
+
+
+class BKTree:
+    """
+    Burkhard-Keller tree over perceptual hashes with the Hamming distance. A query with a small radius
+    only visits the branches whose distance to the node can still contain a match, instead of comparing
+    against every hash.
+    """
+    def __init__(self):
+        self.root = None  # [hash, items, {distance: child}]
+
+    def add(self, hash_value, item):
+        if self.root is None:
+            self.root = [hash_value, [item], {}]
+            return
+        node = self.root
+        while True:
+            distance = hamming_distance(hash_value, node[0])
+            if distance == 0:
+                node[1].append(item)
+                return
+            if distance not in node[2]:
+                node[2][distance] = [hash_value, [item], {}]
+                return
+            node = node[2][distance]
+
+    def query(self, hash_value, max_distance):
+        """
+        Returns:
+            list: (distance, item) of all items whose hash is at most max_distance bits away.
+        """
+        matches = []
+        stack = [self.root] if self.root is not None else []
+        while stack:
+            node = stack.pop()
+            distance = hamming_distance(hash_value, node[0])
+            if distance <= max_distance:
+                matches.extend((distance, item) for item in node[1])
+            for child_distance, child in node[2].items():
+                if distance - max_distance <= child_distance <= distance + max_distance:
+                    stack.append(child)
+        return matches
+
+
+class DedupIndex:
+    """
+    Content hash and perceptual hash of every image of the merged datasets, stored in a JSON file so
+    images are only hashed again when they change.
+
+    Attributes:
+        index_file (str | None): Where the index is stored.
+        entries (dict): Absolute image path -> {"signature", "sha1", "phash"}.
+    """
+    def __init__(self, index_file=None):
+        self.index_file = index_file
+        self.entries = {}
+        if index_file is not None and os.path.exists(index_file):
+            with open(index_file, 'r') as file:
+                self.entries = json.load(file)
+
+    def update(self, image_paths, workers=None):
+        """
+        Hashes the images that are new or changed since they were indexed, in a process pool.
+
+        Args:
+            image_paths (list): Paths to the images.
+            workers (int | None): Number of processes, default all cores.
+        """
+        stale = {}
+        for image_path in map(os.path.abspath, image_paths):
+            signature = _signature(image_path)
+            if self.entries.get(image_path, {}).get("signature") != signature:
+                stale[image_path] = signature
+        if not stale:
+            return
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for image_path, sha1, phash in tqdm(executor.map(_hash_image, stale, chunksize=64), total=len(stale),
+                                                desc="Hashing images"):
+                self.entries[image_path] = {"signature": stale[image_path], "sha1": sha1, "phash": phash}
+
+    def save(self):
+        if self.index_file is None:
+            return
+        with open(f"{self.index_file}.tmp", 'w') as file:
+            json.dump(self.entries, file)
+        os.replace(f"{self.index_file}.tmp", self.index_file)
+
+    def duplicate_groups(self, image_paths, max_distance=4):
+        """
+        Groups the images that are byte-identical or whose perceptual hashes are at most max_distance bits apart.
+
+        Args:
+            image_paths (list): Indexed images, in order of preference (the first of a group is kept).
+            max_distance (int): Hamming distance up to which images count as near-duplicates, 0 for exact only.
+
+        Returns:
+            list: Groups (lists of absolute paths, in the given order) with at least two images.
+        """
+        image_paths = [os.path.abspath(image_path) for image_path in image_paths]
+        position = {image_path: i for i, image_path in enumerate(image_paths)}
+        parent = list(range(len(image_paths)))
+
+        def find(i):
+            while parent[i] != i:
+                parent[i] = parent[parent[i]]
+                i = parent[i]
+            return i
+
+        def union(i, j):
+            i, j = find(i), find(j)
+            if i != j:
+                parent[max(i, j)] = min(i, j)
+
+        first_of_hash = {}
+        for i, image_path in enumerate(image_paths):
+            sha1 = self.entries[image_path]["sha1"]
+            union(i, first_of_hash.setdefault(sha1, i))
+
+        if max_distance > 0:
+            tree = BKTree()
+            for sha1, i in first_of_hash.items():
+                phash = self.entries[image_paths[i]]["phash"]
+                if phash is None:
+                    continue
+                for _, j in tree.query(phash, max_distance):
+                    union(i, j)
+                tree.add(phash, i)
+
+        groups = {}
+        for image_path in image_paths:
+            groups.setdefault(find(position[image_path]), []).append(image_path)
+        return [group for group in groups.values() if len(group) > 1]
+
+    def dedup_plan(self, image_paths, max_distance=4):
+        """
+        Decides which images a merge keeps. The first image of every duplicate group (in the order of
+        image_paths, e.g. the order of the datasets in the merge) is kept, the others are dropped.
+
+        Returns:
+            dict: "drop" (dropped path -> kept path), "exact" and "near" (number of dropped byte-identical
+                and near-duplicate images) and "cross_subset" (groups spanning train/valid/test, i.e. leaks).
+        """
+        plan = {"drop": {}, "exact": 0, "near": 0, "cross_subset": 0}
+        for group in self.duplicate_groups(image_paths, max_distance):
+            kept = group[0]
+            for image_path in group[1:]:
+                plan["drop"][image_path] = kept
+                same_content = self.entries[image_path]["sha1"] == self.entries[kept]["sha1"]
+                plan["exact" if same_content else "near"] += 1
+            if len({_subset(image_path) for image_path in group} - {None}) > 1:
+                plan["cross_subset"] += 1
+        return plan
+
+
+def _subset(image_path):
+    parts = os.path.normpath(image_path).split(os.sep)
+    return next((part for part in reversed(parts) if part in SUBSETS), None)
+
+
+def list_images(folders):
+    return [os.path.join(folder, file_name) for folder in folders if os.path.isdir(folder)
+            for file_name in sorted(os.listdir(folder)) if file_name.lower().endswith(IMAGE_EXTENSIONS)]
+
+
+def build_dedup_plan(image_folders, index_file=None, max_distance=4, workers=None):
+    """
+    Indexes all images of the folders and returns the dedup plan for merging them in this order.
+
+    Args:
+        image_folders (list): Image folders in order of preference.
+        index_file (str | None): Where the index is kept between runs.
+        max_distance (int): Hamming distance up to which images count as near-duplicates.
+        workers (int | None): Number of hashing processes.
+
+    Returns:
+        dict: See DedupIndex.dedup_plan().
+    """
+    image_paths = list_images(image_folders)
+    index = DedupIndex(index_file)
+    index.update(image_paths, workers)
+    index.save()
+    plan = index.dedup_plan(image_paths, max_distance)
+    print(f"{len(image_paths)} images indexed, {plan['exact']} byte-identical and {plan['near']} near-duplicate "
+          f"copies to drop, {plan['cross_subset']} duplicate groups span several subsets.")
+    return plan
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Find duplicate images across image folders.")
+    parser.add_argument("folders", nargs="+", help="Image folders in order of preference.")
+    parser.add_argument("--index", default="dedup_index.json", help="Index file reused between runs.")
+    parser.add_argument("--max-distance", type=int, default=4, help="pHash bits that may differ, 0 for exact only.")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--plan", help="Write the dedup plan to this JSON file.")
+    args = parser.parse_args()
+
+    plan = build_dedup_plan(args.folders, args.index, args.max_distance, args.workers)
+    if args.plan:
+        with open(args.plan, 'w') as file:
+            json.dump(plan, file, indent=1)
+        print(f"Dedup plan saved to {args.plan}")
@@ -0,0 +1,219 @@
+import argparse
+import json
+import os
+import time
+from collections import OrderedDict
+
+import project.paths as paths
+from project.classification_pipeline.classifier import IngredientClassifier, annotation_fragments
+from project.classification_pipeline.results_manifest import file_signature
+
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+
+
+class IngestionDaemon:
+    """
+    Long-running service that watches an image folder and classifies new images as they arrive.
+    The folder is polled, a file is taken once its size and modification time did not change between
+    two polls (so half-uploaded photos are not read). New images are processed in micro-batches by one
+    IngredientClassifier that stays loaded for the whole run. Results of every image are appended as one
+    JSON line (COCO image, annotations with category names, ingredients) to the results log.
+
+    The backlog is bounded: at most max_backlog images wait for processing, further arrivals are left on
+    disk and picked up by a later poll, so a burst of uploads can not exhaust memory.
+
+    Attributes:
+        classifier (IngredientClassifier): The pipeline, loaded once.
+        watch_folder (str): The watched folder.
+        results_log (str): Path to the JSON lines results log.
+        output_folder (str | None): Where the annotated images are written, None to skip rendering.
+        batch_size (int): Maximal number of images per batch.
+        batch_timeout (float): Seconds a not yet full batch waits for more images.
+        poll_interval (float): Seconds between two scans of the folder.
+        max_backlog (int): Maximal number of queued images.
+    """
+    def __init__(self, classifier: IngredientClassifier, watch_folder: str, results_log: str,
+                 output_folder: str | None = None, batch_size: int = 16, batch_timeout: float = 2.0,
+                 poll_interval: float = 1.0, max_backlog: int = 1000):
+        self.classifier = classifier
+        self.watch_folder = watch_folder
+        self.results_log = results_log
+        self.output_folder = output_folder
+        self.batch_size = batch_size
+        self.batch_timeout = batch_timeout
+        self.poll_interval = poll_interval
+        self.max_backlog = max_backlog
+
+        self.backlog = OrderedDict()  # File name -> signature, in order of arrival
+        self._seen = {}  # File name -> signature from the previous poll
+        self._processed = self._load_processed()  # File name -> signature of processed images
+        self._oldest_queued = None
+        self._deferred = set()  # Files left on disk because the backlog was full
+
+        self.n_images = 0
+        self.n_batches = 0
+        self.n_deferred = 0
+        self.n_failed = 0
+        self.processing_time = 0.0
+        self.started = time.time()
+
+    def _load_processed(self) -> dict:
+        """
+        Reads the results log so that images processed before a restart are not processed again.
+        """
+        processed = {}
+        if not os.path.exists(self.results_log):
+            return processed
+        with open(self.results_log, "r") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # A line cut off by a crash
+                processed[record["file_name"]] = record["signature"]
+        return processed
+
+    def poll(self):
+        """
+        Scans the folder and queues images that are new or changed and are no longer being written.
+        """
+        current = {}
+        with os.scandir(self.watch_folder) as entries:
+            for entry in entries:
+                if entry.is_file() and entry.name.lower().endswith(IMAGE_EXTENSIONS):
+                    stat = entry.stat()
+                    current[entry.name] = f"{stat.st_size}:{stat.st_mtime_ns}"
+
+        for name, signature in current.items():
+            if signature != self._seen.get(name) or self._processed.get(name) == signature:
+                continue  # Still changing, or already done
+            if self.backlog.get(name) == signature:
+                continue
+            if name not in self.backlog and len(self.backlog) >= self.max_backlog:
+                if name not in self._deferred:  # Count every file once, not every poll
+                    self._deferred.add(name)
+                    self.n_deferred += 1
+                continue
+            self._deferred.discard(name)
+            self.backlog[name] = signature
+            if self._oldest_queued is None:
+                self._oldest_queued = time.time()
+        self._deferred &= current.keys()
+        self._seen = current
+
+    def batch_ready(self) -> bool:
+        """
+        A batch is processed when it is full or its oldest image waited batch_timeout seconds.
+        """
+        if not self.backlog:
+            return False
+        return len(self.backlog) >= self.batch_size or time.time() - self._oldest_queued >= self.batch_timeout
+
+    def process_batch(self):
+        """
+        Classifies the next batch of queued images and appends their results to the log.
+        """
+        batch = []
+        while self.backlog and len(batch) < self.batch_size:
+            batch.append(self.backlog.popitem(last=False))
+        self._oldest_queued = time.time() if self.backlog else None
+        # Images deleted or replaced while queued are skipped, a changed file is queued again by poll()
+        batch = [(name, signature) for name, signature in batch
+                 if file_signature(os.path.join(self.watch_folder, name)) == signature]
+        if not batch:
+            return
+
+        start = time.time()
+        render_chunk = None
+        if self.output_folder is not None:
+            def render_chunk(chunk_coco, frames):
+                self.classifier.renderer.render(chunk_coco, self.watch_folder, frames=frames,
+                                                output_folder=self.output_folder)
+        try:
+            _, coco_index = self.classifier.classify(self.watch_folder, [name for name, _ in batch],
+                                                     save_detections=False, on_chunk=render_chunk)
+        except Exception as e:
+            print(f"Failed to process batch of {len(batch)} images: {e}")
+            self.n_failed += len(batch)
+            for name, signature in batch:
+                self._processed[name] = signature  # Do not retry a broken image forever
+            return
+
+        signatures = dict(batch)
+        with open(self.results_log, "a") as f:
+            for image_id, image_info in coco_index.images.items():
+                name = os.path.basename(image_info["file_name"])
+                record = {
+                    "file_name": name,
+                    "signature": signatures[name],
+                    "processed_at": time.time(),
+                    "image": {key: value for key, value in image_info.items() if key != "id"},
+                    "annotations": annotation_fragments(coco_index, image_id),
+                    "ingredients": coco_index.ingredients(image_id),
+                }
+                f.write(json.dumps(record, separators=(",", ":")) + "\n")
+        self._processed.update(signatures)
+
+        self.processing_time += time.time() - start
+        self.n_images += len(batch)
+        self.n_batches += 1
+
+    def metrics(self) -> dict:
+        """
+        Returns throughput metrics of the run.
+        """
+        elapsed = time.time() - self.started
+        return {
+            "images": self.n_images,
+            "batches": self.n_batches,
+            "failed": self.n_failed,
+            "deferred": self.n_deferred,
+            "backlog": len(self.backlog),
+            "images_per_second": self.n_images / elapsed if elapsed > 0 else 0.0,
+            "processing_images_per_second": self.n_images / self.processing_time if self.processing_time > 0 else 0.0,
+            "mean_batch_seconds": self.processing_time / self.n_batches if self.n_batches else 0.0,
+        }
+
+    def run(self, metrics_interval: float = 60.0, max_batches: int | None = None):
+        """
+        Runs the service until interrupted.
+
+        Args:
+            metrics_interval (float): Seconds between two printed metric reports.
+            max_batches (int | None): Stop after this many batches, None to run forever.
+        """
+        os.makedirs(os.path.dirname(os.path.abspath(self.results_log)), exist_ok=True)
+        last_report = time.time()
+        print(f"Watching {self.watch_folder}, {len(self._processed)} images already processed.")
+        try:
+            while max_batches is None or self.n_batches < max_batches:
+                self.poll()
+                if self.batch_ready():
+                    self.process_batch()
+                    continue  # Poll again right away, there may be more waiting
+                if time.time() - last_report >= metrics_interval:
+                    print(f"Ingestion metrics: {self.metrics()}")
+                    last_report = time.time()
+                time.sleep(self.poll_interval)
+        except KeyboardInterrupt:
+            pass
+        print(f"Ingestion metrics: {self.metrics()}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Classify images as they arrive in the images folder.")
+    parser.add_argument("--folder", default=paths.config["images"])
+    parser.add_argument("--log", default=paths.config["ingestion_log"])
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--batch-timeout", type=float, default=2.0)
+    parser.add_argument("--poll-interval", type=float, default=1.0)
+    parser.add_argument("--max-backlog", type=int, default=1000)
+    parser.add_argument("--no-render", action="store_true", help="Do not write annotated images.")
+    args = parser.parse_args()
+
+    daemon = IngestionDaemon(IngredientClassifier(), args.folder, args.log,
+                             output_folder=None if args.no_render else paths.config["annotated_images"],
+                             batch_size=args.batch_size, batch_timeout=args.batch_timeout,
+                             poll_interval=args.poll_interval, max_backlog=args.max_backlog)
+    daemon.run()
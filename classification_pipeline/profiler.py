@@ -0,0 +1,132 @@
+import contextlib
+import json
+import os
+import resource
+import sys
+import threading
+import time
+from collections import defaultdict
+
+
+class Profiler:
+    """
+    Lightweight per-stage instrumentation of the pipeline. Stages are wrapped in span() context managers,
+    amounts (images, crops, ...) are added with count(). When the profiler is disabled span() returns a
+    shared no-op context and count() returns immediately, so the instrumentation can stay in the code.
+
+    The recorded spans can be exported as a JSON summary (time per stage, counters, throughput, peak
+    memory) and as a Chrome trace (open in chrome://tracing or https://ui.perfetto.dev).
+
+    Attributes:
+        enabled (bool): Whether spans and counters are recorded.
+        spans (list): Recorded spans (name, start, duration, process id, thread id), times in seconds.
+        counters (defaultdict): Counter name -> value.
+    """
+    _noop = contextlib.nullcontext()
+
+    def __init__(self, enabled: bool = False):
+        self.enabled = enabled
+        self.reset()
+
+    def reset(self):
+        self.spans = []
+        self.counters = defaultdict(int)
+        self._lock = threading.Lock()
+        self._started = time.perf_counter()
+
+    def enable(self):
+        self.enabled = True
+        self.reset()
+
+    def span(self, name: str):
+        """
+        Context manager measuring the wall time of a stage. Spans may be nested.
+        """
+        if not self.enabled:
+            return self._noop
+        return self._span(name)
+
+    @contextlib.contextmanager
+    def _span(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            duration = time.perf_counter() - start
+            with self._lock:
+                self.spans.append((name, start - self._started, duration, os.getpid(), threading.get_ident()))
+
+    def count(self, name: str, n: int = 1):
+        if self.enabled:
+            with self._lock:
+                self.counters[name] += n
+
+    def memory(self) -> dict:
+        """
+        Returns the peak resident set size of the process and, if torch uses CUDA, the peak allocated GPU memory.
+        """
+        # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+        peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+        memory = {"peak_rss_mb": round(peak_rss / 1024 ** 2, 1)}
+        torch = sys.modules.get("torch")  # Only report torch memory if torch is already loaded
+        if torch is not None and torch.cuda.is_available() and torch.cuda.is_initialized():
+            memory["torch_peak_allocated_mb"] = round(torch.cuda.max_memory_allocated() / 1024 ** 2, 1)
+            memory["torch_peak_reserved_mb"] = round(torch.cuda.max_memory_reserved() / 1024 ** 2, 1)
+        return memory
+
+    def summary(self) -> dict:
+        """
+        Returns the total time, number of calls and mean time of every stage, the counters,
+        throughput per counter and the peak memory.
+        """
+        stages = defaultdict(lambda: {"total_seconds": 0.0, "calls": 0})
+        for name, _, duration, _, _ in self.spans:
+            stages[name]["total_seconds"] += duration
+            stages[name]["calls"] += 1
+        for stage in stages.values():
+            stage["mean_seconds"] = stage["total_seconds"] / stage["calls"]
+        elapsed = time.perf_counter() - self._started
+        return {
+            "elapsed_seconds": elapsed,
+            "stages": dict(sorted(stages.items(), key=lambda item: -item[1]["total_seconds"])),
+            "counters": dict(self.counters),
+            "per_second": {name: value / elapsed for name, value in self.counters.items()} if elapsed > 0 else {},
+            "memory": self.memory(),
+        }
+
+    def chrome_trace(self) -> dict:
+        """
+        Returns the spans in the Chrome trace event format.
+        """
+        events = [{"name": name, "ph": "X", "ts": start * 1e6, "dur": duration * 1e6, "pid": pid, "tid": tid}
+                  for name, start, duration, pid, tid in self.spans]
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def save(self, output_file: str, trace_file: str | None = None):
+        """
+        Saves the summary as JSON and optionally the Chrome trace.
+
+        Args:
+            output_file (str): Path to the JSON summary.
+            trace_file (str | None): Path to the Chrome trace JSON.
+        """
+        os.makedirs(os.path.dirname(os.path.abspath(output_file)), exist_ok=True)
+        with open(output_file, "w") as f:
+            json.dump(self.summary(), f, indent=2)
+        if trace_file is not None:
+            with open(trace_file, "w") as f:
+                json.dump(self.chrome_trace(), f)
+
+    def print_summary(self):
+        summary = self.summary()
+        print(f"Profile ({summary['elapsed_seconds']:.2f} s):")
+        for name, stage in summary["stages"].items():
+            print(f"  {name:<24} {stage['total_seconds']:8.3f} s  {stage['calls']:6d} calls  "
+                  f"{stage['mean_seconds'] * 1000:8.2f} ms/call")
+        for name, value in summary["counters"].items():
+            print(f"  {name:<24} {value:8d}  ({summary['per_second'].get(name, 0.0):.2f}/s)")
+        print(f"  memory: {summary['memory']}")
+
+
+# Shared instance used by all pipeline stages, disabled until enable() is called
+profiler = Profiler()
@@ -0,0 +1,163 @@
+import hashlib
+import json
+import os
+
+
+def file_signature(path: str) -> str | None:
+    """
+    Cheap signature of a file (size and modification time), None if the path does not exist.
+    For a folder the signatures of all files in it are combined.
+    """
+    if os.path.isdir(path):
+        digest = hashlib.sha1()
+        for name in sorted(os.listdir(path)):
+            digest.update(f"{name}:{file_signature(os.path.join(path, name))}".encode())
+        return digest.hexdigest()
+    if not os.path.exists(path):
+        return None
+    stat = os.stat(path)
+    return f"{stat.st_size}:{stat.st_mtime_ns}"
+
+
+def content_hash(path: str) -> str:
+    """
+    SHA-1 of the file content.
+    """
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ResultsManifest:
+    """
+    Manifest of already processed images and their results, used to process a folder incrementally.
+    Every image entry stores the file size, modification time and content hash, the fingerprint of the
+    pipeline (model versions, thresholds, label store) that produced it, and its annotations and ingredients.
+    An image is processed again only if the file or the fingerprint changed.
+    Annotations store category names, not ids, so entries from different runs can be merged.
+
+    Attributes:
+        manifest_path (str): Path to the manifest JSON file.
+        entries (dict): Absolute image path -> entry.
+    """
+    def __init__(self, manifest_path: str):
+        self.manifest_path = manifest_path
+        self.entries = {}
+        if os.path.exists(manifest_path):
+            try:
+                with open(manifest_path, "r") as f:
+                    self.entries = json.load(f)
+            except (OSError, json.JSONDecodeError) as e:
+                print(f"Error loading results manifest, starting a new one: {e}")
+
+    def is_current(self, image_path: str, fingerprint: str) -> bool:
+        """
+        Checks if the stored results of an image are still valid. If only the modification time
+        changed but the content did not, the entry is updated and stays valid.
+        """
+        entry = self.entries.get(os.path.abspath(image_path))
+        if entry is None or entry["fingerprint"] != fingerprint:
+            return False
+        stat = os.stat(image_path)
+        if entry["size"] != stat.st_size:
+            return False
+        if entry["mtime"] == stat.st_mtime_ns:
+            return True
+        if entry["hash"] != content_hash(image_path):
+            return False
+        entry["mtime"] = stat.st_mtime_ns
+        return True
+
+    def stale_files(self, folder: str, image_files: list, fingerprint: str) -> list:
+        """
+        Returns the images of a folder that are new or changed since they were processed.
+
+        Args:
+            folder (str): The image folder.
+            image_files (list): File names of all images in the folder.
+            fingerprint (str): Fingerprint of the current pipeline.
+
+        Returns:
+            list: File names that have to be processed.
+        """
+        return [name for name in image_files if not self.is_current(os.path.join(folder, name), fingerprint)]
+
+    def prune(self, folder: str, image_files: list):
+        """
+        Drops entries of images that were removed from the folder.
+        """
+        folder = os.path.abspath(folder)
+        present = {os.path.join(folder, name) for name in image_files}
+        for path in [path for path in self.entries if os.path.dirname(path) == folder and path not in present]:
+            del self.entries[path]
+
+    def update(self, image_path: str, fingerprint: str, image_info: dict, annotations: list, ingredients: list):
+        """
+        Stores the results of one image.
+
+        Args:
+            image_path (str): Path to the image.
+            fingerprint (str): Fingerprint of the pipeline that produced the results.
+            image_info (dict): COCO image dict (without id, ids are assigned when merging).
+            annotations (list): Dicts with "bbox", "category" (name), "score" and "model".
+            ingredients (list): Ingredient names found in the image.
+        """
+        stat = os.stat(image_path)
+        self.entries[os.path.abspath(image_path)] = {
+            "size": stat.st_size,
+            "mtime": stat.st_mtime_ns,
+            "hash": content_hash(image_path),
+            "fingerprint": fingerprint,
+            "image": {key: value for key, value in image_info.items() if key != "id"},
+            "annotations": annotations,
+            "ingredients": ingredients,
+        }
+
+    def to_coco(self, folder: str, categories: list, info: dict | None = None) -> dict:
+        """
+        Merges the stored results of all images of a folder into one COCO dict.
+
+        Args:
+            folder (str): The image folder.
+            categories (list): COCO categories, annotation category names are mapped to their ids.
+            info (dict | None): COCO info dict.
+
+        Returns:
+            dict: The merged COCO data, image and annotation ids are assigned sequentially.
+        """
+        folder = os.path.abspath(folder)
+        name_to_id = {category["name"]: category["id"] for category in categories}
+        coco_data = {"info": info or {}, "images": [], "annotations": [], "categories": categories}
+        for path in sorted(path for path in self.entries if os.path.dirname(path) == folder):
+            entry = self.entries[path]
+            image_id = len(coco_data["images"])
+            coco_data["images"].append({"id": image_id, **entry["image"]})
+            for annotation in entry["annotations"]:
+                _, _, width, height = annotation["bbox"]
+                coco_data["annotations"].append({
+                    "id": len(coco_data["annotations"]),
+                    "image_id": image_id,
+                    "bbox": annotation["bbox"],
+                    "area": width * height,
+                    "iscrowd": 0,
+                    "category_id": name_to_id.get(annotation["category"], 0),
+                    "score": annotation["score"],
+                    "model": annotation["model"],
+                })
+        return coco_data
+
+    def ingredients(self, folder: str, annotated_folder: str) -> dict:
+        """
+        Returns annotated image path -> ingredient list for all images of a folder with ingredients.
+        """
+        folder = os.path.abspath(folder)
+        return {f"{annotated_folder}/{os.path.basename(path)}": entry["ingredients"]
+                for path, entry in sorted(self.entries.items())
+                if os.path.dirname(path) == folder and entry["ingredients"]}
+
+    def save(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.manifest_path)), exist_ok=True)
+        with open(self.manifest_path, "w") as f:
+            json.dump(self.entries, f)
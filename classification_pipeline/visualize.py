@@ -1,72 +1,221 @@
+import argparse
+import html
 import json
 import os
+from concurrent.futures import ThreadPoolExecutor
+
 import cv2
+import numpy as np
+import yaml
+
 import project.paths as paths
-# Paths
-
-# Load the COCO JSON
-with open(paths.config["clip_results"], "r") as f:
-    coco_data = json.load(f)
-
-# Create a dictionary to map category_id to category name
-category_dict = {category['id']: category['name'] for category in coco_data['categories']}
-
-
-# Function to visualize a specific image with annotations
-def visualize_image():
-    image_path = coco_data["image"]["path"]
-
-    # Check if the image exists
-    if not os.path.exists(image_path):
-        print(f"Image {image_path} does not exist.")
-        return
-
-    # Load the image
-    image = cv2.imread(image_path)
-    if image is None:
-        print(f"Failed to load image {image_path}.")
-        return
-
-    # Draw all annotations related to this image
-    for annotation in coco_data['annotations']:
-        # Extract bounding box information (if available)
-        bbox = annotation.get('bbox', None)
-        category_id = annotation['category_id']
-        label = category_dict[category_id]
-        label_str = ""
-        # i = 0
-        # for label in label_list:
-        #     if i > 0:
-        #         label_str = label_str + ", "
-        #     label_str += label
-        #     i += 1
-        # Draw the bounding box if available
-        if bbox:
-            x_min, y_min, width, height = bbox
-            x_max, y_max = int(x_min + width), int(y_min + height)
-            x_min, y_min = int(x_min), int(y_min)
-
-            # Draw rectangle for bounding box
-            color = (0, 255, 0)  # Green
-            thickness = 2
-            cv2.rectangle(image, (x_min, y_min), (x_max, y_max), color, thickness)
-
-            # Draw label above the bounding box
-            font = cv2.FONT_HERSHEY_SIMPLEX
-            font_scale = 0.5
-            font_thickness = 1
-            label_position = (x_min, y_min - 10 if y_min - 10 > 10 else y_min + 10)
-            cv2.putText(image, label, label_position, font, font_scale, color, font_thickness, cv2.LINE_AA)
-
-# Display the labeled image
-    cv2.imshow("Labeled Image", image)
-
-    # Wait for a key press and close the display window
-    if cv2.waitKey(0) & 0xFF == ord('q'):
-        cv2.destroyAllWindows()
-
-
-# Example usage to visualize image with a specific image_id
-# Note: Replace the image_id below with the actual ID of the image you want to visualize
-desired_image_id = 0  # Replace with the correct ID
-visualize_image()
+from project.classification_pipeline.annotation_renderer import AnnotationRenderer
+from project.classification_pipeline.coco_index import CocoIndex
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+
+
+def coco_items(coco_file: str, image_folder: str):
+    """
+    Yields the annotations of a COCO file per image.
+
+    Args:
+        coco_file (str): Path to the COCO JSON file.
+        image_folder (str): Folder with the images.
+
+    Yields:
+        tuple: Image path, COCO boxes [x_min, y_min, width, height] in pixels, labels, False (not normalized).
+    """
+    with open(coco_file, "r") as f:
+        coco_data = json.load(f)
+    coco_index = CocoIndex(coco_data)
+    for image_info in coco_data["images"]:
+        annotations = [annotation for annotation in coco_index.annotations(image_info["id"]) if annotation.get("bbox")]
+        yield (os.path.join(image_folder, os.path.basename(image_info["file_name"])),
+               [annotation["bbox"] for annotation in annotations],
+               [coco_index.category_name(annotation["category_id"]) or "" for annotation in annotations], False)
+
+
+def yolo_items(image_folder: str, label_folder: str, names: list | None = None):
+    """
+    Yields the annotations of a YOLO dataset folder per image.
+
+    Args:
+        image_folder (str): Folder with the images.
+        label_folder (str): Folder with the label files ({image name}.txt, class x_center y_center width height).
+        names (list | None): Class names, default "Class {id}".
+
+    Yields:
+        tuple: Image path, normalized COCO boxes [x_min, y_min, width, height], labels, True (normalized).
+    """
+    for file_name in sorted(os.listdir(image_folder)):
+        if not file_name.lower().endswith(IMAGE_EXTENSIONS):
+            continue
+        label_path = os.path.join(label_folder, f"{os.path.splitext(file_name)[0]}.txt")
+        rows = []
+        if os.path.exists(label_path):
+            with open(label_path, "r") as f:
+                rows = [line.split() for line in f if len(line.split()) == 5]
+        values = np.array([row[1:] for row in rows], dtype=np.float64).reshape(-1, 4)
+        values[:, :2] -= values[:, 2:] / 2
+        labels = [names[int(row[0])] if names and int(row[0]) < len(names) else f"Class {row[0]}" for row in rows]
+        yield os.path.join(image_folder, file_name), values.tolist(), labels, True
+
+
+class BatchVisualizer:
+    """
+    Renders annotated thumbnails, contact sheets and a static HTML gallery for many images, without a display.
+    The boxes are drawn with AnnotationRenderer.draw, the same routine the classifier uses, into the
+    downscaled image, so every thumbnail only costs a decode, a resize and an encode. Images are processed
+    in a thread pool (OpenCV releases the GIL) one contact sheet at a time, so memory does not grow with
+    the number of images.
+
+    Attributes:
+        thumbnail_size (int): Longer side of a thumbnail in pixels.
+        columns (int): Thumbnails per row of a contact sheet.
+        rows (int): Rows of a contact sheet.
+        renderer (AnnotationRenderer): Draws the boxes, sized for thumbnails.
+        n_workers (int): Number of threads.
+    """
+    def __init__(self, thumbnail_size: int = 320, columns: int = 6, rows: int = 5,
+                 renderer: AnnotationRenderer | None = None, n_workers: int | None = None):
+        self.thumbnail_size = thumbnail_size
+        self.columns = columns
+        self.rows = rows
+        self.renderer = renderer or AnnotationRenderer(thickness=1, font_scale=0.4)
+        self.n_workers = n_workers or os.cpu_count()
+
+    def thumbnail(self, image_path: str, boxes, labels, normalized: bool = False) -> np.ndarray | None:
+        """
+        Returns the downscaled image with its annotations drawn, None if it can not be decoded.
+        """
+        image = cv2.imread(image_path)
+        if image is None:
+            return None
+        height, width = image.shape[:2]
+        scale = min(1.0, self.thumbnail_size / max(height, width))
+        if scale < 1:
+            image = cv2.resize(image, (round(width * scale), round(height * scale)), interpolation=cv2.INTER_AREA)
+        boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+        boxes = boxes * ([width, height, width, height] if normalized else 1) * scale
+        return self.renderer.draw(image, boxes.tolist(), labels)
+
+    def contact_sheet(self, thumbnails: list) -> np.ndarray:
+        """
+        Places the thumbnails on a grid, each centred in a thumbnail_size square.
+        """
+        size = self.thumbnail_size
+        n_rows = -(-len(thumbnails) // self.columns)
+        sheet = np.full((n_rows * size, min(len(thumbnails), self.columns) * size, 3), 32, dtype=np.uint8)
+        for i, thumbnail in enumerate(thumbnails):
+            height, width = thumbnail.shape[:2]
+            top = (i // self.columns) * size + (size - height) // 2
+            left = (i % self.columns) * size + (size - width) // 2
+            sheet[top:top + height, left:left + width] = thumbnail
+        return sheet
+
+    def render(self, items, output_folder: str, thumbnails: bool = True, sheets: bool = True,
+               gallery: bool = True) -> dict:
+        """
+        Renders all items into output_folder: thumbnails/, sheets/sheet_XXXX.jpg and index.html.
+
+        Args:
+            items: Iterable of (image path, boxes, labels, normalized), e.g. from coco_items() or yolo_items().
+            output_folder (str): Where the output is written.
+            thumbnails (bool): Write a thumbnail per image.
+            sheets (bool): Write contact sheets.
+            gallery (bool): Write a static HTML gallery of the thumbnails (requires thumbnails).
+
+        Returns:
+            dict: Numbers of rendered images, failed images and written sheets.
+        """
+        for folder, enabled in (("thumbnails", thumbnails), ("sheets", sheets)):
+            if enabled:
+                os.makedirs(os.path.join(output_folder, folder), exist_ok=True)
+        per_sheet = self.columns * self.rows
+        stats = {"images": 0, "failed": 0, "sheets": 0}
+        entries = []
+
+        def render_item(item):
+            image_path, boxes, labels, normalized = item
+            thumbnail = self.thumbnail(image_path, boxes, labels, normalized)
+            if thumbnail is not None and thumbnails:
+                cv2.imwrite(os.path.join(output_folder, "thumbnails", os.path.basename(image_path)), thumbnail)
+            return image_path, labels, thumbnail
+
+        items = iter(items)
+        with ThreadPoolExecutor(max_workers=self.n_workers) as executor:
+            while True:
+                chunk = [item for _, item in zip(range(per_sheet), items)]
+                if not chunk:
+                    break
+                rendered = list(executor.map(render_item, chunk))
+                for image_path, labels, thumbnail in rendered:
+                    if thumbnail is None:
+                        print(f"Failed to load image {image_path}, skipping.")
+                        stats["failed"] += 1
+                        continue
+                    stats["images"] += 1
+                    entries.append((os.path.basename(image_path), labels, stats["sheets"]))
+                if sheets:
+                    sheet_thumbnails = [thumbnail for _, _, thumbnail in rendered if thumbnail is not None]
+                    if sheet_thumbnails:
+                        cv2.imwrite(os.path.join(output_folder, "sheets", f"sheet_{stats['sheets']:04d}.jpg"),
+                                    self.contact_sheet(sheet_thumbnails))
+                        stats["sheets"] += 1
+
+        if gallery and thumbnails:
+            self.write_gallery(entries, output_folder, sheets)
+        print(f"Rendered {stats['images']} images ({stats['failed']} failed) and {stats['sheets']} contact sheets "
+              f"into {output_folder}")
+        return stats
+
+    def write_gallery(self, entries: list, output_folder: str, sheets: bool = True):
+        """
+        Writes index.html with every thumbnail and its labels, linking the contact sheets.
+        """
+        cards = "\n".join(
+            f'<figure><img src="thumbnails/{html.escape(file_name)}" loading="lazy">'
+            f'<figcaption><b>{html.escape(file_name)}</b><br>{html.escape(", ".join(sorted(set(labels))))}'
+            f'</figcaption></figure>'
+            for file_name, labels, _ in entries)
+        sheet_links = ""
+        if sheets:
+            n_sheets = len({sheet for _, _, sheet in entries})
+            sheet_links = " ".join(f'<a href="sheets/sheet_{i:04d}.jpg">{i}</a>' for i in range(n_sheets))
+        with open(os.path.join(output_folder, "index.html"), "w") as f:
+            f.write(f"""<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>Annotations</title>
+<style>body{{font-family:sans-serif;background:#202020;color:#ddd}} figure{{display:inline-block;margin:4px;
+width:{self.thumbnail_size}px;vertical-align:top}} figcaption{{font-size:12px;word-wrap:break-word}} a{{color:#8cf}}</style>
+</head><body><h1>{len(entries)} images</h1><p>Contact sheets: {sheet_links}</p>
+{cards}
+</body></html>
+""")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Render annotated thumbnails, contact sheets and an HTML gallery.")
+    parser.add_argument("--coco", help="COCO file, default the classifier results (clip_results).")
+    parser.add_argument("--images", help="Image folder, default the configured images.")
+    parser.add_argument("--labels", help="YOLO label folder, renders YOLO annotations instead of a COCO file.")
+    parser.add_argument("--names", help="dataset.yaml with the class names of the YOLO labels.")
+    parser.add_argument("--output", required=True, help="Output folder.")
+    parser.add_argument("--thumbnail-size", type=int, default=320)
+    parser.add_argument("--columns", type=int, default=6)
+    parser.add_argument("--rows", type=int, default=5)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--no-gallery", action="store_true")
+    args = parser.parse_args()
+
+    image_folder = args.images or paths.config["images"]
+    if args.labels:
+        names = None
+        if args.names:
+            with open(args.names, "r") as f:
+                names = yaml.safe_load(f).get("names")
+        items = yolo_items(image_folder, args.labels, names)
+    else:
+        items = coco_items(args.coco or paths.config["clip_results"], image_folder)
+    visualizer = BatchVisualizer(args.thumbnail_size, args.columns, args.rows, n_workers=args.workers)
+    visualizer.render(items, args.output, gallery=not args.no_gallery)
@@ -0,0 +1,135 @@
+import json
+import os
+
+import numpy as np
+
+import project.paths as paths
+
+
+class Vocabulary:
+    """
+    Persistent, append-only mapping of unified ingredient labels to category ids.
+    A label keeps its id for good: labels added to the ingredient dictionary get new ids at the end,
+    labels removed from it are retired but their ids are never reused. Every change increments the
+    version, which is written into the COCO results, so results saved by different runs stay comparable.
+
+    Attributes:
+        labels (list): Unified label of every category id.
+        ids (dict): Unified label -> category id.
+        retired (set): Labels that are no longer in the ingredient dictionary.
+        synonyms (dict): Synonym (CLIP label) -> unified label.
+        version (int): Incremented on every change of labels or synonyms.
+        source_hash (str | None): Hash of the dictionary the vocabulary was last synced with.
+    """
+    def __init__(self, labels: list | None = None, retired=None, synonyms: dict | None = None, version: int = 0,
+                 source_hash: str | None = None):
+        self.labels = list(labels or [])
+        self.ids = {label: i for i, label in enumerate(self.labels)}
+        self.retired = set(retired or [])
+        self.synonyms = dict(synonyms or {})
+        self.version = version
+        self.source_hash = source_hash
+
+    def __len__(self):
+        return len(self.labels)
+
+    def sync(self, reversed_dict: dict, source_hash: str | None = None) -> bool:
+        """
+        Updates the vocabulary to a new version of the reversed ingredient dictionary.
+
+        Args:
+            reversed_dict (dict): Synonym -> unified label.
+            source_hash (str | None): Hash of the dictionary file.
+
+        Returns:
+            bool: True if anything changed (and the version was incremented).
+        """
+        unified = list(dict.fromkeys(reversed_dict.values()))
+        new_labels = [label for label in unified if label not in self.ids]
+        retired = set(self.labels) - set(unified)
+        changed = bool(new_labels) or retired != self.retired or reversed_dict != self.synonyms
+        for label in new_labels:
+            self.ids[label] = len(self.labels)
+            self.labels.append(label)
+        self.retired = retired
+        self.synonyms = dict(reversed_dict)
+        self.source_hash = source_hash
+        if changed:
+            self.version += 1
+        return changed
+
+    def unify(self, label: str) -> str:
+        """Maps a synonym to its unified label, unknown labels are returned unchanged."""
+        return self.synonyms.get(label, label)
+
+    def id(self, label: str) -> int:
+        """
+        Returns the category id of a unified label or a synonym.
+        """
+        unified = self.unify(label)
+        if unified not in self.ids:
+            raise KeyError(f"Label '{label}' is not in the vocabulary (version {self.version}).")
+        return self.ids[unified]
+
+    def lookup_table(self, keys: list) -> np.ndarray:
+        """
+        Returns the category id of every key as an integer array, so labels given as positions in keys
+        (e.g. the rows of a label index) are mapped to category ids with one array lookup.
+
+        Args:
+            keys (list): Unified labels or synonyms.
+
+        Returns:
+            np.ndarray: int64 array (len(keys),) of category ids.
+        """
+        missing = [key for key in keys if self.unify(key) not in self.ids]
+        if missing:
+            raise KeyError(f"{len(missing)} labels are not in the vocabulary (version {self.version}), "
+                           f"e.g. {missing[:5]}. Re-run embed_labels.py after changing the ingredient dictionary.")
+        return np.fromiter((self.ids[self.unify(key)] for key in keys), dtype=np.int64, count=len(keys))
+
+    def categories(self) -> list:
+        """
+        Returns the COCO categories of all ids, retired labels included so that old ids stay resolvable.
+        """
+        return [{"id": i, "name": label, **({"retired": True} if label in self.retired else {})}
+                for i, label in enumerate(self.labels)]
+
+    def save(self, output_file: str):
+        # Written atomically, the daemon, the service and the workers read the same file
+        paths.write_json_atomic(output_file, {"version": self.version, "source_hash": self.source_hash,
+                                              "labels": self.labels, "retired": sorted(self.retired),
+                                              "synonyms": self.synonyms}, indent=1)
+
+    @classmethod
+    def load(cls, input_file: str) -> "Vocabulary":
+        with open(input_file, "r") as f:
+            data = json.load(f)
+        return cls(data["labels"], data.get("retired"), data.get("synonyms"), data.get("version", 0),
+                   data.get("source_hash"))
+
+
+_vocabulary = None
+
+
+def load_vocabulary() -> Vocabulary:
+    """
+    Returns the vocabulary stored in paths.config["vocabulary"], synced with the current reversed
+    ingredient dictionary. When the dictionary changed, the new version is saved back.
+    """
+    global _vocabulary
+    bundle = paths.label_bundle()
+    if _vocabulary is not None and _vocabulary.source_hash == bundle.source_hash:
+        return _vocabulary
+
+    vocabulary_file = paths.config.get("vocabulary")
+    vocabulary = Vocabulary()
+    if vocabulary_file and os.path.exists(vocabulary_file):
+        vocabulary = Vocabulary.load(vocabulary_file)
+    if vocabulary.source_hash != bundle.source_hash:
+        if vocabulary.sync(bundle.reversed_dict, bundle.source_hash):
+            print(f"Ingredient vocabulary updated to version {vocabulary.version}.")
+        if vocabulary_file:
+            vocabulary.save(vocabulary_file)
+    _vocabulary = vocabulary
+    return vocabulary
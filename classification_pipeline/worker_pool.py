@@ -0,0 +1,162 @@
+import gc
+import multiprocessing
+import os
+import shutil
+import tempfile
+
+import project.paths as paths
+from project.classification_pipeline.classifier import IngredientClassifier, annotation_fragments
+
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+
+# Set in the parent before the workers are forked, the workers inherit it with the loaded models
+_classifier = None
+
+
+def _init_worker(threads_per_worker: int, crop_root: str):
+    """
+    Runs once in every worker process after the fork.
+    """
+    import torch
+    torch.set_num_threads(threads_per_worker)
+    _classifier.crop_folder = os.path.join(crop_root, f"worker{os.getpid()}")
+    clip_models = [_classifier.clip_model]
+    if hasattr(_classifier.clip_model, "small_model"):
+        clip_models = [_classifier.clip_model.small_model, _classifier.clip_model.large_model]
+    for clip_model in clip_models:
+        # The SQLite connection of the parent must not be shared
+        if clip_model.embedding_cache is not None:
+            clip_model.embedding_cache.reopen()
+
+
+def _classify_chunk(task: tuple) -> tuple[list, list]:
+    """
+    Classifies a chunk of images in a worker.
+
+    Returns:
+        tuple[list, list]: Per-image results (file name, image dict, annotations with category names,
+            ingredients) and the categories of the run.
+    """
+    image_folder, file_names, iou_threshold, tiled, max_tiles = task
+    detections, coco_index = _classifier.classify(image_folder, file_names, iou_threshold, tiled, max_tiles,
+                                                  save_detections=False)
+    results = [(os.path.basename(image_info["file_name"]), image_info, annotation_fragments(coco_index, image_id),
+                coco_index.ingredients(image_id))
+               for image_id, image_info in coco_index.images.items()]
+    return results, detections.categories
+
+
+class WorkerPool:
+    """
+    Runs IngredientClassifier in several processes to use all CPU cores.
+    The models are loaded once in the parent, the workers are forked afterwards and share the weights
+    and the label matrix copy-on-write, so RAM does not grow with the number of workers. Every worker
+    limits torch to threads_per_worker threads, so the workers do not oversubscribe the cores.
+    Images are sent to the workers in small chunks, a worker that finishes early takes the next chunk.
+
+    Every worker crops into its own folder inside a temporary folder, which close() removes.
+
+    CPU only: CUDA can not be used in forked processes.
+
+    Attributes:
+        classifier (IngredientClassifier): The loaded pipeline.
+        n_workers (int): Number of worker processes.
+        threads_per_worker (int): torch threads of every worker.
+    """
+    def __init__(self, classifier: IngredientClassifier, n_workers: int | None = None,
+                 threads_per_worker: int | None = None):
+        import torch
+        if torch.cuda.is_available() and torch.cuda.is_initialized():
+            raise ValueError("WorkerPool needs the models on CPU, CUDA can not be used after fork.")
+        self.classifier = classifier
+        self.n_workers = n_workers or os.cpu_count()
+        self.threads_per_worker = threads_per_worker or max(1, os.cpu_count() // self.n_workers)
+        self._pool = None
+        self._crop_root = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def start(self):
+        global _classifier
+        if self._pool is not None:
+            return
+        _classifier = self.classifier
+        # Load the vocabulary and the label store before forking so the workers share them
+        self.classifier.warm_up()
+        # Move everything allocated so far out of the garbage collector's reach, otherwise its
+        # bookkeeping writes touch the shared pages and every worker ends up with a private copy
+        gc.freeze()
+        crop_parent = os.path.dirname(os.path.abspath(paths.config["cropped_objects_folder"]))
+        os.makedirs(crop_parent, exist_ok=True)
+        self._crop_root = tempfile.mkdtemp(prefix="cropped_objects_workers_", dir=crop_parent)
+        self._pool = multiprocessing.get_context("fork").Pool(
+            self.n_workers, initializer=_init_worker, initargs=(self.threads_per_worker, self._crop_root))
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+            gc.unfreeze()
+        if self._crop_root is not None:
+            shutil.rmtree(self._crop_root, ignore_errors=True)
+            self._crop_root = None
+
+    def classify_folder(self, image_folder: str, image_files: list | None = None, iou_threshold: float = 0.7,
+                        tiled: bool = False, max_tiles: int | None = None, chunk_size: int = 4) -> tuple[dict, dict]:
+        """
+        Classifies all images of a folder with the workers.
+
+        Args:
+            image_folder (str): Folder with the images.
+            image_files (list | None): File names to process, default all images of the folder.
+            iou_threshold (float): IoU threshold of the box merging.
+            tiled (bool): Run the detectors on overlapping tiles as well.
+            max_tiles (int | None): Upper bound on the number of tiles per image.
+            chunk_size (int): Number of images sent to a worker at once.
+
+        Returns:
+            tuple[dict, dict]: The merged COCO data and annotated image path -> list of ingredients.
+        """
+        self.start()
+        if image_files is None:
+            image_files = sorted(f for f in os.listdir(image_folder) if f.lower().endswith(IMAGE_EXTENSIONS))
+        tasks = [(image_folder, image_files[i:i + chunk_size], iou_threshold, tiled, max_tiles)
+                 for i in range(0, len(image_files), chunk_size)]
+
+        per_image, categories = {}, []
+        for results, chunk_categories in self._pool.imap_unordered(_classify_chunk, tasks):
+            categories = categories or chunk_categories
+            for file_name, image_info, annotations, ingredients in results:
+                per_image[file_name] = (image_info, annotations, ingredients)
+
+        # Merge in folder order, ids are assigned sequentially
+        name_to_id = {category["name"]: category["id"] for category in categories}
+        coco_data = {"info": {}, "images": [], "annotations": [], "categories": categories}
+        image_ingredients = {}
+        for file_name in image_files:
+            if file_name not in per_image:
+                continue
+            image_info, annotations, ingredients = per_image[file_name]
+            image_id = len(coco_data["images"])
+            coco_data["images"].append({**image_info, "id": image_id})
+            for annotation in annotations:
+                coco_data["annotations"].append({
+                    "id": len(coco_data["annotations"]),
+                    "image_id": image_id,
+                    "bbox": annotation["bbox"],
+                    "area": annotation["bbox"][2] * annotation["bbox"][3],
+                    "iscrowd": 0,
+                    "category_id": name_to_id.get(annotation["category"], 0),
+                    "score": annotation["score"],
+                    "model": annotation["model"],
+                })
+            if ingredients:
+                image_ingredients[f"{paths.config["annotated_images"]}/{file_name}"] = ingredients
+        return coco_data, image_ingredients
@@ -4,128 +4,246 @@ import os
 
 from tqdm import tqdm
 
+import cv2
+import numpy as np
+
 import project.paths as paths
-from charset_normalizer import detect
-from ultralytics import YOLO
+
+from project.classification_pipeline.detection_result import DetectionResult
+from project.classification_pipeline.profiler import profiler
+from project.classification_pipeline.yolo_model_pipeline.box_ops import (coverage, make_tiles, nms,
+                                                                         weighted_boxes_fusion, xyxy_to_xywh)
+
+
+EXPORT_FORMATS = ("onnx", "openvino")
 
 
 class YoloModel(abc.ABC):
-    def __init__(self, path_to_model:str = None):
+    def __init__(self, path_to_model:str = None, export_format: str | None = None, thresholds_file: str | None = None):
+        """
+        Args:
+            path_to_model (str): Unused, both models are loaded from paths.config.
+            export_format (str | None): Run the models through an exported backend ("onnx" or "openvino")
+                instead of PyTorch. The export is created next to the .pt file on first use.
+            thresholds_file (str | None): JSON with calibrated detection thresholds (see
+                evaluation.calibrate_detection_thresholds), default paths.config["detection_thresholds"].
+        """
+        self.export_format = export_format
+        self.conf1 = 0.1  # Confidence threshold of model1 (general ingredients)
+        self.conf2 = 0.05  # Confidence threshold of model2 (packaged goods)
+        self.max_detections = None  # Cap on detections per image, the best scoring are kept
+        self.skip_model2_coverage = None  # Skip model2 when model1 boxes cover at least this fraction of the image
+        self.load_thresholds(thresholds_file or paths.config.get("detection_thresholds"))
         if not path_to_model:
-            self.model1 = YOLO(paths.config["yolo_model_1"])
-            self.model2 = YOLO(paths.config["yolo_model_2"])
+            self.model1 = self._load_model(paths.config["yolo_model_1"])
+            self.model2 = self._load_model(paths.config["yolo_model_2"])
+
+    def load_thresholds(self, thresholds_file: str | None):
+        """
+        Loads detection thresholds (conf1, conf2, max_detections, skip_model2_coverage) from a JSON file.
+        Missing file or keys keep the current values.
+        """
+        if not thresholds_file or not os.path.exists(thresholds_file):
+            return
+        with open(thresholds_file, "r") as f:
+            thresholds = json.load(f)
+        for key in ("conf1", "conf2", "max_detections", "skip_model2_coverage"):
+            if key in thresholds:
+                setattr(self, key, thresholds[key])
+
+    def _load_model(self, model_path: str) -> "YOLO":
+        """Loads a model, exported to self.export_format when possible, falling back to the .pt weights."""
+        from ultralytics import YOLO  # Imported on first use, ultralytics takes seconds to import
+        if self.export_format is None:
+            return YOLO(model_path)
+        if self.export_format not in EXPORT_FORMATS:
+            raise ValueError(f"Invalid export format '{self.export_format}'. Choose one of {EXPORT_FORMATS}.")
+
+        stem = os.path.splitext(model_path)[0]
+        exported_path = f"{stem}.onnx" if self.export_format == "onnx" else f"{stem}_openvino_model"
+        try:
+            if not os.path.exists(exported_path):
+                # Dynamic input shapes, so several images can be stacked into one batch
+                exported_path = YOLO(model_path).export(format=self.export_format, dynamic=True)
+            return YOLO(exported_path, task="detect")
+        except Exception as e:
+            print(f"Export of {model_path} to {self.export_format} failed, using PyTorch weights: {e}")
+            self.export_format = None
+            return YOLO(model_path)
+
+    def _predict(self, model, images, conf, offsets=None):
+        """
+        Runs one batched forward pass of a model.
+
+        Args:
+            model (YOLO): The model.
+            images (list): Decoded BGR images (or tiles) forming one batch.
+            conf (float): Confidence threshold.
+            offsets (np.ndarray | None): (x, y) offset of every image in the batch, added to its boxes.
+
+        Returns:
+            tuple[np.ndarray, np.ndarray, np.ndarray]: Boxes (n, 4) in [x_min, y_min, x_max, y_max] format,
+                scores (n,) and the position in the batch of the image every box was found in (n,).
+        """
+        results = model(images, conf=conf, verbose=False)
+        boxes, scores = [np.zeros((0, 4), dtype=np.float32)], [np.zeros(0, dtype=np.float32)]
+        sources = [np.zeros(0, dtype=np.int64)]
+        for i, result in enumerate(results):
+            if result.boxes is None or not len(result.boxes):
+                continue
+            xyxy = result.boxes.xyxy.cpu().numpy().astype(np.float32)
+            if offsets is not None:
+                xyxy += np.tile(offsets[i], 2)
+            boxes.append(xyxy)
+            scores.append(result.boxes.conf.cpu().numpy().astype(np.float32))
+            sources.append(np.full(len(xyxy), i, dtype=np.int64))
+        return np.concatenate(boxes), np.concatenate(scores), np.concatenate(sources)
+
+    def detect(self, folder_path, output_file, iou_threshold=0.7, save: bool = False, tiled: bool = False,
+               tile_size: int = 640, tile_overlap: float = 0.2, max_tiles: int | None = None,
+               merge: str = "nms", image_files: list | None = None, frames: dict | None = None,
+               detections: DetectionResult | None = None, batch_size: int = 8) -> DetectionResult:
+        """
+        Detects objects in all images of a folder with both models and merges their boxes.
+        batch_size images (with their tiles) are stacked into one forward pass per model.
+
+        Args:
+            folder_path (str): Folder with the images.
+            output_file (str): Where the results are saved if save is True.
+            iou_threshold (float): IoU threshold of the box merging.
+            save (bool): Save the results to output_file.
+            tiled (bool): Besides the whole image, also run the models on overlapping tiles so that small
+                objects on high-resolution photos are not lost when the image is downscaled to the model input.
+            tile_size (int): Side of a tile in pixels.
+            tile_overlap (float): Fraction of a tile overlapping its neighbour.
+            max_tiles (int | None): Cost control, tiles are enlarged so that there are at most max_tiles per image.
+            merge (str): "nms" keeps the best of overlapping boxes, "wbf" fuses them (weighted boxes fusion),
+                "none" keeps the raw boxes of both models (used to calibrate the thresholds).
+            image_files (list | None): File names inside folder_path to process, default all images of the folder.
+            frames (dict | None): If provided, the decoded BGR images are stored in it keyed by image id,
+                so later stages (cropping, rendering) do not decode them again.
+            detections (DetectionResult | None): Results of earlier calls the images are appended to
+                (their ids continue after the existing images), default a new result.
+            batch_size (int): Number of images per forward pass.
 
-    def detect(self, folder_path, output_file, iou_threshold=0.7, save: bool = False):
+        Returns:
+            DetectionResult: The merged detections.
+        """
+        if merge not in ("nms", "wbf", "none"):
+            raise ValueError("Invalid merge method. Choose 'nms', 'wbf' or 'none'.")
 
         # List all images in the folder
-        image_files = [f for f in os.listdir(folder_path) if f.lower().endswith(('.png', '.jpg', '.jpeg'))]
+        if image_files is None:
+            image_files = [f for f in os.listdir(folder_path) if f.lower().endswith(('.png', '.jpg', '.jpeg'))]
 
-        # Initialize COCO format data
-        coco_data = {
-            "info": {
+        # Columnar results, converted to COCO format only when needed
+        if detections is None:
+            detections = DetectionResult(info={
                 "description": "Model Inference Results with NMS",
                 "version": "2.0",
                 "year": 2024,
                 "contributor": "Petr and Filip",
-            },
-            "images": [],
-            "annotations": [],
-            "categories": []
-        }
-
-        image_id = 0  # To keep track of image ids
-        annotation_id = 0  # To keep track of annotation ids
-
-        for image_name in tqdm(image_files, desc="Object detection"):
-            image_path = os.path.join(folder_path, image_name)
-
-            results1 = self.model1([image_path], conf=0.1, verbose=False)
-            results2 = self.model2([image_path], conf=0.05, verbose=False)
-
-            image_info = {
-                "id": image_id,
-                "file_name": "images/" + image_name,
-                "width": results1[0].orig_shape[1],
-                "height": results1[0].orig_shape[0],
-            }
-
-            coco_data["images"].append(image_info)
-
-            all_detections = []
-
-            # Extract detections from model1
-            for result in results1:
-                boxes = result.boxes
-                if boxes is not None:
-                    for i, box in enumerate(boxes.xyxy):
-                        x_min, y_min, x_max, y_max = map(float, box)
-                        width = x_max - x_min
-                        height = y_max - y_min
-                        score = float(boxes.conf[i])
-                        model_id = 1  # Category ID for model1
-                        all_detections.append({
-                            "bbox": [x_min, y_min, width, height],
-                            "confidence": score,
-                            "model": model_id,
-                        })
-
-            # Extract detections from model2
-            for result in results2:
-                boxes = result.boxes
-                if boxes is not None:
-                    for i, box in enumerate(boxes.xyxy):
-                        x_min, y_min, x_max, y_max = map(float, box)
-                        width = x_max - x_min
-                        height = y_max - y_min
-                        score = float(boxes.conf[i])
-                        model_id = 2  # Category ID for model2
-                        all_detections.append({
-                            "bbox": [x_min, y_min, width, height],
-                            "confidence": score,
-                            "model": model_id
-                        })
-
-            # Perform Non-Maximum Suppression (NMS)
-            nms_detections = self.non_max_suppression(all_detections, iou_threshold=iou_threshold)
-
-            # Add annotations from NMS filtered detections
-            for detection in nms_detections:
-                x_min, y_min, width, height = detection["bbox"]
-                coco_data["annotations"].append({
-                    "id": annotation_id,
-                    "image_id": image_id,
-                    "bbox": [int(x_min), int(y_min), int(width), int(height)],
-                    "area": int(width * height),
-                    "iscrowd": 0,
-                    "segmentation": [],
-                    "category_id": 0,
-                })
-                annotation_id += 1
-
-            image_id += 1  # Increment image id for each new image
+            })
 
-        if save:
-            with open(output_file, "w") as f:
-                json.dump(coco_data, f, indent=4)
+        image_id = len(detections.images)  # To keep track of image ids
 
-        return coco_data
+        with tqdm(total=len(image_files), desc="Object detection") as progress:
+            for start in range(0, len(image_files), batch_size):
+                images, image_names = [], []
+                for image_name in image_files[start:start + batch_size]:
+                    image_path = os.path.join(folder_path, image_name)
+                    with profiler.span("decode"):
+                        image = cv2.imread(image_path)
+                    if image is None:
+                        print(f"Failed to load image {image_path}.")
+                        continue
+                    profiler.count("images")
+                    images.append(image)
+                    image_names.append(image_name)
+                progress.update(len(image_files[start:start + batch_size]))
+                if not images:
+                    continue
 
-    def non_max_suppression(self, detections, iou_threshold=0.8):
-        """Apply Non-Maximum Suppression to a list of detections."""
-        detections = sorted(detections, key=lambda x: x['confidence'], reverse=True)
-        nms_detections = []
+                # One batch with every image (and its tiles), owners maps a batch position to its image
+                batch, offsets, owners = [], [], []
+                for i, image in enumerate(images):
+                    if tiled:
+                        tiles, tile_offsets = make_tiles(image, tile_size, tile_overlap, max_tiles)
+                        # The whole image is the global pass, the model downscales it to its input size.
+                        # Images that fit into one tile get no tiles, so they are not predicted twice
+                        batch += [image] + tiles
+                        offsets.append(np.vstack([np.zeros((1, 2), dtype=np.float32), tile_offsets]))
+                        owners += [i] * (len(tiles) + 1)
+                    else:
+                        batch.append(image)
+                        offsets.append(np.zeros((1, 2), dtype=np.float32))
+                        owners.append(i)
+                offsets = np.vstack(offsets)
+                owners = np.array(owners, dtype=np.int64)
+
+                with profiler.span("yolo_model1"):
+                    boxes1, scores1, sources1 = self._predict(self.model1, batch, self.conf1, offsets)
+                owners1 = owners[sources1]
+                # Early exit, the packaged-goods model is not needed for images model1 already covers
+                run_model2 = np.ones(len(images), dtype=bool)
+                if self.skip_model2_coverage is not None:
+                    run_model2 = np.array([coverage(boxes1[owners1 == i], image.shape[0], image.shape[1]) <
+                                           self.skip_model2_coverage for i, image in enumerate(images)])
+                positions = np.flatnonzero(run_model2[owners])
+                if len(positions):
+                    with profiler.span("yolo_model2"):
+                        boxes2, scores2, sources2 = self._predict(self.model2, [batch[j] for j in positions],
+                                                                  self.conf2, offsets[positions])
+                    owners2 = owners[positions[sources2]]
+                else:
+                    boxes2, scores2 = np.zeros((0, 4), dtype=np.float32), np.zeros(0, dtype=np.float32)
+                    owners2 = np.zeros(0, dtype=np.int64)
+
+                for i, (image, image_name) in enumerate(zip(images, image_names)):
+                    mask1, mask2 = owners1 == i, owners2 == i
+                    boxes = np.concatenate([boxes1[mask1], boxes2[mask2]])
+                    scores = np.concatenate([scores1[mask1], scores2[mask2]])
+                    # 1 = model1, 2 = model2
+                    model_ids = np.concatenate([np.full(mask1.sum(), 1), np.full(mask2.sum(), 2)])
+
+                    # Merge overlapping boxes of both models (and of neighbouring tiles)
+                    with profiler.span("nms"):
+                        if merge == "wbf":
+                            boxes, scores, model_ids = weighted_boxes_fusion(boxes, scores, model_ids,
+                                                                             iou_threshold=iou_threshold)
+                        elif merge == "nms":
+                            keep = nms(boxes, scores, iou_threshold=iou_threshold)
+                            boxes, scores, model_ids = boxes[keep], scores[keep], model_ids[keep]
+                    if self.max_detections is not None:
+                        keep = np.argsort(-scores, kind="stable")[:self.max_detections]
+                        boxes, scores, model_ids = boxes[keep], scores[keep], model_ids[keep]
 
-        while detections:
-            best_detection = detections.pop(0)
-            nms_detections.append(best_detection)
+                    image_info = {
+                        "id": image_id,
+                        "file_name": "images/" + image_name,
+                        "width": image.shape[1],
+                        "height": image.shape[0],
+                    }
+                    detections.add_image(image_info, boxes=xyxy_to_xywh(boxes), scores=scores, model_ids=model_ids)
+                    if frames is not None:
+                        frames[image_id] = image
 
-            # Remove detections that overlap too much with the best detection
-            detections = [
-                det for det in detections
-                if self.calculate_iou(best_detection['bbox'], det['bbox']) < iou_threshold
-            ]
+                    image_id += 1  # Increment image id for each new image
 
-        return nms_detections
+        if save:
+            with profiler.span("save_json"):
+                detections.save(output_file)
+
+        return detections
+
+    def non_max_suppression(self, detections, iou_threshold=0.8):
+        """Apply Non-Maximum Suppression to a list of detections."""
+        if not detections:
+            return []
+        boxes = np.array([det['bbox'] for det in detections], dtype=np.float32)
+        boxes[:, 2:] += boxes[:, :2]
+        keep = nms(boxes, [det['confidence'] for det in detections], iou_threshold=iou_threshold)
+        return [detections[i] for i in keep]
 
     def calculate_iou(self, box1, box2):
         """Calculate Intersection over Union (IoU) between two bounding boxes."""
@@ -0,0 +1,144 @@
+import numpy as np
+
+
+def xyxy_to_xywh(boxes: np.ndarray) -> np.ndarray:
+    """Converts boxes (n, 4) from [x_min, y_min, x_max, y_max] to [x_min, y_min, width, height]."""
+    boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+    return np.concatenate([boxes[:, :2], boxes[:, 2:] - boxes[:, :2]], axis=1)
+
+
+def box_iou(boxes1: np.ndarray, boxes2: np.ndarray) -> np.ndarray:
+    """
+    Computes the pairwise IoU of two sets of boxes in [x_min, y_min, x_max, y_max] format.
+
+    Args:
+        boxes1 (np.ndarray): Array (n, 4).
+        boxes2 (np.ndarray): Array (m, 4).
+
+    Returns:
+        np.ndarray: IoU matrix (n, m).
+    """
+    top_left = np.maximum(boxes1[:, None, :2], boxes2[None, :, :2])
+    bottom_right = np.minimum(boxes1[:, None, 2:], boxes2[None, :, 2:])
+    intersection = np.prod(np.clip(bottom_right - top_left, 0, None), axis=2)
+    area1 = np.prod(boxes1[:, 2:] - boxes1[:, :2], axis=1)
+    area2 = np.prod(boxes2[:, 2:] - boxes2[:, :2], axis=1)
+    union = area1[:, None] + area2[None, :] - intersection
+    return np.divide(intersection, union, out=np.zeros_like(intersection, dtype=np.float64), where=union > 0)
+
+
+def nms(boxes: np.ndarray, scores: np.ndarray, iou_threshold: float = 0.7) -> np.ndarray:
+    """
+    Greedy non-maximum suppression, the IoU of the kept box against all remaining boxes is computed at once.
+
+    Args:
+        boxes (np.ndarray): Array (n, 4) in [x_min, y_min, x_max, y_max] format.
+        scores (np.ndarray): Array (n,) of confidences.
+        iou_threshold (float): Boxes overlapping a kept box with IoU >= iou_threshold are removed.
+
+    Returns:
+        np.ndarray: Indices of the kept boxes, sorted by descending score.
+    """
+    order = np.argsort(-np.asarray(scores), kind="stable")
+    boxes = np.asarray(boxes, dtype=np.float32)
+    keep = []
+    while len(order):
+        best = order[0]
+        keep.append(best)
+        if len(order) == 1:
+            break
+        ious = box_iou(boxes[best:best + 1], boxes[order[1:]])[0]
+        order = order[1:][ious < iou_threshold]
+    return np.asarray(keep, dtype=np.int64)
+
+
+def weighted_boxes_fusion(boxes: np.ndarray, scores: np.ndarray, labels: np.ndarray,
+                          iou_threshold: float = 0.55) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Weighted boxes fusion. Instead of dropping overlapping boxes, every cluster of boxes overlapping
+    the highest scoring one is replaced by the score-weighted average box.
+
+    Args:
+        boxes (np.ndarray): Array (n, 4) in [x_min, y_min, x_max, y_max] format.
+        scores (np.ndarray): Array (n,) of confidences.
+        labels (np.ndarray): Array (n,) carried along, the label of the best box of a cluster is kept.
+        iou_threshold (float): Boxes with IoU >= iou_threshold against the cluster head are fused.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray, np.ndarray]: Fused boxes, their mean scores and labels.
+    """
+    boxes = np.asarray(boxes, dtype=np.float32)
+    scores = np.asarray(scores, dtype=np.float32)
+    labels = np.asarray(labels)
+    order = np.argsort(-scores, kind="stable")
+    fused_boxes, fused_scores, fused_labels = [], [], []
+    while len(order):
+        best = order[0]
+        ious = box_iou(boxes[best:best + 1], boxes[order])[0]
+        cluster = order[ious >= iou_threshold]
+        weights = scores[cluster]
+        fused_boxes.append((boxes[cluster] * weights[:, None]).sum(axis=0) / weights.sum())
+        fused_scores.append(weights.mean())
+        fused_labels.append(labels[best])
+        order = order[ious < iou_threshold]
+    if not fused_boxes:
+        return np.zeros((0, 4), dtype=np.float32), np.zeros(0, dtype=np.float32), labels[:0]
+    return np.stack(fused_boxes), np.asarray(fused_scores, dtype=np.float32), np.asarray(fused_labels)
+
+
+def coverage(boxes: np.ndarray, height: int, width: int, grid: int = 64) -> float:
+    """
+    Estimates the fraction of an image covered by the union of boxes, on a coarse grid.
+
+    Args:
+        boxes (np.ndarray): Array (n, 4) in [x_min, y_min, x_max, y_max] format.
+        height (int): Image height.
+        width (int): Image width.
+        grid (int): Resolution of the grid the boxes are rasterized to.
+
+    Returns:
+        float: Covered fraction in [0, 1].
+    """
+    mask = np.zeros((grid, grid), dtype=bool)
+    scale = np.array([grid / width, grid / height, grid / width, grid / height])
+    for x_min, y_min, x_max, y_max in np.clip(np.round(np.asarray(boxes) * scale), 0, grid).astype(int):
+        mask[y_min:y_max, x_min:x_max] = True
+    return float(mask.mean())
+
+
+def make_tiles(image: np.ndarray, tile_size: int = 640, overlap: float = 0.2,
+               max_tiles: int | None = None) -> tuple[list, np.ndarray]:
+    """
+    Splits an image into overlapping tiles. Tiles are views into the image, no pixels are copied.
+    An image that fits into one tile (or max_tiles <= 1) gives no tiles, the whole image is already
+    the global pass of tiled detection.
+
+    Args:
+        image (np.ndarray): The decoded image (h, w, c).
+        tile_size (int): Side of a tile in pixels.
+        overlap (float): Fraction of a tile that overlaps its neighbour.
+        max_tiles (int | None): Upper bound on the number of tiles, tiles are enlarged to stay under it.
+
+    Returns:
+        tuple[list, np.ndarray]: The tiles and their (x, y) offsets in the image, shape (n, 2).
+    """
+    height, width = image.shape[:2]
+    if max(width, height) <= tile_size or (max_tiles is not None and max_tiles <= 1):
+        return [], np.zeros((0, 2), dtype=np.float32)
+    while True:
+        stride = max(1, int(tile_size * (1 - overlap)))
+        xs = list(range(0, max(width - tile_size, 0) + 1, stride))
+        ys = list(range(0, max(height - tile_size, 0) + 1, stride))
+        # Make sure the right and bottom borders are covered
+        if xs[-1] + tile_size < width:
+            xs.append(width - tile_size)
+        if ys[-1] + tile_size < height:
+            ys.append(height - tile_size)
+        if max_tiles is None or len(xs) * len(ys) <= max_tiles or tile_size >= max(width, height):
+            break
+        tile_size = int(tile_size * 1.25)
+    if tile_size >= max(width, height):
+        return [], np.zeros((0, 2), dtype=np.float32)
+    tiles = [image[y:y + tile_size, x:x + tile_size] for y in ys for x in xs]
+    offsets = np.array([(x, y) for y in ys for x in xs], dtype=np.float32)
+    return tiles, offsets
@@ -8,33 +8,51 @@ import project.paths as paths
 import cv2
 import json
 
+from project.classification_pipeline.coco_index import CocoIndex
+from project.classification_pipeline.profiler import profiler
+
 # Paths
-def cut_out_objects(coco_data, image_folder):
-    images_folder = paths.config["images"]  # Folder containing the images
-    output_folder = paths.config["cropped_objects_folder"]  # Folder to save cropped boxes
+def cut_out_objects(coco_data, image_folder, coco_index: CocoIndex | None = None,
+                    output_folder: str | None = None, frames: dict | None = None) -> dict:
+    """
+    Crops all annotated objects and saves them into output_folder, default paths.config["cropped_objects_folder"].
+    coco_index is the index of coco_data, built if not provided. Images already decoded by the detector
+    are taken from frames (keyed by image id), the others are read from image_folder.
+
+    Returns:
+        dict: The decoded BGR images keyed by image id, so later stages do not decode them again.
+    """
+    images_folder = image_folder or paths.config["images"]  # Folder containing the images
+    output_folder = output_folder or paths.config["cropped_objects_folder"]  # Folder to save cropped boxes
 
     # Clear the directory if it exists
     if os.path.exists(output_folder):
         shutil.rmtree(output_folder)  # Remove all files and subdirectories
     os.makedirs(output_folder, exist_ok=True)  # Recreate the empty directory
 
+    frames = {} if frames is None else frames
+    coco_index = coco_index or CocoIndex(coco_data)
     for image_info in tqdm(coco_data["images"], desc="Cropping objects"):
         image_name = os.path.basename(image_info["file_name"])
         image_path = os.path.join(images_folder, image_name)
-        # Check if the image exists
-        if not os.path.exists(image_path):
-            print(f"Image {image_path} does not exist.")
-            continue
-
-        # Load the image
-        image = cv2.imread(image_path)
+        image = frames.get(image_info["id"])
         if image is None:
-            print(f"Failed to load image {image_path}.")
-            continue
+            # Check if the image exists
+            if not os.path.exists(image_path):
+                print(f"Image {image_path} does not exist.")
+                continue
+
+            # Load the image
+            with profiler.span("crop_decode"):
+                image = cv2.imread(image_path)
+            if image is None:
+                print(f"Failed to load image {image_path}.")
+                continue
+            frames[image_info["id"]] = image
 
         # Process each annotation for this image
-        for annotation in coco_data["annotations"]:
-            if annotation["image_id"] == image_info["id"]:
+        with profiler.span("crop"):
+            for annotation in coco_index.annotations(image_info["id"]):
                 x, y, w, h = map(int, annotation["bbox"])  # Bounding box (x, y, width, height)
                 annotation_id = annotation["id"]
 
@@ -50,6 +68,9 @@ def cut_out_objects(coco_data, image_folder):
 
                 # Save the cropped image
                 cv2.imwrite(crop_path, crop)
+                profiler.count("crops")
+
+    return frames
 
     # print(f"Cropping completed. Cropped images saved to {output_folder}.")
 
@@ -0,0 +1,96 @@
+import math
+import os
+
+import cv2
+from ultralytics.data.dataset import YOLODataset
+from ultralytics.models.yolo.detect import DetectionTrainer
+from ultralytics.utils import colorstr
+from ultralytics.utils.torch_utils import de_parallel
+
+from project.classification_pipeline.yolo_model_pipeline.shards import INDEX_FILE, ShardReader
+
+
+class ShardedYOLODataset(YOLODataset):
+    """
+    YOLODataset that reads a subset packed by shards.pack_subset() instead of a folder of image and label files.
+    The labels come from the index, the images are decoded from the memory-mapped shards.
+    Augmentation, mosaic, rect batches etc. are inherited unchanged.
+    """
+    def __init__(self, *args, preload=False, **kwargs):
+        self.preload = preload
+        super().__init__(*args, **kwargs)
+
+    def get_img_files(self, img_path):
+        self.reader = ShardReader(img_path, preload=self.preload)
+        # Virtual paths, only used as names (plots, logs)
+        return [os.path.join(img_path, entry.get("file_name", f"{entry['key']}.jpg")) for entry in self.reader.images]
+
+    def get_labels(self):
+        labels = []
+        for i, entry in enumerate(self.reader.images):
+            cls, bboxes = self.reader.labels(i)
+            labels.append({"im_file": self.im_files[i], "shape": tuple(entry["shape"]), "cls": cls, "bboxes": bboxes,
+                           "segments": [], "keypoints": None, "normalized": True, "bbox_format": "xywh"})
+        return labels
+
+    def load_image(self, i, rect_mode=True):
+        """
+        Same as BaseDataset.load_image(), but decodes the image from its shard.
+        """
+        im = self.ims[i]
+        if im is not None:
+            return self.ims[i], self.im_hw0[i], self.im_hw[i]
+
+        im = self.reader.image(i)
+        if im is None:
+            raise FileNotFoundError(f"Image {self.im_files[i]} could not be decoded from its shard.")
+        h0, w0 = im.shape[:2]
+        if rect_mode:  # resize long side to imgsz while maintaining aspect ratio
+            r = self.imgsz / max(h0, w0)
+            if r != 1:
+                w, h = (min(math.ceil(w0 * r), self.imgsz), min(math.ceil(h0 * r), self.imgsz))
+                im = cv2.resize(im, (w, h), interpolation=cv2.INTER_LINEAR)
+        elif not (h0 == w0 == self.imgsz):  # resize by stretching image to square imgsz
+            im = cv2.resize(im, (self.imgsz, self.imgsz), interpolation=cv2.INTER_LINEAR)
+
+        # Add to buffer if training with augmentations
+        if self.augment:
+            self.ims[i], self.im_hw0[i], self.im_hw[i] = im, (h0, w0), im.shape[:2]
+            self.buffer.append(i)
+            if 1 < len(self.buffer) >= self.max_buffer_length:
+                j = self.buffer.pop(0)
+                if self.cache != "ram":
+                    self.ims[j], self.im_hw0[j], self.im_hw[j] = None, None, None
+        return im, (h0, w0), im.shape[:2]
+
+
+class ShardTrainer(DetectionTrainer):
+    """
+    DetectionTrainer that uses ShardedYOLODataset for subsets packed into shards and the normal
+    YOLODataset otherwise. Pass it as model.train(trainer=ShardTrainer, ...).
+    Set ShardTrainer.preload = True to read every shard into memory once instead of memory-mapping it.
+    """
+    preload = False
+
+    def build_dataset(self, img_path, mode="train", batch=None):
+        if not os.path.exists(os.path.join(img_path, INDEX_FILE)):
+            return super().build_dataset(img_path, mode, batch)
+        stride = max(int(de_parallel(self.model).stride.max() if self.model else 0), 32)
+        return ShardedYOLODataset(
+            img_path=img_path,
+            imgsz=self.args.imgsz,
+            batch_size=batch,
+            augment=mode == "train",
+            hyp=self.args,
+            rect=self.args.rect or mode == "val",
+            cache=None,  # The shards are kept in memory by the OS page cache or with preload
+            single_cls=self.args.single_cls or False,
+            stride=stride,
+            pad=0.0 if mode == "train" else 0.5,
+            prefix=colorstr(f"{mode}: "),
+            task=self.args.task,
+            classes=self.args.classes,
+            data=self.data,
+            fraction=self.args.fraction if mode == "train" else 1.0,
+            preload=self.preload,
+        )
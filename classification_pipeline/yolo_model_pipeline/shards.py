@@ -0,0 +1,240 @@
+import argparse
+import io
+import json
+import mmap
+import os
+import tarfile
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+import yaml
+from PIL import Image
+from tqdm import tqdm
+
+from project.classification_pipeline.image_dataset_preprocessing.converting_polygons_to_xywh import (
+    convert_rows, parse_label_file)
+
+INDEX_FILE = "index.json"
+SUBSETS = ("train", "valid", "test")
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+
+def _prepare_image(image_path, imgsz):
+    """
+    Reads an image for packing, downscaled so that its longer side is at most imgsz if imgsz is set.
+
+    Returns:
+        tuple[bytes, list, str]: The encoded image, its [height, width] and its extension (the original one,
+            or .jpg if it was re-encoded).
+    """
+    with open(image_path, 'rb') as file:
+        data = file.read()
+    extension = os.path.splitext(image_path)[1].lower()
+    if imgsz is None:
+        width, height = Image.open(io.BytesIO(data)).size
+        return data, [height, width], extension
+
+    image = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+    height, width = image.shape[:2]
+    ratio = imgsz / max(height, width)
+    if ratio < 1:
+        # YOLO labels are normalized, resizing does not change them
+        image = cv2.resize(image, (round(width * ratio), round(height * ratio)), interpolation=cv2.INTER_AREA)
+        data = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, 95])[1].tobytes()
+        extension = '.jpg'
+    return data, list(image.shape[:2]), extension
+
+
+def _read_labels(label_path):
+    """
+    Reads a YOLO label file for packing. Polygon rows are converted to xywh boxes (as in
+    converting_polygons_to_xywh) so the index only holds "class x_center y_center width height" rows,
+    rows without coordinates are dropped.
+    """
+    if not os.path.exists(label_path):
+        return ""
+    with open(label_path, 'r') as file:
+        text = file.read()
+    try:
+        class_ids, values, lengths = parse_label_file(text)
+    except ValueError as e:
+        raise ValueError(f"Can not parse the labels in {label_path}: {e}") from e
+    if (lengths == 4).all():
+        return text
+    boxes, _ = convert_rows(values, lengths)
+    return "".join(f"{class_id} " + " ".join(f"{coord:.6f}" for coord in box) + "\n"
+                   for class_id, box, length in zip(class_ids, boxes.tolist(), lengths) if length >= 2)
+
+
+def pack_subset(image_folder, label_folder, output_folder, shard_size=1 << 30, imgsz=None, workers=8):
+    """
+    Packs the images and labels of one subset into tar shards (WebDataset layout: {key}.{extension} and
+    {key}.txt next to each other) and writes an index with the position of every image and its labels.
+    The key is the file name without its extension, images whose keys collide (a.jpg and a.png share the
+    label file a.txt) are rejected.
+
+    Args:
+        image_folder (str): Folder with the images.
+        label_folder (str): Folder with the YOLO label files, images without one get an empty label.
+        output_folder (str): Folder for the shards and the index.
+        shard_size (int): Bytes after which a new shard is started.
+        imgsz (int | None): Downscale images so their longer side is at most imgsz (e.g. the training imgsz).
+        workers (int): Threads that read and resize the images.
+
+    Returns:
+        int: Number of packed images.
+    """
+    os.makedirs(output_folder, exist_ok=True)
+    image_files = sorted(f for f in os.listdir(image_folder) if f.lower().endswith(IMAGE_EXTENSIONS))
+    keys = {}
+    for file_name in image_files:
+        keys.setdefault(os.path.splitext(file_name)[0], []).append(file_name)
+    collisions = [names for names in keys.values() if len(names) > 1]
+    if collisions:
+        raise ValueError(f"{len(collisions)} images in {image_folder} share their name without the extension, "
+                         f"e.g. {', '.join(collisions[0])}. Rename them before packing.")
+    entries, shards = [], []
+    tar, tar_bytes = None, 0
+
+    def close_shard():
+        tar.close()
+        # The data offsets are only known once the shard is written
+        with tarfile.open(os.path.join(output_folder, shards[-1]), 'r') as written:
+            offsets = {member.name: member.offset_data for member in written.getmembers()}
+        for entry in entries:
+            if entry["shard"] == len(shards) - 1:
+                entry["offset"] = offsets[entry["file_name"]]
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        prepared = executor.map(lambda f: _prepare_image(os.path.join(image_folder, f), imgsz), image_files)
+        for file_name, (data, shape, extension) in tqdm(zip(image_files, prepared), total=len(image_files),
+                                             desc=f"Packing {os.path.basename(output_folder)}"):
+            if tar is None or tar_bytes >= shard_size:
+                if tar is not None:
+                    close_shard()
+                shards.append(f"shard-{len(shards):05d}.tar")
+                tar, tar_bytes = tarfile.open(os.path.join(output_folder, shards[-1]), 'w'), 0
+
+            key = os.path.splitext(file_name)[0]
+            labels = _read_labels(os.path.join(label_folder, f"{key}.txt"))
+            for name, payload in ((f"{key}{extension}", data), (f"{key}.txt", labels.encode())):
+                info = tarfile.TarInfo(name)
+                info.size = len(payload)
+                tar.addfile(info, io.BytesIO(payload))
+            tar_bytes += len(data)
+            entries.append({"key": key, "file_name": f"{key}{extension}", "shard": len(shards) - 1, "offset": None,
+                            "size": len(data), "shape": shape, "labels": labels})
+    if tar is not None:
+        close_shard()
+
+    with open(os.path.join(output_folder, INDEX_FILE), 'w') as file:
+        json.dump({"imgsz": imgsz, "shards": shards, "images": entries}, file)
+    return len(entries)
+
+
+def pack_dataset(dataset_root, output_root, shard_size=1 << 30, imgsz=None, workers=8):
+    """
+    Packs a dataset produced by combine_datasets (train/valid/test with images and labels) into shards
+    and writes a dataset.yaml pointing to the packed subsets, to be used with ShardTrainer.
+
+    Args:
+        dataset_root (str): Root of the dataset, with dataset.yaml.
+        output_root (str): Root of the packed dataset.
+        shard_size (int): Bytes after which a new shard is started.
+        imgsz (int | None): Downscale images so their longer side is at most imgsz.
+        workers (int): Threads that read and resize the images.
+
+    Returns:
+        str: Path to the dataset.yaml of the packed dataset.
+    """
+    with open(os.path.join(dataset_root, "dataset.yaml"), 'r') as file:
+        dataset = yaml.safe_load(file)
+    packed = {"train": None, "val": None, "test": None}
+    for subset, key in zip(SUBSETS, packed):
+        image_folder = os.path.join(dataset_root, subset, 'images')
+        if not os.path.isdir(image_folder):
+            continue
+        output_folder = os.path.join(os.path.abspath(output_root), subset)
+        n_images = pack_subset(image_folder, os.path.join(dataset_root, subset, 'labels'), output_folder,
+                               shard_size, imgsz, workers)
+        print(f"Packed {n_images} images of {subset} into {output_folder}")
+        packed[key] = output_folder
+
+    yaml_file_path = os.path.join(output_root, "dataset.yaml")
+    with open(yaml_file_path, 'w') as file:
+        yaml.safe_dump({**{key: value for key, value in packed.items() if value}, "nc": dataset["nc"],
+                        "names": dataset["names"]}, file)
+    print(f"YAML file created at: {yaml_file_path}")
+    return yaml_file_path
+
+
+class ShardReader:
+    """
+    Random access to the images of a packed subset. The shards are memory-mapped, or with preload read
+    into memory once, shard by shard, so an epoch does not open a file per image.
+
+    Attributes:
+        folder (str): Folder with the shards and the index.
+        imgsz (int | None): Size the images were downscaled to when packing.
+        shards (list): Shard file names.
+        images (list): Index entry of every image (key, file_name, shard, offset, size, shape, labels).
+    """
+    def __init__(self, folder, preload=False):
+        self.folder = folder
+        with open(os.path.join(folder, INDEX_FILE), 'r') as file:
+            index = json.load(file)
+        self.imgsz = index["imgsz"]
+        self.shards = index["shards"]
+        self.images = index["images"]
+        self._buffers = {}  # Opened lazily, so every data loader process maps the shards itself
+        if preload:
+            for i, shard in enumerate(self.shards):
+                with open(os.path.join(folder, shard), 'rb') as file:
+                    self._buffers[i] = file.read()
+
+    def __len__(self):
+        return len(self.images)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_buffers"] = {i: buffer for i, buffer in self._buffers.items() if isinstance(buffer, bytes)}
+        return state
+
+    def _buffer(self, shard):
+        if shard not in self._buffers:
+            with open(os.path.join(self.folder, self.shards[shard]), 'rb') as file:
+                self._buffers[shard] = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._buffers[shard]
+
+    def read(self, i):
+        """Returns the encoded bytes of image i."""
+        entry = self.images[i]
+        return self._buffer(entry["shard"])[entry["offset"]:entry["offset"] + entry["size"]]
+
+    def image(self, i):
+        """Returns image i decoded as a BGR array."""
+        return cv2.imdecode(np.frombuffer(self.read(i), np.uint8), cv2.IMREAD_COLOR)
+
+    def labels(self, i):
+        """
+        Returns:
+            tuple[np.ndarray, np.ndarray]: Class ids (n, 1) and normalized xywh boxes (n, 4) of image i.
+        """
+        class_ids, values, lengths = parse_label_file(self.images[i]["labels"])
+        boxes, _ = convert_rows(values, lengths)  # Only needed for indexes packed before labels were converted
+        valid = lengths >= 2
+        cls = np.array(class_ids, dtype=np.float32).reshape(-1, 1)[valid]
+        return cls, boxes[valid].astype(np.float32)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pack a YOLO dataset into tar shards for faster training I/O.")
+    parser.add_argument("dataset_root", help="Root of the dataset (train/valid/test and dataset.yaml).")
+    parser.add_argument("output_root", help="Root of the packed dataset.")
+    parser.add_argument("--imgsz", type=int, default=None, help="Downscale the images to the training size.")
+    parser.add_argument("--shard-size", type=int, default=1024, help="Shard size in MiB.")
+    parser.add_argument("--workers", type=int, default=8)
+    args = parser.parse_args()
+
+    pack_dataset(args.dataset_root, args.output_root, args.shard_size * 1024 ** 2, args.imgsz, args.workers)
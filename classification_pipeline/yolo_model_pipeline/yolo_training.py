@@ -1,14 +1,27 @@
+import argparse
+
 from ultralytics import YOLO
 
-model = YOLO("yolov8m.pt")  # load a pretrained model (recommended for training)
-
-# Train the model
-results = model.train(
-    data="/mnt/home2/SU2/ingredients_photo_dataset/final_dataset/dataset.yaml",
-    epochs=400,
-    imgsz=640,
-    device=0,  # Specify GPU device
-    batch=8,  # Reduce if you face memory issues
-    save_period=10,  # Save weights after each epoch (useful for debugging)
-    name="yolo11n-experiment",
-)
\ No newline at end of file
+from project.classification_pipeline.yolo_model_pipeline.shard_dataset import ShardTrainer
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Train the ingredient detector.")
+    parser.add_argument("--data", default="/mnt/home2/SU2/ingredients_photo_dataset/final_dataset/dataset.yaml",
+                        help="dataset.yaml of the dataset, or of a dataset packed with shards.py.")
+    parser.add_argument("--preload", action="store_true", help="Read the shards into memory once.")
+    args = parser.parse_args()
+
+    model = YOLO("yolov8m.pt")  # load a pretrained model (recommended for training)
+    ShardTrainer.preload = args.preload
+
+    # Train the model, packed subsets are read from their shards, folders as before
+    results = model.train(
+        data=args.data,
+        trainer=ShardTrainer,
+        epochs=400,
+        imgsz=640,
+        device=0,  # Specify GPU device
+        batch=8,  # Reduce if you face memory issues
+        save_period=10,  # Save weights after each epoch (useful for debugging)
+        name="yolo11n-experiment",
+    )
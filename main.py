@@ -1,20 +1,52 @@
+import argparse
+import json
 import os
 import shutil
 
 from project import paths
-from project.chatGPT_API.chatptapi import chat_gpt_api
 from project.classification_pipeline.classifier import IngredientClassifier
+from project.classification_pipeline.profiler import profiler
 from project.recipe_dataset.filtering import recipe_filtering
 
 if __name__ == "__main__":
-    classifier = IngredientClassifier()
-    shutil.rmtree(paths.config["annotated_images"])
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--incremental", action="store_true",
+                        help="Only process new or changed images, reuse the results of the others.")
+    parser.add_argument("--workers", type=int, default=0,
+                        help="Classify with this many CPU worker processes sharing the loaded models.")
+    parser.add_argument("--profile", action="store_true",
+                        help="Record per-stage timings and memory, saved to paths.config[\"profile\"].")
+    parser.add_argument("--set", action="append", default=[], metavar="KEY=VALUE",
+                        help="Override a configuration entry of paths_configs.yaml, may be repeated.")
+    args = parser.parse_args()
+    if args.incremental and args.workers:
+        parser.error("--incremental can not be combined with --workers.")
+    paths.apply_overrides(args.set)
+    paths.validate()
+    if args.profile:
+        profiler.enable()
+
+    with profiler.span("load_models"):
+        classifier = IngredientClassifier()
+    if not args.incremental:
+        shutil.rmtree(paths.config["annotated_images"], ignore_errors=True)
     os.makedirs(paths.config["annotated_images"], exist_ok=True)
 
-    images, ingredients= classifier.inference(paths.config["images"])
-    if images:
-        for name, image in images.items():
-            image.save(f"{paths.config["annotated_images"]}/{os.path.basename(name)}")
+    if args.workers:
+        from project.classification_pipeline.worker_pool import WorkerPool
+        with WorkerPool(classifier, n_workers=args.workers) as pool:
+            coco_data, ingredients = pool.classify_folder(paths.config["images"])
+        with profiler.span("save_json"), open(paths.config["clip_results"], "w") as f:
+            json.dump(coco_data, f, separators=(",", ":"))
+        images = classifier.add_bboxes_and_annotation(coco_data, output_folder=paths.config["annotated_images"])
+    else:
+        images, ingredients= classifier.inference(paths.config["images"], output_folder=paths.config["annotated_images"],
+                                                  incremental=args.incremental)
+
+    if args.profile:
+        profiler.print_summary()
+        profile_file = paths.config["profile"]
+        profiler.save(profile_file, os.path.splitext(profile_file)[0] + "_trace.json")
 
     print("Filtered recipe:")
     for i, line in enumerate(recipe_filtering(list(ingredients.values())[0]), start=1):
@@ -22,4 +54,5 @@ if __name__ == "__main__":
         print()
 
     print("GPT recipe:")
+    from project.chatGPT_API.chatptapi import chat_gpt_api
     print(chat_gpt_api(list(ingredients.values())[0]))
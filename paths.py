@@ -1,4 +1,178 @@
+"""
+Runtime configuration of the project.
+
+The configuration is read once from paths_configs.yaml (next to this file, or the file in the
+REMI_CONFIG environment variable) and exposed as the dict paths.config, as before.
+
+- Relative paths are resolved against the "root" entry of the file, or the folder of the file if there is none.
+- Every entry can be overridden with an environment variable REMI_<KEY> (e.g. REMI_IMAGES=/data/photos)
+  or from the command line with apply_overrides(["images=/data/photos"]).
+- validate() checks that the input files and folders exist before anything is loaded.
+- label_bundle() returns the parsed ingredient dictionary (synonym -> unified label) with its hash.
+  It is cached in a JSON file keyed by the hash of the dictionary, so the YAML is only parsed again
+  when the dictionary changes.
+"""
+import hashlib
+import json
+import os
+import tempfile
+
 import yaml
 
-with open("/home/petr/Documents/SU2_project/project/paths_configs.yaml", "r") as f:
-    config = yaml.safe_load(f)
\ No newline at end of file
+
+CONFIG_FILE = os.environ.get("REMI_CONFIG",
+                             os.path.join(os.path.dirname(os.path.abspath(__file__)), "paths_configs.yaml"))
+ENV_PREFIX = "REMI_"
+
+# Entries that must exist before the pipeline runs, the rest are outputs created on demand
+INPUT_FILES = ("reversed_ingredients_dict", "ingredients_dict", "yolo_model_1", "yolo_model_2", "recipe_dataset")
+INPUT_FOLDERS = ("images", "embedded_labels")
+
+
+def _resolve(value, root: str):
+    if isinstance(value, str) and value and not os.path.isabs(value) and not value.startswith("~"):
+        return os.path.normpath(os.path.join(root, value))
+    if isinstance(value, str) and value.startswith("~"):
+        return os.path.expanduser(value)
+    return value
+
+
+def load_config(config_file: str = CONFIG_FILE) -> dict:
+    """
+    Reads the configuration file, applies the environment overrides and resolves relative paths.
+
+    Args:
+        config_file (str): Path to the YAML configuration.
+
+    Returns:
+        dict: Configuration key -> value.
+    """
+    with open(config_file, "r") as f:
+        raw = yaml.safe_load(f) or {}
+    for key, value in os.environ.items():
+        if key.startswith(ENV_PREFIX) and key != "REMI_CONFIG":
+            raw[key[len(ENV_PREFIX):].lower()] = value
+    root = raw.pop("root", None) or os.path.dirname(os.path.abspath(config_file))
+    root = os.path.expanduser(root)
+    return {key: _resolve(value, root) for key, value in raw.items()} | {"root": root}
+
+
+def apply_overrides(overrides: list):
+    """
+    Overrides configuration entries, e.g. from a --set KEY=VALUE command line option.
+    Relative paths are resolved against the configuration root.
+
+    Args:
+        overrides (list): Strings "key=value".
+    """
+    for override in overrides or []:
+        key, separator, value = override.partition("=")
+        if not separator:
+            raise ValueError(f"Invalid override '{override}', expected KEY=VALUE.")
+        config[key.strip()] = _resolve(value.strip(), config["root"])
+    _bundle_cache.clear()
+
+
+def validate(required_files=INPUT_FILES, required_folders=INPUT_FOLDERS, strict: bool = True) -> list:
+    """
+    Checks that the configured input files and folders exist.
+
+    Args:
+        required_files: Keys of entries that must be existing files (or folders, for exported models).
+        required_folders: Keys of entries that must be existing folders.
+        strict (bool): Raise a ValueError listing all problems instead of returning them.
+
+    Returns:
+        list: Descriptions of the problems found, empty if the configuration is valid.
+    """
+    problems = []
+    for key in required_files:
+        if not config.get(key):
+            problems.append(f"'{key}' is not configured")
+        elif not os.path.exists(config[key]):
+            problems.append(f"'{key}' does not exist: {config[key]}")
+    for key in required_folders:
+        if not config.get(key):
+            problems.append(f"'{key}' is not configured")
+        elif not os.path.isdir(config[key]):
+            problems.append(f"'{key}' is not a folder: {config[key]}")
+    if problems and strict:
+        raise ValueError(f"Invalid configuration {CONFIG_FILE}:\n  " + "\n  ".join(problems))
+    return problems
+
+
+def write_json_atomic(output_file: str, data, **dump_kwargs):
+    """
+    Writes data as JSON to a temporary file next to output_file and moves it into place, so other
+    processes reading the file never see it half-written.
+
+    Args:
+        output_file (str): Path to the JSON file.
+        data: The data to write.
+        **dump_kwargs: Passed to json.dump (indent, separators, ...).
+    """
+    folder = os.path.dirname(os.path.abspath(output_file))
+    os.makedirs(folder, exist_ok=True)
+    descriptor, temporary_path = tempfile.mkstemp(dir=folder, prefix=f".{os.path.basename(output_file)}.")
+    try:
+        with os.fdopen(descriptor, "w") as f:
+            json.dump(data, f, **dump_kwargs)
+        os.replace(temporary_path, output_file)
+    except BaseException:
+        os.remove(temporary_path)
+        raise
+
+
+class LabelBundle:
+    """
+    The parsed reversed ingredient dictionary. Category ids are assigned by the Vocabulary
+    (classification_pipeline/vocabulary.py), which is synced with it.
+
+    Attributes:
+        reversed_dict (dict): Synonym -> unified label.
+        source_hash (str): SHA-1 of the dictionary file the bundle was derived from.
+    """
+    def __init__(self, reversed_dict: dict, source_hash: str):
+        self.reversed_dict = reversed_dict
+        self.source_hash = source_hash
+
+
+_bundle_cache = {}
+
+
+def label_bundle() -> LabelBundle:
+    """
+    Returns the LabelBundle of config["reversed_ingredients_dict"]. Within a process it is computed once
+    per version of the file (checked by size and modification time). Across processes it is cached in
+    config["derived_cache"], keyed by the hash of the file, so the YAML is only parsed after it changed.
+    """
+    source = config["reversed_ingredients_dict"]
+    stat = os.stat(source)
+    signature = (source, stat.st_size, stat.st_mtime_ns)
+    if signature in _bundle_cache:
+        return _bundle_cache[signature]
+
+    with open(source, "rb") as f:
+        source_hash = hashlib.sha1(f.read()).hexdigest()
+    cache_file = config.get("derived_cache")
+    reversed_dict = None
+    if cache_file and os.path.exists(cache_file):
+        try:
+            with open(cache_file, "r") as f:
+                cached = json.load(f)
+            if cached.get("source_hash") == source_hash:
+                reversed_dict = cached["reversed_dict"]
+        except (OSError, json.JSONDecodeError, KeyError) as e:
+            print(f"Ignoring broken config cache {cache_file}: {e}")
+    if reversed_dict is None:
+        with open(source, "r") as f:
+            reversed_dict = yaml.safe_load(f) or {}
+        if cache_file:
+            write_json_atomic(cache_file, {"source_hash": source_hash, "reversed_dict": reversed_dict})
+
+    _bundle_cache.clear()
+    _bundle_cache[signature] = LabelBundle(reversed_dict, source_hash)
+    return _bundle_cache[signature]
+
+
+config = load_config()
@@ -0,0 +1,225 @@
+import argparse
+import asyncio
+import os
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from aiohttp import web
+
+from project import paths
+from project.chatGPT_API.chatptapi import chat_gpt_api
+from project.classification_pipeline.classifier import IngredientClassifier, annotation_fragments
+from project.recipe_dataset.filtering import recipe_filtering
+
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+
+
+class InferenceService:
+    """
+    Local HTTP service around IngredientClassifier, so consumers do not have to load the models themselves.
+    Concurrent /classify requests are collected into micro-batches: the first request of a batch waits at
+    most max_wait seconds for others, then the whole batch goes through one detection and labelling run.
+    All model work runs in a single worker thread, the event loop only receives uploads and answers.
+
+    Endpoints:
+        POST /classify: image upload (multipart field "image" or raw body), optional query
+            recipes=filter|gpt. Returns the ingredients, the boxes and optionally a recipe.
+        POST /recipes: JSON {"ingredients": [...], "source": "filter" | "gpt"}.
+        GET /health: liveness and queue size.
+        GET /metrics: request, batch and latency counters.
+
+    Attributes:
+        classifier (IngredientClassifier): The pipeline, loaded once.
+        upload_folder (str): Where uploaded images are stored while they are processed.
+        max_batch_size (int): Maximal number of images per batch.
+        max_wait (float): Seconds the first request of a batch waits for more requests.
+        max_queue (int): Maximal number of waiting requests, further requests get 503.
+    """
+    def __init__(self, classifier: IngredientClassifier, upload_folder: str, max_batch_size: int = 16,
+                 max_wait: float = 0.05, max_queue: int = 64):
+        self.classifier = classifier
+        self.upload_folder = upload_folder
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.max_queue = max_queue
+        self.queue = None
+        self.model_executor = ThreadPoolExecutor(max_workers=1)  # The pipeline shares the crop folder
+        self.recipe_executor = ThreadPoolExecutor(max_workers=4)
+        self.started = time.time()
+        self.metrics = {"requests": 0, "rejected": 0, "failed": 0, "batches": 0, "images": 0,
+                        "batch_seconds": 0.0, "latency_seconds": 0.0, "max_latency_seconds": 0.0}
+
+    def create_app(self) -> web.Application:
+        app = web.Application(client_max_size=32 * 1024 ** 2)
+        app.add_routes([web.post("/classify", self.handle_classify),
+                        web.post("/recipes", self.handle_recipes),
+                        web.get("/health", self.handle_health),
+                        web.get("/metrics", self.handle_metrics)])
+        app.on_startup.append(self._start_batcher)
+        app.on_cleanup.append(self._stop_batcher)
+        return app
+
+    async def _start_batcher(self, app):
+        os.makedirs(self.upload_folder, exist_ok=True)
+        self.queue = asyncio.Queue(maxsize=self.max_queue)
+        app["batcher"] = asyncio.create_task(self._batcher())
+
+    async def _stop_batcher(self, app):
+        app["batcher"].cancel()
+        self.model_executor.shutdown(wait=False)
+        self.recipe_executor.shutdown(wait=False)
+
+    async def _batcher(self):
+        """
+        Collects queued requests into batches and runs them one after another.
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            start = time.time()
+            try:
+                results = await loop.run_in_executor(self.model_executor, self._run_batch,
+                                                     [file_name for file_name, _ in batch])
+                for file_name, future in batch:
+                    if not future.done():
+                        future.set_result(results.get(file_name))
+            except Exception as e:
+                print(f"Failed to process batch of {len(batch)} images: {e}")
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+            self.metrics["batches"] += 1
+            self.metrics["images"] += len(batch)
+            self.metrics["batch_seconds"] += time.time() - start
+
+    def _run_batch(self, file_names: list) -> dict:
+        """
+        Detects and labels a batch of uploaded images, runs in the model thread.
+
+        Returns:
+            dict: File name -> {"ingredients": [...], "detections": [...]}.
+        """
+        try:
+            # The whole micro-batch shares one forward pass per model
+            _, coco_index = self.classifier.classify(self.upload_folder, file_names, save_detections=False,
+                                                     chunk_size=len(file_names), batch_size=len(file_names))
+            return {os.path.basename(image_info["file_name"]): {
+                        "ingredients": coco_index.ingredients(image_id),
+                        "detections": annotation_fragments(coco_index, image_id),
+                    } for image_id, image_info in coco_index.images.items()}
+        finally:
+            for file_name in file_names:
+                os.remove(os.path.join(self.upload_folder, file_name))
+
+    def _recipe(self, ingredients: list, source: str):
+        if not ingredients:
+            return None
+        if source == "gpt":
+            return chat_gpt_api(ingredients)
+        return recipe_filtering(ingredients)
+
+    async def _read_upload(self, request: web.Request) -> tuple[bytes, str]:
+        if request.content_type.startswith("multipart/"):
+            reader = await request.multipart()
+            async for part in reader:
+                if part.name == "image":
+                    return await part.read(), os.path.splitext(part.filename or "")[1].lower()
+            raise web.HTTPBadRequest(text="Missing multipart field 'image'.")
+        return await request.read(), ".png" if request.content_type == "image/png" else ".jpg"
+
+    async def handle_classify(self, request: web.Request) -> web.Response:
+        start = time.time()
+        self.metrics["requests"] += 1
+        source = request.query.get("recipes")
+        if source not in (None, "filter", "gpt"):
+            raise web.HTTPBadRequest(text="Invalid recipes source. Choose 'filter' or 'gpt'.")
+        if self.queue.full():
+            self.metrics["rejected"] += 1
+            raise web.HTTPServiceUnavailable(text="Too many requests waiting, try again later.")
+
+        data, extension = await self._read_upload(request)
+        if not data:
+            raise web.HTTPBadRequest(text="Empty upload.")
+        file_name = f"{uuid.uuid4().hex}{extension if extension in IMAGE_EXTENSIONS else '.jpg'}"
+        with open(os.path.join(self.upload_folder, file_name), "wb") as f:
+            f.write(data)
+
+        future = asyncio.get_running_loop().create_future()
+        try:
+            self.queue.put_nowait((file_name, future))
+        except asyncio.QueueFull:
+            os.remove(os.path.join(self.upload_folder, file_name))
+            self.metrics["rejected"] += 1
+            raise web.HTTPServiceUnavailable(text="Too many requests waiting, try again later.")
+        try:
+            result = await future
+        except Exception as e:
+            self.metrics["failed"] += 1
+            raise web.HTTPInternalServerError(text=f"Inference failed: {e}")
+        if result is None:
+            self.metrics["failed"] += 1
+            raise web.HTTPUnprocessableEntity(text="The upload could not be decoded as an image.")
+
+        if source is not None:
+            result["recipe"] = await asyncio.get_running_loop().run_in_executor(
+                self.recipe_executor, self._recipe, result["ingredients"], source)
+        latency = time.time() - start
+        self.metrics["latency_seconds"] += latency
+        self.metrics["max_latency_seconds"] = max(self.metrics["max_latency_seconds"], latency)
+        return web.json_response(result)
+
+    async def handle_recipes(self, request: web.Request) -> web.Response:
+        try:
+            body = await request.json()
+        except ValueError:  # JSONDecodeError and UnicodeDecodeError
+            raise web.HTTPBadRequest(text="The body is not valid JSON.")
+        if not isinstance(body, dict):
+            raise web.HTTPBadRequest(text="Expected {'ingredients': [...], 'source': 'filter' | 'gpt'}.")
+        ingredients = body.get("ingredients")
+        source = body.get("source", "filter")
+        if not isinstance(ingredients, list) or source not in ("filter", "gpt"):
+            raise web.HTTPBadRequest(text="Expected {'ingredients': [...], 'source': 'filter' | 'gpt'}.")
+        recipe = await asyncio.get_running_loop().run_in_executor(self.recipe_executor, self._recipe,
+                                                                  ingredients, source)
+        return web.json_response({"ingredients": ingredients, "recipe": recipe})
+
+    async def handle_health(self, request: web.Request) -> web.Response:
+        return web.json_response({"status": "ok", "queue": self.queue.qsize(),
+                                  "uptime_seconds": round(time.time() - self.started, 1)})
+
+    async def handle_metrics(self, request: web.Request) -> web.Response:
+        metrics = dict(self.metrics, queue=self.queue.qsize())
+        answered = metrics["requests"] - metrics["rejected"] - metrics["failed"]
+        metrics["mean_batch_size"] = metrics["images"] / metrics["batches"] if metrics["batches"] else 0.0
+        metrics["mean_latency_seconds"] = metrics["latency_seconds"] / answered if answered > 0 else 0.0
+        return web.json_response(metrics)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local HTTP service for ingredient classification.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--max-batch-size", type=int, default=16)
+    parser.add_argument("--max-wait", type=float, default=0.05, help="Seconds a request waits for a batch to fill.")
+    parser.add_argument("--max-queue", type=int, default=64)
+    parser.add_argument("--set", action="append", default=[], metavar="KEY=VALUE",
+                        help="Override a configuration entry of paths_configs.yaml, may be repeated.")
+    args = parser.parse_args()
+    paths.apply_overrides(args.set)
+    paths.validate()
+
+    service = InferenceService(IngredientClassifier(), paths.config["service_uploads"],
+                               max_batch_size=args.max_batch_size, max_wait=args.max_wait, max_queue=args.max_queue)
+    web.run_app(service.create_app(), host=args.host, port=args.port)
@@ -1,116 +1,250 @@
+import argparse
 import json
+import sys
 
+import numpy as np
 
-def validate_coco_file(coco_file_path, log_path=None):
-    """
-    Validate that a COCO file has valid image IDs, category IDs, and annotations.
+try:
+    import ijson
+except ImportError:  # ijson is optional, without it the file is loaded at once
+    ijson = None
 
-    Args:
-        coco_file_path (str): Path to the COCO JSON file to validate.
-        log_path (str, optional): If provided, logs the issues to this file.
 
-    Returns:
-        None
-    """
-    issues = []  # List to store validation issues
+def _as_int(value):
+    return value if isinstance(value, int) and not isinstance(value, bool) else None
 
-    # Step 1: Load the COCO file
-    try:
-        with open(coco_file_path, 'r') as f:
-            coco_data = json.load(f)
-    except Exception as e:
-        print(f"Error: Failed to load COCO file. {e}")
-        return
 
-    # Step 2: Extract essential data
-    images = coco_data.get('images', [])
-    annotations = coco_data.get('annotations', [])
-    categories = coco_data.get('categories', [])
+def _as_float(value):
+    return float(value) if isinstance(value, (int, float)) and not isinstance(value, bool) else np.nan
 
-    # Create mappings for quick lookup
-    image_ids = {image['id'] for image in images}
-    category_ids = {category['id'] for category in categories}
-    category_names = {category['id']: category['name'] for category in categories}
 
-    print(f"Total images: {len(images)}")
-    print(f"Total annotations: {len(annotations)}")
-    print(f"Total categories: {len(categories)}")
+SECTIONS = ("images", "categories", "annotations")
 
-    # Step 3: Validate each annotation
-    for i, annotation in enumerate(annotations):
-        annotation_id = annotation.get('id')
-        image_id = annotation.get('image_id')
-        category_id = annotation.get('category_id')
-        bbox = annotation.get('bbox')
 
-        if annotation_id is None:
-            issues.append(f"Annotation {i}: Missing 'id' field.")
-
-        if image_id not in image_ids:
-            issues.append(
-                f"Annotation {i} (ID={annotation_id}): 'image_id' ({image_id}) does not exist in the image list.")
-
-        if category_id not in category_ids:
-            issues.append(
-                f"Annotation {i} (ID={annotation_id}): 'category_id' ({category_id}) is not in the categories list.")
-
-        if not isinstance(bbox, list) or len(bbox) != 4 or not all(isinstance(x, (int, float)) for x in bbox):
-            issues.append(f"Annotation {i} (ID={annotation_id}): 'bbox' is invalid. Got {bbox}.")
+def _entries(coco_file_path, coco_data):
+    """
+    Yields (section, entry) for the entries of "images", "categories" and "annotations". With ijson the
+    file is streamed in a single pass, only one entry is held in memory at a time.
+    """
+    if coco_data is not None:
+        for section in SECTIONS:
+            for entry in coco_data.get(section, []):
+                yield section, entry
+        return
+    item_prefixes = {f"{section}.item": section for section in SECTIONS}
+    with open(coco_file_path, 'rb') as f:
+        builder, section = None, None
+        for prefix, event, value in ijson.parse(f, use_float=True):
+            if builder is not None:
+                builder.event(event, value)
+                if prefix == f"{section}.item" and event in ('end_map', 'end_array'):
+                    yield section, builder.value
+                    builder = None
+            elif prefix in item_prefixes:
+                section = item_prefixes[prefix]
+                if event in ('start_map', 'start_array'):
+                    builder = ijson.ObjectBuilder()
+                    builder.event(event, value)
+                else:
+                    yield section, value
+
+
+def load_columns(coco_file_path):
+    """
+    Reads a COCO file into columnar arrays in a single pass over the file. Missing or malformed ids are -1 with
+    the corresponding "*_missing" mask set, malformed numbers are NaN.
 
-    # Step 4: Validate images
-    image_ids_seen = set()
-    for i, image in enumerate(images):
-        image_id = image.get('id')
-        file_name = image.get('file_name')
+    Args:
+        coco_file_path (str): Path to the COCO JSON file.
 
-        if image_id is None:
-            issues.append(f"Image {i}: Missing 'id' field.")
+    Returns:
+        dict: Section -> dict of column name -> np.ndarray.
+    """
+    coco_data = None
+    if ijson is None:
+        print("Warning: ijson is not installed, the whole COCO file is loaded into memory.")
+        with open(coco_file_path, 'r') as f:
+            coco_data = json.load(f)
 
-        if image_id in image_ids_seen:
-            issues.append(f"Image {i}: Duplicate image ID '{image_id}'.")
+    raw = {"images": {"id": [], "file_name_valid": [], "width": [], "height": []},
+           "categories": {"id": [], "name_valid": []},
+           "annotations": {"id": [], "image_id": [], "category_id": [], "bbox": [], "area": [],
+                           "has_segmentation": []}}
+    for section, entry in _entries(coco_file_path, coco_data):
+        values = raw[section]
+        values["id"].append(_as_int(entry.get('id')))
+        if section == "images":
+            values["file_name_valid"].append(isinstance(entry.get('file_name'), str) and len(entry['file_name']) > 0)
+            values["width"].append(_as_float(entry.get('width')))
+            values["height"].append(_as_float(entry.get('height')))
+        elif section == "categories":
+            values["name_valid"].append(isinstance(entry.get('name'), str) and len(entry['name']) > 0)
         else:
-            image_ids_seen.add(image_id)
+            values["image_id"].append(_as_int(entry.get('image_id')))
+            values["category_id"].append(_as_int(entry.get('category_id')))
+            bbox = entry.get('bbox')
+            values["bbox"].append([_as_float(x) for x in bbox] if isinstance(bbox, list) and len(bbox) == 4
+                                  else [np.nan] * 4)
+            values["area"].append(_as_float(entry.get('area')))
+            values["has_segmentation"].append(bool(entry.get('segmentation')))
+
+    columns = {}
+    for section in SECTIONS:
+        columns[section] = {}
+        for key, values in raw[section].items():
+            if key in ("id", "image_id", "category_id"):
+                missing = np.array([value is None for value in values], dtype=bool)
+                columns[section][key] = np.array([-1 if value is None else value for value in values], dtype=np.int64)
+                columns[section][f"{key}_missing"] = missing
+            elif key == "bbox":
+                columns[section][key] = np.array(values, dtype=np.float64).reshape(-1, 4)
+            elif key in ("file_name_valid", "name_valid", "has_segmentation"):
+                columns[section][key] = np.array(values, dtype=bool)
+            else:
+                columns[section][key] = np.array(values, dtype=np.float64)
+    return columns
+
+
+def _duplicated(ids, missing):
+    """Mask of the entries whose (present) id already appeared before."""
+    duplicated = np.zeros(len(ids), dtype=bool)
+    present = np.flatnonzero(~missing)
+    _, first = np.unique(ids[present], return_index=True)
+    duplicated[present] = True
+    duplicated[present[first]] = False
+    return duplicated
+
+
+def check_columns(columns, bounds_tolerance=1.0, area_tolerance=0.01):
+    """
+    Runs all checks on the columnar COCO data.
 
-        if not isinstance(file_name, str) or len(file_name) == 0:
-            issues.append(f"Image {i}: 'file_name' is missing or empty.")
+    Args:
+        columns (dict): Output of load_columns().
+        bounds_tolerance (float): Pixels a box may extend beyond the image before it counts as out of bounds.
+        area_tolerance (float): Relative difference between "area" and the box area that is still consistent.
 
-    # Step 5: Validate categories
-    category_ids_seen = set()
-    for i, category in enumerate(categories):
-        category_id = category.get('id')
-        category_name = category.get('name')
+    Returns:
+        dict: Issue name -> (section, mask of the offending entries).
+    """
+    images, categories, annotations = columns["images"], columns["categories"], columns["annotations"]
+    issues = {
+        "image_missing_id": ("images", images["id_missing"]),
+        "image_duplicate_id": ("images", _duplicated(images["id"], images["id_missing"])),
+        "image_missing_file_name": ("images", ~images["file_name_valid"]),
+        "image_invalid_size": ("images", ~(images["width"] > 0) | ~(images["height"] > 0)),
+        "category_missing_id": ("categories", categories["id_missing"]),
+        "category_duplicate_id": ("categories", _duplicated(categories["id"], categories["id_missing"])),
+        "category_missing_name": ("categories", ~categories["name_valid"]),
+        "annotation_missing_id": ("annotations", annotations["id_missing"]),
+        "annotation_duplicate_id": ("annotations", _duplicated(annotations["id"], annotations["id_missing"])),
+    }
+
+    # Referential integrity
+    image_ids = images["id"][~images["id_missing"]]
+    issues["annotation_unknown_image"] = ("annotations", annotations["image_id_missing"] |
+                                          ~np.isin(annotations["image_id"], image_ids))
+    issues["annotation_unknown_category"] = ("annotations", annotations["category_id_missing"] |
+                                             ~np.isin(annotations["category_id"],
+                                                      categories["id"][~categories["id_missing"]]))
+
+    # Boxes, checked against the size of their image (the first image with the id)
+    bbox = annotations["bbox"]
+    x, y, w, h = bbox.T
+    invalid_bbox = np.isnan(bbox).any(axis=1)
+    issues["annotation_invalid_bbox"] = ("annotations", invalid_bbox)
+    issues["annotation_degenerate_bbox"] = ("annotations", ~invalid_bbox & ((w <= 0) | (h <= 0)))
+
+    unique_ids, first = np.unique(image_ids, return_index=True)
+    present = np.flatnonzero(~images["id_missing"])
+    width = np.full(len(x), np.nan)
+    height = np.full(len(x), np.nan)
+    if len(unique_ids):
+        position = np.clip(np.searchsorted(unique_ids, annotations["image_id"]), 0, len(unique_ids) - 1)
+        known = unique_ids[position] == annotations["image_id"]
+        width[known] = images["width"][present[first[position[known]]]]
+        height[known] = images["height"][present[first[position[known]]]]
+    with np.errstate(invalid='ignore'):
+        out_of_bounds = ((x < -bounds_tolerance) | (y < -bounds_tolerance) |
+                         (x + w > width + bounds_tolerance) | (y + h > height + bounds_tolerance))
+    issues["annotation_out_of_bounds"] = ("annotations", ~invalid_bbox & out_of_bounds)
+
+    # Area: equal to the box area, or at most the box area for segmentations (polygons lie inside their box)
+    area = annotations["area"]
+    box_area = w * h
+    with np.errstate(invalid='ignore'):
+        too_large = area > box_area * (1 + area_tolerance) + 1e-6
+        mismatch = np.abs(area - box_area) > box_area * area_tolerance + 1e-6
+        inconsistent = np.isnan(area) | (area < 0) | np.where(annotations["has_segmentation"], too_large, mismatch)
+    issues["annotation_area_inconsistent"] = ("annotations", ~invalid_bbox & inconsistent)
+    return issues
+
+
+def validate_coco_file(coco_file_path, log_path=None, sample_size=10, bounds_tolerance=1.0, area_tolerance=0.01):
+    """
+    Validate a COCO file: id uniqueness, references of annotations to images and categories, boxes
+    (malformed, degenerate, out of the image bounds) and areas. All checks run on columnar arrays.
 
-        if category_id is None:
-            issues.append(f"Category {i}: Missing 'id' field.")
+    Args:
+        coco_file_path (str): Path to the COCO JSON file to validate.
+        log_path (str, optional): If provided, the JSON report is written to this file.
+        sample_size (int): Number of offenders listed per issue.
+        bounds_tolerance (float): Pixels a box may extend beyond the image.
+        area_tolerance (float): Allowed relative difference of "area" and the box area.
 
-        if category_id in category_ids_seen:
-            issues.append(f"Category {i}: Duplicate category ID '{category_id}'.")
-        else:
-            category_ids_seen.add(category_id)
-
-        if not isinstance(category_name, str) or len(category_name) == 0:
-            issues.append(f"Category {i}: 'name' is missing or empty.")
-
-    # Step 6: Print results
-    if issues:
-        print(f"Validation failed with {len(issues)} issues found.")
-        for issue in issues:
-            print(f"- {issue}")
-
-        # Optionally, write issues to log file
-        if log_path:
-            with open(log_path, 'w') as log_file:
-                log_file.write("\n".join(issues))
-            print(f"Issues have been logged to: {log_path}")
-    else:
+    Returns:
+        dict | None: The report (counts, issues with their count and a sample of offenders, "valid"),
+            None if the file can not be loaded.
+    """
+    try:
+        columns = load_columns(coco_file_path)
+    except Exception as e:
+        print(f"Error: Failed to load COCO file. {e}")
+        return None
+
+    issues = check_columns(columns, bounds_tolerance, area_tolerance)
+    report = {
+        "file": coco_file_path,
+        "counts": {section: len(columns[section]["id"]) for section in ("images", "annotations", "categories")},
+        "issues": {},
+    }
+    for name, (section, mask) in issues.items():
+        offenders = np.flatnonzero(mask)
+        if not len(offenders):
+            continue
+        sample = [{"index": int(i), "id": None if columns[section]["id_missing"][i] else int(columns[section]["id"][i])}
+                  for i in offenders[:sample_size]]
+        if section == "annotations":
+            for entry in sample:
+                entry["bbox"] = [None if np.isnan(v) else v for v in columns[section]["bbox"][entry["index"]].tolist()]
+        report["issues"][name] = {"count": int(len(offenders)), "sample": sample}
+    report["valid"] = not report["issues"]
+
+    print(f"Total images: {report['counts']['images']}")
+    print(f"Total annotations: {report['counts']['annotations']}")
+    print(f"Total categories: {report['counts']['categories']}")
+    if report["valid"]:
         print("Validation Passed! The COCO file is valid.")
+    else:
+        print(f"Validation failed with {sum(issue['count'] for issue in report['issues'].values())} issues found.")
+        for name, issue in report["issues"].items():
+            print(f"- {name}: {issue['count']}")
 
+    if log_path:
+        with open(log_path, 'w') as log_file:
+            json.dump(report, log_file, indent=1)
+        print(f"Report has been written to: {log_path}")
+    return report
 
-if __name__ == "__main__":
-    # Path to the COCO file
-    coco_file_path = "/home/petr/Documents/SU2_project/project/coco_dataset1/annotations/clip_results.json"
 
-    # Optional log file to store issues
-
-    # Validate the COCO file
-    validate_coco_file(coco_file_path)
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Validate a COCO file, exits with 1 if it is invalid.")
+    parser.add_argument("coco_file", help="Path to the COCO JSON file.")
+    parser.add_argument("--report", help="Write the JSON report to this file.")
+    parser.add_argument("--sample", type=int, default=10, help="Offenders listed per issue.")
+    parser.add_argument("--bounds-tolerance", type=float, default=1.0)
+    parser.add_argument("--area-tolerance", type=float, default=0.01)
+    args = parser.parse_args()
+
+    report = validate_coco_file(args.coco_file, args.report, args.sample, args.bounds_tolerance, args.area_tolerance)
+    sys.exit(0 if report is not None and report["valid"] else 1)
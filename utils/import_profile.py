@@ -0,0 +1,44 @@
+import argparse
+import subprocess
+import sys
+
+
+def import_profile(module: str, top: int = 20) -> list:
+    """
+    Measures how long importing a module takes, using the interpreter's -X importtime report.
+    The import runs in a fresh interpreter, so nothing is cached from the current process.
+
+    Args:
+        module (str): The module to import, e.g. "project.app".
+        top (int): Number of slowest imports to print.
+
+    Returns:
+        list: (cumulative microseconds, self microseconds, module name) of all imports, slowest first.
+    """
+    completed = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                               capture_output=True, text=True)
+    if completed.returncode != 0:
+        print(completed.stderr.splitlines()[-1] if completed.stderr else "Import failed.")
+    imports = []
+    for line in completed.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        imports.append((int(cumulative_us), int(self_us), name.rstrip()))
+    imports.sort(reverse=True)
+
+    total = next((cumulative for cumulative, _, name in imports if name.strip() == module), None)
+    if total is not None:
+        print(f"Importing {module} takes {total / 1e6:.3f} s")
+    print(f"{'cumulative s':>12} {'self s':>8}  module")
+    for cumulative, self_time, name in imports[:top]:
+        print(f"{cumulative / 1e6:12.3f} {self_time / 1e6:8.3f}  {name}")
+    return imports
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Show which imports make a module slow to import.")
+    parser.add_argument("module", nargs="?", default="project.app")
+    parser.add_argument("--top", type=int, default=20)
+    args = parser.parse_args()
+    import_profile(args.module, args.top)
@@ -1,8 +1,10 @@
 import os
 import shutil
 
+from project.classification_pipeline.image_dataset_preprocessing.dedup_index import build_dedup_plan
 
-def merge_image_folders(folder1, folder2, output_folder):
+
+def merge_image_folders(folder1, folder2, output_folder, dedup_distance=None):
     """
     Merges two image folders into a single output folder.
 
@@ -14,10 +16,18 @@ def merge_image_folders(folder1, folder2, output_folder):
         Path to the second folder containing images.
     output_folder : str
         Path to the output folder where merged images will be saved.
+    dedup_distance : int | None
+        If set, duplicate images are left out (the copy from folder1 is kept): byte-identical ones and
+        ones whose perceptual hashes differ in at most this many bits. 0 only drops exact duplicates.
     """
     # Create the output folder if it doesn't exist
     os.makedirs(output_folder, exist_ok=True)
 
+    dropped_images = {}
+    if dedup_distance is not None:
+        dropped_images = build_dedup_plan([folder1, folder2], os.path.join(output_folder, ".dedup_index.json"),
+                                          dedup_distance)["drop"]
+
     # Get a list of all images in the output folder to avoid duplicates
     existing_files = set(os.listdir(output_folder))
     unique_id = 0  # To ensure unique filenames in case of collision
@@ -38,6 +48,10 @@ def merge_image_folders(folder1, folder2, output_folder):
             if file_ext not in ['.jpg', '.jpeg', '.png', '.bmp', '.gif', '.tiff']:  # Check for image file types
                 continue
 
+            if os.path.abspath(src_path) in dropped_images:
+                print(f"Skipped duplicate: {src_path} of {dropped_images[os.path.abspath(src_path)]}")
+                continue
+
             # Check for file name collision
             if file_name in existing_files:
                 # Rename the file with a unique identifier